@@ -5,33 +5,136 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+import os
+import threading
+from datetime import datetime
+
 from flask import Flask
-from database import init_database, add_sample_data
+from flask.json.provider import DefaultJSONProvider
+import database
+from database import (
+    init_database, add_sample_data, configure_storage, configure_book_cache, configure_search_cache,
+    backfill_loan_epochs, get_loan_epoch_status, warm_suggest_index,
+)
+from records import Record
+from services import payment_service
+from services.payment_service import configure_payment_gateway
+from services.overdue_service import OverdueScheduler
+from services.job_service import JOB_WORKER_THREADS, JobWorker
 from routes import register_blueprints
+from cli import register_commands
+
+
+class LibraryJSONProvider(DefaultJSONProvider):
+    """JSON provider that also encodes Book and Loan records."""
 
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_json()
+        return DefaultJSONProvider.default(o)
 
-def create_app():
+
+def create_app(config=None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: Optional mapping of settings. Storage is configured through
+            DATABASE (file path), DB_PROFILE ('safe', 'throughput' or 'legacy')
+            and DB_PRAGMAS (per-PRAGMA overrides). Defaults come from the
+            LIBRARY_DATABASE and LIBRARY_DB_PROFILE environment variables.
+            The book lookup cache is set by BOOK_CACHE ('full', 'metadata'
+            or 'off'; default from LIBRARY_BOOK_CACHE), BOOK_CACHE_SIZE and
+            BOOK_CACHE_TTL (seconds). SEARCH_CACHE_BYTES is the memory budget
+            of the search result cache. SUGGEST_WARMUP=False builds the
+            typeahead index on the first /api/suggest call instead of in a
+            background thread at startup. CACHE_CONTROL maps endpoint names
+            to Cache-Control values replacing the defaults of the
+            conditionally cached pages (see routes.http_cache).
+            LOAN_EPOCH_BACKFILL=False skips starting the background backfill
+            of loan epoch columns (run `flask backfill-loan-epochs` instead).
+            OVERDUE_JOB_AT ('HH:MM', local time) schedules the nightly overdue
+            snapshot and fee accrual in-process; None (the default) leaves it
+            to `flask overdue run` from cron.
+            PAYMENT_GATEWAY_URL (default from LIBRARY_PAYMENT_URL) switches
+            payments from the simulated gateway to the pooled HTTP client,
+            with PAYMENT_API_KEY, PAYMENT_MAX_CONCURRENCY (calls in flight)
+            and PAYMENT_TIMEOUT ((connect, read) seconds).
+            JOB_WORKERS is the number of threads running queued payment and
+            refund jobs in this process. It defaults to 0, leaving them to
+            `flask jobs worker`: only a long-running server should set it,
+            never a process that builds the app for a CLI command and exits
+            while a worker may be half way through a gateway call.
+            SAMPLE_DATA=False skips seeding an empty catalog.
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    app.json = LibraryJSONProvider(app)
+    app.config.from_mapping(
+        DATABASE=database.DATABASE,
+        DB_PROFILE=database.STORAGE_PROFILE,
+        DB_PRAGMAS={},
+        BOOK_CACHE=database.BOOK_CACHE_MODE,
+        BOOK_CACHE_SIZE=database.BOOK_CACHE_SIZE,
+        BOOK_CACHE_TTL=database.BOOK_CACHE_TTL,
+        SEARCH_CACHE_BYTES=database.SEARCH_CACHE_BYTES,
+        SUGGEST_WARMUP=True,
+        LOAN_EPOCH_BACKFILL=True,
+        OVERDUE_JOB_AT=None,
+        PAYMENT_GATEWAY_URL=payment_service.PAYMENT_GATEWAY_URL,
+        PAYMENT_API_KEY=payment_service.PAYMENT_API_KEY,
+        PAYMENT_MAX_CONCURRENCY=payment_service.PAYMENT_MAX_CONCURRENCY,
+        PAYMENT_TIMEOUT=payment_service.PAYMENT_TIMEOUT,
+        JOB_WORKERS=0,
+        SAMPLE_DATA=True,
+    )
+    if config:
+        app.config.update(config)
+    
+    # Configure the storage layer before anything opens a connection
+    configure_storage(app.config['DB_PROFILE'], database=app.config['DATABASE'], **app.config['DB_PRAGMAS'])
+    configure_book_cache(app.config['BOOK_CACHE'], app.config['BOOK_CACHE_SIZE'], app.config['BOOK_CACHE_TTL'])
+    configure_search_cache(app.config['SEARCH_CACHE_BYTES'])
+    configure_payment_gateway(app.config['PAYMENT_GATEWAY_URL'], app.config['PAYMENT_API_KEY'],
+                              app.config['PAYMENT_MAX_CONCURRENCY'], app.config['PAYMENT_TIMEOUT'])
     
     # Initialize the database
     init_database()
     
+    # Fill epoch columns of loans from before migration 7 without holding up startup
+    if app.config['LOAN_EPOCH_BACKFILL'] and not get_loan_epoch_status()['ready']:
+        threading.Thread(target=backfill_loan_epochs, name='loan-epoch-backfill', daemon=True).start()
+    
+    if app.config['OVERDUE_JOB_AT']:
+        at = datetime.strptime(app.config['OVERDUE_JOB_AT'], '%H:%M').time()
+        app.extensions['overdue_scheduler'] = OverdueScheduler(at).start()
+    
+    if app.config['JOB_WORKERS']:
+        app.extensions['job_worker'] = JobWorker(app.config['JOB_WORKERS']).start()
+    
     # Add sample data for testing and demonstration
-    add_sample_data()
+    if app.config['SAMPLE_DATA']:
+        add_sample_data()
+    
+    # Build the typeahead index off the request path
+    if app.config['SUGGEST_WARMUP']:
+        threading.Thread(target=warm_suggest_index, name='suggest-index-warmup', daemon=True).start()
     
     # Register all route blueprints
     register_blueprints(app)
     
+    # Register CLI commands (flask --app app <command>)
+    register_commands(app)
+    
     return app
 
 
 if __name__ == '__main__':
-    app = create_app()
+    # The debug reloader's parent only watches files; the child serves
+    serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    app = create_app({'JOB_WORKERS': JOB_WORKER_THREADS if serving else 0})
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,58 @@
+"""
+Fee engine benchmark: per-loan Python fee calculation (fromisoformat plus
+_fee_for_days, as the status report does) against the batch fee engine's
+pure-Python and NumPy backends.
+
+Usage:
+    python -m benchmarks.bench_fee_engine [--loans 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import fee_engine  # noqa: E402
+from services.library_service import _fee_for_days  # noqa: E402
+
+
+def per_row(due_dates, as_of):
+    fees = []
+    for due in due_dates:
+        days = max(0, (as_of - datetime.fromisoformat(due)).days)
+        fees.append(_fee_for_days(days))
+    return fees
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--loans', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    as_of = datetime(2024, 6, 1)
+    due_dates = [(as_of - timedelta(seconds=rng.randint(-30 * 86400, 60 * 86400),
+                                     microseconds=rng.randint(0, 999999))).isoformat()
+                 for _ in range(args.loans)]
+
+    runs = [('per-row loop', lambda: per_row(due_dates, as_of)),
+            ('engine (python)', lambda: fee_engine.fees_for_due_dates(due_dates, as_of, use_numpy=False)[1])]
+    if fee_engine.has_numpy():
+        runs.append(('engine (numpy)', lambda: fee_engine.fees_for_due_dates(due_dates, as_of, use_numpy=True)[1]))
+
+    baseline = None
+    for name, fn in runs:
+        start = time.perf_counter()
+        fees = fn()
+        elapsed = time.perf_counter() - start
+        baseline = baseline or fees
+        assert fees == baseline, f'{name} disagrees with the per-row loop'
+        print(f'{name:<16} {elapsed:8.3f}s  {args.loans / elapsed:>12,.0f} loans/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Late-fee settlement benchmark: wall-clock latency for a patron to pay all
+their late fees, one pay_late_fees() charge per book versus a single
+pay_all_late_fees() charge, against the stub gateway (run in its own
+process) with a fixed latency per request.
+
+Usage:
+    python -m benchmarks.bench_fee_settlement [--patrons 50] [--books 5] [--latency 0.05]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from benchmarks.bench_payments import _start_stub  # noqa: E402
+from services.library_service import pay_all_late_fees, pay_late_fees  # noqa: E402
+from services.payment_service import HTTPPaymentGateway  # noqa: E402
+
+
+def _seed(patrons, books):
+    """Each patron has books open loans, 1 to books days overdue."""
+    db.configure_storage('throughput', database=os.path.join(tempfile.mkdtemp(), 'bench_settlement.db'))
+    db.init_database()
+    db.insert_books_bulk([(f'Late Title {i}', f'Author {i}', f'{9700000000000 + i}', patrons) for i in range(books)])
+    now = datetime.now()
+    rows = []
+    for p in range(2 * patrons):
+        for b in range(books):
+            due = now - timedelta(days=b + 1, hours=1)
+            rows.append((f'{300000 + p}', b + 1, (due - timedelta(days=14)).isoformat(), due.isoformat()))
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)
+        ''', rows)
+
+
+def _timed(calls):
+    latencies = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _print(label, latencies, requests):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{label:<22} median {statistics.median(latencies):>8.1f} ms  p95 {p95:>8.1f} ms  '
+          f'{requests:>5} gateway requests')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--patrons', type=int, default=50)
+    parser.add_argument('--books', type=int, default=5, help='Overdue books per patron.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stub gateway latency per request (seconds).')
+    args = parser.parse_args()
+
+    _seed(args.patrons, args.books)
+    stub, url = _start_stub(args.latency)
+    gateway = HTTPPaymentGateway(url)
+    print(f'{args.patrons} patrons x {args.books} overdue books, gateway latency {args.latency * 1000:.0f} ms')
+    try:
+        def per_book(patron_id):
+            for book_id in range(1, args.books + 1):
+                ok, msg, _ = pay_late_fees(patron_id, book_id, gateway)
+                assert ok, msg
+
+        def batch(patron_id):
+            result = pay_all_late_fees(patron_id, gateway)
+            assert result['status'] == 'paid' and len(result['items']) == args.books, result
+
+        patrons = [f'{300000 + p}' for p in range(2 * args.patrons)]
+        _print('per book', _timed(lambda p=p: per_book(p) for p in patrons[:args.patrons]),
+               args.patrons * args.books)
+        _print('pay_all_late_fees', _timed(lambda p=p: batch(p) for p in patrons[args.patrons:]), args.patrons)
+    finally:
+        gateway.close()
+        stub.terminate()
+        stub.wait()
+        db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
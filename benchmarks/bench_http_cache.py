@@ -0,0 +1,60 @@
+"""
+Conditional GET benchmark: full responses against 304 Not Modified
+revalidations for the catalog page, the catalog and search APIs and
+suggestions, through the Flask test client on a large catalog.
+
+Usage:
+    python -m benchmarks.bench_http_cache [--books 200000] [--requests 500]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from app import create_app  # noqa: E402
+
+URLS = ('/catalog', '/api/books?limit=100', '/api/search?q=title 1&limit=50', '/api/suggest?q=tit')
+
+
+def _time(client, url, requests, headers=None):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=200_000)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_http_cache.db')
+    app = create_app({'DATABASE': path, 'DB_PROFILE': 'throughput', 'SAMPLE_DATA': False,
+                      'LOAN_EPOCH_BACKFILL': False, 'SUGGEST_WARMUP': False, 'JOB_WORKERS': 0})
+    db.insert_books_bulk([(f'Title {i}', f'Author {i % 997}', f'{9700000000000 + i}', 2)
+                          for i in range(args.books)])
+    client = app.test_client()
+    print(f'{args.books:,} books, median of {args.requests} requests')
+    print(f'{"url":<34} {"200":>10} {"bytes":>8} {"304":>10}')
+    try:
+        for url in URLS:
+            client.get(url)  # build indexes, fill the search cache
+            full_ms, response = _time(client, url, args.requests)
+            revalidate_ms, not_modified = _time(client, url, args.requests, {'If-None-Match': response.headers['ETag']})
+            assert not_modified.status_code == 304, url
+            print(f'{url:<34} {full_ms:>7.3f} ms {len(response.data):>8,} {revalidate_ms:>7.3f} ms')
+    finally:
+        db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Job queue benchmark: how long a late-fee payment request holds an HTTP
+worker as the gateway slows down. Paying inside the request (what the
+synchronous endpoint did) takes as long as the gateway does; queueing the
+payment returns at once while JobWorker threads make the gateway calls.
+Runs against the stub gateway (in its own process) at several latencies,
+and reports how long the workers took to drain the queue.
+
+Usage:
+    python -m benchmarks.bench_job_queue [--patrons 20] [--latencies 0,0.1,0.5,1.0] [--workers 8]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from app import create_app  # noqa: E402
+from benchmarks.bench_payments import _start_stub  # noqa: E402
+from services import payment_service  # noqa: E402
+from services.library_service import pay_all_late_fees  # noqa: E402
+
+
+def _seed(patrons):
+    """2 * patrons patrons with one book 3 days overdue each; returns the database path."""
+    path = os.path.join(tempfile.mkdtemp(), 'bench_jobs.db')
+    db.configure_storage('throughput', database=path)
+    db.init_database()
+    db.insert_books_bulk([('Queued Title', 'Author', '9800000000000', 2 * patrons)])
+    due = datetime.now() - timedelta(days=3, hours=1)
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) VALUES (?, 1, ?, ?)
+        ''', [(f'{400000 + p}', (due - timedelta(days=14)).isoformat(), due.isoformat()) for p in range(2 * patrons)])
+    return path
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def _run(latency, patrons, workers):
+    path = _seed(patrons)
+    stub, url = _start_stub(latency)
+    app = create_app({'DATABASE': path, 'SAMPLE_DATA': False, 'LOAN_EPOCH_BACKFILL': False,
+                      'PAYMENT_GATEWAY_URL': url, 'JOB_WORKERS': workers})
+    client = app.test_client()
+    try:
+        inline = []
+        for p in range(patrons):
+            start = time.perf_counter()
+            assert pay_all_late_fees(f'{400000 + p}')['status'] == 'paid'
+            inline.append((time.perf_counter() - start) * 1000)
+
+        queued, urls = [], []
+        drain_start = time.perf_counter()
+        for p in range(patrons, 2 * patrons):
+            start = time.perf_counter()
+            response = client.post(f'/api/patron/{400000 + p}/fees/pay')
+            queued.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 202, response.get_json()
+            urls.append(response.headers['Location'])
+        for status_url in urls:
+            job = client.get(f'{status_url}?wait=30').get_json()
+            assert job['status'] == 'succeeded' and job['result']['status'] == 'paid', job
+        drain = time.perf_counter() - drain_start
+    finally:
+        app.extensions['job_worker'].stop(timeout=5)
+        payment_service.configure_payment_gateway(None)
+        stub.terminate()
+        stub.wait()
+        db.close_all_connections()
+    return inline, queued, drain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--patrons', type=int, default=20, help='Payment requests per mode and latency.')
+    parser.add_argument('--latencies', default='0,0.1,0.5,1.0', help='Stub gateway latencies (seconds).')
+    parser.add_argument('--workers', type=int, default=8, help='JobWorker threads.')
+    args = parser.parse_args()
+
+    print(f'{args.patrons} payment requests per mode, {args.workers} job worker threads')
+    print(f'{"gateway":>8}  {"paid in request (median / p95)":>32}  {"queued (median / p95)":>24}  {"queue drained":>14}')
+    for latency in (float(value) for value in args.latencies.split(',')):
+        inline, queued, drain = _run(latency, args.patrons, args.workers)
+        print(f'{latency * 1000:>6.0f} ms  {"%8.1f / %8.1f ms" % _percentiles(inline):>32}  '
+              f'{"%6.1f / %6.1f ms" % _percentiles(queued):>24}  {drain:>11.2f} s')
+
+
+if __name__ == '__main__':
+    main()
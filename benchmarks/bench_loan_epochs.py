@@ -0,0 +1,93 @@
+"""
+Loan epoch benchmark: backfill throughput for loans written before the
+epoch columns existed, then "open loans overdue as of T" answered by
+parsing every open loan's due_date (the path used until the backfill
+finishes) against the due_ts index range scan.
+
+Usage:
+    python -m benchmarks.bench_loan_epochs [--loans 200000] [--overdue 0.05] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from services.library_service import calculate_outstanding_fees  # noqa: E402
+
+AS_OF = datetime(2024, 6, 1, 12, 0)
+
+
+def _seed(loans, overdue):
+    """A schema-6 database full of open loans, then migrated to the latest version."""
+    db.configure_storage('throughput', database=os.path.join(tempfile.mkdtemp(), 'bench_epochs.db'))
+    db.migrate(target=6)
+    db.insert_books_bulk([(f'Epoch Title {i}', f'Author {i}', f'{9700000000000 + i}', 5) for i in range(1000)])
+    rng = random.Random(7)
+    rows = []
+    for i in range(loans):
+        late = rng.random() < overdue
+        due = AS_OF + timedelta(seconds=rng.randint(-40 * 86400, -86400) if late else rng.randint(1, 14 * 86400),
+                                microseconds=rng.randint(0, 999999))
+        rows.append((f'{100000 + i % 20000}', 1 + i % 1000, (due - timedelta(days=14)).isoformat(), due.isoformat()))
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)
+        ''', rows)
+    db.migrate()
+
+
+def _timed(fn, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _scan_overdue():
+    return [loan['id'] for loan in db.iter_overdue_loans(AS_OF)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--loans', type=int, default=200000)
+    parser.add_argument('--overdue', type=float, default=0.05, help='Fraction of open loans that are overdue.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    _seed(args.loans, args.overdue)
+    print(f'{args.loans} open loans, {args.overdue:.0%} overdue as of {AS_OF.isoformat()}')
+
+    text_seconds, text_ids = _timed(_scan_overdue, args.repeat)
+    text_fees_seconds, text_fees = _timed(lambda: calculate_outstanding_fees(AS_OF), args.repeat)
+
+    start = time.perf_counter()
+    report = db.backfill_loan_epochs()
+    elapsed = time.perf_counter() - start
+    print(f'backfill:                    {elapsed * 1000:>9.1f} ms  '
+          f'({report["updated"] / elapsed:,.0f} loans/s, {report["unparsed"]} unparsed)')
+
+    index_seconds, index_ids = _timed(_scan_overdue, args.repeat)
+    index_fees_seconds, index_fees = _timed(lambda: calculate_outstanding_fees(AS_OF), args.repeat)
+    assert sorted(index_ids) == sorted(text_ids), 'index scan disagrees with the text scan'
+    assert index_fees == text_fees, 'outstanding fees changed'
+
+    print(f'overdue loans, parse text:   {text_seconds * 1000:>9.1f} ms  ({len(text_ids)} loans)')
+    print(f'overdue loans, due_ts index: {index_seconds * 1000:>9.1f} ms  '
+          f'({text_seconds / index_seconds:.1f}x)')
+    print(f'outstanding fees, text:      {text_fees_seconds * 1000:>9.1f} ms')
+    print(f'outstanding fees, index:     {index_fees_seconds * 1000:>9.1f} ms  '
+          f'({text_fees_seconds / index_fees_seconds:.1f}x)')
+    db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
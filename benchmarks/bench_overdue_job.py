@@ -0,0 +1,67 @@
+"""
+Overdue job benchmark: the nightly overdue snapshot over a large loan table,
+in loans per second, for a few chunk sizes, plus a run interrupted halfway
+and resumed from its checkpoint.
+
+Usage:
+    python -m benchmarks.bench_overdue_job [--loans 500000] [--overdue 0.2]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from services.overdue_service import run_overdue_job  # noqa: E402
+
+AS_OF = datetime(2024, 6, 1, 2, 0)
+
+
+def _seed(loans, overdue):
+    db.configure_storage('throughput', database=os.path.join(tempfile.mkdtemp(), 'bench_overdue.db'))
+    db.init_database()
+    db.insert_books_bulk([(f'Overdue Title {i}', f'Author {i}', f'{9800000000000 + i}', 5) for i in range(1000)])
+    rng = random.Random(11)
+    rows = []
+    for i in range(loans):
+        late = rng.random() < overdue
+        due = AS_OF + timedelta(seconds=rng.randint(-60 * 86400, -1) if late else rng.randint(1, 14 * 86400),
+                                microseconds=rng.randint(0, 999999))
+        rows.append((f'{100000 + i % 50000}', 1 + i % 1000, (due - timedelta(days=14)).isoformat(), due.isoformat()))
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)
+        ''', rows)
+
+
+def _print(label, report):
+    print(f'{label:<24} {report["loans"]:>8} loans  {report["elapsed_seconds"] * 1000:>9.1f} ms  '
+          f'{report["loans_per_second"]:>10,} loans/s  ({report["chunks"]} chunks, ${report["total_fees"]:,.2f})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--loans', type=int, default=500000)
+    parser.add_argument('--overdue', type=float, default=0.2, help='Fraction of open loans that are overdue.')
+    args = parser.parse_args()
+
+    _seed(args.loans, args.overdue)
+    print(f'{args.loans} open loans, {args.overdue:.0%} overdue as of {AS_OF.isoformat()}')
+
+    for chunk_size in (500, 2000, 10000):
+        report = run_overdue_job(AS_OF, chunk_size, resume=False, accrue=False)
+        _print(f'chunk size {chunk_size}', report)
+
+    partial = run_overdue_job(AS_OF, 2000, resume=False, accrue=False, max_chunks=max(1, int(args.loans * args.overdue) // 2000 // 2))
+    _print('interrupted', partial)
+    _print('resumed', run_overdue_job(AS_OF, 2000, accrue=False))
+    db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Patron history benchmark: status report and history paging for a synthetic
+patron with a long borrowing history, compared with building the whole
+history in one response, plus the streaming JSON export.
+
+Usage:
+    python -m benchmarks.bench_patron_history [--loans 50000] [--page-size 20] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from services.export_service import export_patron_history  # noqa: E402
+from services.library_service import (  # noqa: E402
+    build_history_items, get_patron_history, get_patron_status_report,
+)
+
+PATRON = '424242'
+
+
+def _seed(loans):
+    db.configure_storage('throughput', database=os.path.join(tempfile.mkdtemp(), 'bench_history.db'))
+    db.init_database()
+    db.insert_books_bulk([(f'History Title {i}', f'Author {i}', f'{9500000000000 + i}', 3) for i in range(500)])
+    start = datetime.now() - timedelta(days=loans // 10 + 30)
+    rows = []
+    for i in range(loans):
+        borrowed = start + timedelta(minutes=144 * i)
+        returned = borrowed + timedelta(days=10 + i % 9)
+        rows.append((PATRON, 1 + i % 500, borrowed.isoformat(), (borrowed + timedelta(days=14)).isoformat(),
+                     returned.isoformat()))
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+    db.analyze_database()
+
+
+def _timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _full_history():
+    """The whole history in one response, as the report used to build it."""
+    now = datetime.now()
+    items = build_history_items(list(db.iter_patron_history(PATRON)), now)
+    return json.dumps({'patron_id': PATRON, 'history': items})
+
+
+def _page_through(page_size):
+    pages, cursor = 0, None
+    while True:
+        page = get_patron_history(PATRON, cursor=cursor, limit=page_size)
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--loans', type=int, default=50000)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    _seed(args.loans)
+    print(f'patron {PATRON} with {args.loans} loans')
+
+    seconds, body = _timed(lambda: json.dumps(get_patron_status_report(PATRON, args.page_size)), args.repeat)
+    print(f'status report (first page): {seconds * 1000:>9.2f} ms  {len(body):>11,} bytes')
+
+    cursor = get_patron_history(PATRON, limit=args.page_size)['next_cursor']
+    seconds, _ = _timed(lambda: get_patron_history(PATRON, cursor=cursor, limit=args.page_size), args.repeat)
+    print(f'history page (cursor):      {seconds * 1000:>9.2f} ms')
+
+    seconds, body = _timed(_full_history, max(1, args.repeat // 10))
+    print(f'full history, one response: {seconds * 1000:>9.2f} ms  {len(body):>11,} bytes')
+
+    seconds, size = _timed(lambda: sum(len(chunk) for chunk in export_patron_history(PATRON)),
+                           max(1, args.repeat // 10))
+    print(f'streaming JSON export:      {seconds * 1000:>9.2f} ms  {size:>11,} bytes '
+          f'({args.loans / seconds:,.0f} loans/s)')
+
+    start = time.perf_counter()
+    pages = _page_through(100)
+    print(f'all pages of 100:           {(time.perf_counter() - start) * 1000:>9.2f} ms  ({pages} pages)')
+    db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Payment gateway benchmark against the local stub gateway (run in its own
+process, so it does not compete with the client for the GIL): payments per
+second for a client that opens a new connection per call (what a
+straightforward requests.post() client does) and for the pooled
+HTTPPaymentGateway at several concurrency limits, with the callers spread
+over a pool of threads the way Flask workers would be.
+
+Usage:
+    python -m benchmarks.bench_payments [--payments 2000] [--latency 0.01] [--threads 32]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.payment_service import PAYMENT_MAX_CONCURRENCY, HTTPPaymentGateway  # noqa: E402
+
+AUTH = {'Authorization': 'Bearer test_key_12345'}
+
+
+class UnpooledGateway:
+    """New connection per call, as a client calling requests.post() directly would make."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def process_payment(self, patron_id, amount, description=''):
+        response = requests.post(f'{self.base_url}/charges', timeout=(3.05, 10.0),
+                                 headers=AUTH,
+                                 json={'customer_id': patron_id, 'amount': amount, 'currency': 'usd',
+                                       'description': description})
+        return response.status_code == 200, response.json().get('id', ''), ''
+
+
+def _start_stub(latency):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.payment_stub', '--port', str(port),
+                                '--latency', str(latency)], cwd=ROOT, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{url}/_stats', headers=AUTH, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('payment stub did not start')
+
+
+def _connections(url):
+    return requests.get(f'{url}/_stats', headers=AUTH, timeout=1).json()['connections']
+
+
+def _run(url, gateway, payments, threads):
+    before = _connections(url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda i: gateway.process_payment(f'{100000 + i % 900000}', 2.5, 'bench'),
+                                range(payments)))
+    elapsed = time.perf_counter() - start
+    assert all(ok for ok, _, _ in results)
+    return payments / elapsed, _connections(url) - before - 1  # minus the _stats call's own connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--payments', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.01, help='Stub gateway latency per request (seconds).')
+    parser.add_argument('--threads', type=int, default=32, help='Caller threads.')
+    args = parser.parse_args()
+
+    stub, url = _start_stub(args.latency)
+    print(f'{args.payments} payments from {args.threads} threads, gateway latency {args.latency * 1000:.0f} ms')
+    try:
+        rate, conns = _run(url, UnpooledGateway(url), args.payments, args.threads)
+        print(f'{"new connection per call":<28} {rate:>9,.0f} payments/s  {conns:>6} connections')
+        for limit in sorted({1, PAYMENT_MAX_CONCURRENCY, args.threads}):
+            gateway = HTTPPaymentGateway(url, max_concurrency=limit)
+            rate, conns = _run(url, gateway, args.payments, args.threads)
+            gateway.close()
+            print(f'{f"pooled, {limit} in flight":<28} {rate:>9,.0f} payments/s  {conns:>6} connections')
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == '__main__':
+    main()
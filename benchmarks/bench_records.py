@@ -0,0 +1,117 @@
+"""
+Row representation benchmark: Book and Loan records built by a row_factory
+compared with the sqlite3.Row-to-dict conversion they replaced, for the
+whole catalog and for a patron with many open loans. Reports the time to
+fetch each result and the memory held by it.
+
+Usage:
+    python -m benchmarks.bench_records [--books 100000] [--loans 20000] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+
+PATRON = '515151'
+
+
+def _seed(books, loans):
+    db.configure_storage('throughput', database=os.path.join(tempfile.mkdtemp(), 'bench_records.db'))
+    db.init_database()
+    db.insert_books_bulk([(f'Record Title {i}', f'Author {i % 997}', f'{9600000000000 + i}', 3)
+                          for i in range(books)])
+    start = datetime.now() - timedelta(days=60)
+    rows = []
+    for i in range(loans):
+        borrowed = start + timedelta(minutes=i)
+        rows.append((PATRON, 1 + i % books, borrowed.isoformat(), (borrowed + timedelta(days=14)).isoformat()))
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, NULL)
+        ''', rows)
+    db.analyze_database()
+
+
+def _books_as_dicts():
+    conn = db.get_db_connection()
+    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
+    conn.close()
+    return [dict(book) for book in books]
+
+
+def _loans_as_dicts():
+    """The conversion get_patron_borrowed_books used to do."""
+    conn = db.get_db_connection()
+    records = conn.execute('''
+        SELECT br.*, b.title, b.author
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.patron_id = ? AND br.return_date IS NULL
+        ORDER BY br.borrow_date
+    ''', (PATRON,)).fetchall()
+    conn.close()
+    return [{
+        'book_id': record['book_id'],
+        'title': record['title'],
+        'author': record['author'],
+        'borrow_date': datetime.fromisoformat(record['borrow_date']),
+        'due_date': datetime.fromisoformat(record['due_date']),
+        'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date']),
+    } for record in records]
+
+
+def _timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _held_bytes(fn):
+    """Bytes still allocated while the result of fn() is alive."""
+    tracemalloc.start()
+    result = fn()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held, len(result)
+
+
+def _report(label, fn, repeat):
+    seconds = _timed(fn, repeat)
+    held, rows = _held_bytes(fn)
+    print(f'{label:<28} {seconds * 1000:>9.2f} ms  {rows / seconds:>12,.0f} rows/s  '
+          f'{held / 1024 / 1024:>8.2f} MiB  {held / rows:>6.0f} B/row')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    _seed(args.books, args.loans)
+    print(f'{args.books} books, patron {PATRON} with {args.loans} open loans')
+    _report('catalog, dict rows', _books_as_dicts, args.repeat)
+    _report('catalog, Book records', db.get_all_books, args.repeat)
+    _report('open loans, dict rows', _loans_as_dicts, args.repeat)
+    _report('open loans, Loan records', lambda: db.get_patron_borrowed_books(PATRON), args.repeat)
+    # Loan dates are parsed lazily; this is the cost once every due date is read
+    _report('open loans, records + dates',
+            lambda: [loan for loan in db.get_patron_borrowed_books(PATRON) if loan.due_date], args.repeat)
+    db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Search result cache benchmark: a skewed (Zipf) stream of search terms
+against search_books_page() on a large catalog, with the result cache off
+(a zero memory budget) and on, reporting latency and the hit ratio.
+
+Usage:
+    python -m benchmarks.bench_search_cache [--titles 200000] [--searches 5000] [--terms 500]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from benchmarks.bench_search_index import WORDS, _seed  # noqa: E402
+from services.library_service import search_books_page  # noqa: E402
+
+
+def _terms(count, rng):
+    """count distinct search terms: words, word pairs and fragments of them."""
+    terms = set(WORDS)
+    while len(terms) < count:
+        word = rng.choice(WORDS)
+        start = rng.randrange(len(word) - 2)
+        terms.add(rng.choice([word[start:start + rng.randint(3, 5)], f'{word} {rng.choice(WORDS)}']))
+    return sorted(terms)[:count]
+
+
+def _run(stream, budget):
+    db.configure_search_cache(max_bytes=budget)
+    latencies = []
+    for term, search_type in stream:
+        start = time.perf_counter()
+        search_books_page(term, search_type)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies, db.get_search_cache_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--titles', type=int, default=200_000)
+    parser.add_argument('--searches', type=int, default=5000)
+    parser.add_argument('--terms', type=int, default=500, help='Distinct search terms.')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    _seed(args.titles)
+    terms = _terms(args.terms, rng)
+    weights = [1 / rank for rank in range(1, len(terms) + 1)]
+    stream = [(term.upper() if rng.random() < 0.2 else term, 'title')
+              for term in rng.choices(terms, weights, k=args.searches)]
+    search_books_page('warm', 'title')  # build the trigram index first
+    print(f'{args.searches} searches over {len(terms)} Zipf-distributed terms, {args.titles:,} titles')
+    try:
+        for label, budget in (('cache off', 0), ('cache on', db.SEARCH_CACHE_BYTES)):
+            latencies, stats = _run(stream, budget)
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            print(f'{label:<10} mean {statistics.mean(latencies):>7.2f} ms  median {statistics.median(latencies):>6.2f} ms  '
+                  f'p99 {p99:>7.1f} ms  hit ratio {stats["hit_ratio"] or 0:.2f}  {stats["weight"] / 1024:.0f} KiB')
+    finally:
+        db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
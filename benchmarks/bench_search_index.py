@@ -0,0 +1,89 @@
+"""
+Title search benchmark on a large catalog: the R6 substring search as it
+was (a LIKE scan of every title, re-checked with str.lower()) against the
+in-memory trigram index, for rare, common, short and non-ASCII terms,
+and a ranked first page of 20 results from the index. Reports the index
+build time and size, per-query latency, and checks that the scan and the
+index return the same books.
+
+Usage:
+    python -m benchmarks.bench_search_index [--titles 1000000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+
+WORDS = ('the', 'great', 'war', 'peace', 'garden', 'night', 'river', 'house', 'shadow', 'kingdom', 'secret',
+         'winter', 'stone', 'empire', 'silent', 'crimson', 'harbor', 'lantern', 'orchard', 'misérables',
+         'journey', 'letters', 'mirror', 'north', 'wolves', 'island', 'memory', 'glass', 'fire', 'café')
+QUERIES = ('gatsb', 'tsby', 'ntern orc', 'the', 'river', 'MISÉR', 'ar', 'zzq')
+
+
+def _seed(titles):
+    db.configure_storage('throughput', database=os.path.join(tempfile.mkdtemp(), 'bench_search.db'))
+    db.init_database()
+    rng = random.Random(42)
+    rows = []
+    for i in range(titles):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 6))]
+        words[rng.randrange(len(words))] += f'{i % 9973}'
+        rows.append((' '.join(words).title(), f'Author {i % 5000}', f'{9000000000000 + i}', 1))
+    rows[titles // 2] = ('The Great Gatsby', 'F. Scott Fitzgerald', f'{9000000000000 + titles // 2}', 1)
+    for i in range(0, titles, 100_000):
+        db.insert_books_bulk(rows[i:i + 100_000])
+
+
+def _scan(term):
+    # search_books_in_catalog's substring path before the index
+    needle = term.lower()
+    books = db.search_books_by_substring(term, 'title') if term.isascii() else db.get_all_books()
+    return [book for book in books if needle in book.title.lower()]
+
+
+def _time(func, term, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(term)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--titles', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    _seed(args.titles)
+    print(f'{args.titles:,} titles seeded in {time.perf_counter() - start:.1f} s')
+    try:
+        start = time.perf_counter()
+        db.search_books_indexed('warm', 'title')
+        stats = db.get_search_index_stats()['title']
+        print(f'index built in {time.perf_counter() - start:.1f} s: {stats["trigrams"]:,} trigrams, '
+              f'{stats["postings"]:,} postings ({stats["postings_bytes"] / 2 ** 20:.0f} MiB)')
+        print(f'{"term":<12} {"matches":>9} {"scan":>11} {"index":>11} {"top 20":>11}')
+        for term in QUERIES:
+            scan_ms, expected = _time(_scan, term, args.repeat)
+            index_ms, found = _time(lambda t: db.search_books_indexed(t, 'title'), term, args.repeat)
+            assert [book.id for book in found] == [book.id for book in expected], term
+            ranked_ms, (_, total) = _time(lambda t: db.search_books_ranked(t, 'title', 20), term, args.repeat)
+            assert total == len(found), term
+            print(f'{term:<12} {len(found):>9,} {scan_ms:>8.1f} ms {index_ms:>8.1f} ms {ranked_ms:>8.1f} ms')
+    finally:
+        db.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Storage profile benchmark: read/write concurrency under each durability profile.
+
+Reader threads repeatedly load the catalog while writer threads borrow and
+return books. With the legacy rollback journal, readers stall whenever a
+writer commits; with WAL they keep going.
+
+Usage:
+    python -m benchmarks.bench_storage [--seconds 5] [--readers 4] [--writers 2]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from services.library_service import borrow_book_by_patron, return_book_by_patron  # noqa: E402
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def run_profile(profile, seconds, readers, writers, books):
+    path = os.path.join(tempfile.mkdtemp(), f'bench_{profile}.db')
+    db.configure_storage(profile, database=path)
+    db.init_database()
+    conn = db.get_db_connection()
+    conn.executemany(
+        'INSERT INTO books (title, author, isbn, total_copies, available_copies) VALUES (?, ?, ?, ?, ?)',
+        [(f'Title {i:06d}', f'Author {i % 97}', f'{9000000000000 + i}', 5, 5) for i in range(books)],
+    )
+    conn.commit()
+    conn.close()
+
+    stop = threading.Event()
+    read_latencies = []
+    write_counts = [0] * writers
+    lock = threading.Lock()
+
+    def reader():
+        local = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            db.get_all_books()
+            local.append(time.perf_counter() - start)
+        with lock:
+            read_latencies.extend(local)
+
+    def writer(n):
+        patron = f'{500000 + n}'
+        book_id = n + 1
+        while not stop.is_set():
+            borrow_book_by_patron(patron, book_id)
+            return_book_by_patron(patron, book_id)
+            write_counts[n] += 2
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    db.close_all_connections()
+
+    return {
+        'profile': profile,
+        'reads_per_sec': len(read_latencies) / seconds,
+        'writes_per_sec': sum(write_counts) / seconds,
+        'read_p50_ms': _percentile(read_latencies, 0.50) * 1000,
+        'read_p99_ms': _percentile(read_latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--profiles', nargs='+', default=['legacy', 'safe', 'throughput'])
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'reads/s':>10}{'writes/s':>10}{'read p50 ms':>14}{'read p99 ms':>14}")
+    for profile in args.profiles:
+        r = run_profile(profile, args.seconds, args.readers, args.writers, args.books)
+        print(f"{r['profile']:<12}{r['reads_per_sec']:>10.0f}{r['writes_per_sec']:>10.0f}"
+              f"{r['read_p50_ms']:>14.2f}{r['read_p99_ms']:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Typeahead benchmark on a large catalog: the index build time and size,
+then /api/suggest's lookups (get_search_suggestions()) for every prefix of
+titles and authors as they would be typed, one keystroke at a time, and
+after single inserts. Exits non-zero when the p99 lookup latency is over
+the target.
+
+Usage:
+    python -m benchmarks.bench_suggest [--titles 1000000] [--words 2000] [--target-ms 1.0]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from benchmarks.bench_search_index import _seed  # noqa: E402
+from services.library_service import get_search_suggestions  # noqa: E402
+
+
+def _keystrokes(count, rng):
+    """Every prefix (1 to 12 characters) of count titles and authors drawn from the catalog."""
+    conn = db.get_db_connection()
+    rows = conn.execute('SELECT title, author FROM books ORDER BY RANDOM() LIMIT ?', (count,)).fetchall()
+    conn.close()
+    typed = [row[rng.randrange(2)] for row in rows]
+    return [text[:n] for text in typed for n in range(1, min(len(text), 12) + 1)]
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return {p: timings[min(len(timings) - 1, int(len(timings) * p / 100))] for p in (50, 99, 100)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--titles', type=int, default=1_000_000)
+    parser.add_argument('--words', type=int, default=2000, help='Titles and authors typed out.')
+    parser.add_argument('--inserts', type=int, default=200)
+    parser.add_argument('--target-ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    _seed(args.titles)
+    try:
+        start = time.perf_counter()
+        db.warm_suggest_index()
+        stats = db.get_suggest_index_stats()
+        print(f'{args.titles:,} books indexed in {time.perf_counter() - start:.1f} s: ' + ', '.join(
+            f'{field} {s["texts"]:,} texts / {s["words"]:,} words ({s["sorted_bytes"] / 2 ** 20:.0f} MiB)'
+            for field, s in sorted(stats.items())))
+
+        prefixes = _keystrokes(args.words, rng)
+        timings = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            get_search_suggestions(prefix)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        insert_timings = []
+        for i in range(args.inserts):
+            db.insert_book(f'Freshly Added {i}', f'New Author {i}', f'{8000000000000 + i}', 1, 1)
+            start = time.perf_counter()
+            suggestions = get_search_suggestions(f'freshly added {i}')['suggestions']
+            insert_timings.append((time.perf_counter() - start) * 1000)
+            assert suggestions and suggestions[0]['text'] == f'Freshly Added {i}'
+
+        print(f'{"lookups":<22} {"count":>7} {"p50":>9} {"p99":>9} {"max":>9}')
+        for label, sample in (('keystrokes (1-12 ch)', timings), ('first after an insert', insert_timings)):
+            p = _percentiles(sample)
+            print(f'{label:<22} {len(sample):>7,} {p[50]:>6.3f} ms {p[99]:>6.3f} ms {p[100]:>6.2f} ms')
+        p99 = _percentiles(timings)[99]
+        print(f'keystroke p99 {p99:.3f} ms (target {args.target_ms} ms): {"ok" if p99 <= args.target_ms else "MISSED"}')
+    finally:
+        db.close_all_connections()
+    if p99 > args.target_ms:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Payment Stub Server - a local stand-in for the external payment gateway
+Serves the HTTP API HTTPPaymentGateway talks to (POST /charges, POST
+/refunds, GET /charges/<id>) with the same rules as the simulated
+PaymentGateway, plus configurable latency. A POST repeated with the same
+Idempotency-Key header gets the first response back without being applied
+again. Used by the tests and the payment benchmarks, and handy for trying
+the app against a "real" gateway:
+
+    python -m benchmarks.payment_stub --port 8099 --latency 0.05
+    LIBRARY_PAYMENT_URL=http://127.0.0.1:8099 flask --app app run
+"""
+
+import argparse
+import itertools
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle
+        # plus delayed ACKs add ~40 ms to every keep-alive response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: Dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _serve(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length)) if length else {}
+        self.server.count('requests')
+        if self.server.latency and self.path != '/_stats':
+            time.sleep(self.server.latency)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._reply(401, {'error': 'Missing API key'})
+            return
+        self._reply(*self.server.respond(method, self.path, payload, self.headers.get('Idempotency-Key')))
+
+    def do_GET(self):
+        self._serve('GET')
+
+    def do_POST(self):
+        self._serve('POST')
+
+
+class PaymentStubServer(ThreadingHTTPServer):
+    """
+    Threaded stub gateway. latency is added to every request but GET
+    /_stats; fail_status, when set, is returned for every request instead
+    (to exercise 5xx handling), for the next fail_count requests or, when
+    that is None, for all of them. counters records connections accepted
+    and requests served, and is also served at GET /_stats for a stub
+    running in another process.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.fail_status: Optional[int] = None
+        self.fail_count: Optional[int] = None
+        self.counters = {'connections': 0, 'requests': 0}
+        self.charges: Dict[str, Dict] = {}
+        self.idempotent: Dict[str, Tuple[int, Dict]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._keys_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle_error(self, request, client_address) -> None:
+        # A client that timed out has closed its end before the response
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def respond(self, method: str, path: str, payload: Dict, key: Optional[str] = None) -> Tuple[int, Dict]:
+        if method == 'GET' and path == '/_stats':
+            with self._lock:
+                return 200, dict(self.counters)
+        with self._lock:
+            failing = self.fail_status and self.fail_count != 0
+            if failing and self.fail_count is not None:
+                self.fail_count -= 1
+        if failing:
+            return self.fail_status, {'error': 'Gateway failure'}
+        if method == 'POST' and key:
+            # Held while the request is applied, so a concurrent retry with
+            # the same key waits for the first one's result instead of
+            # applying it twice
+            with self._keys_lock:
+                if key not in self.idempotent:
+                    self.idempotent[key] = self._apply(method, path, payload)
+                return self.idempotent[key]
+        return self._apply(method, path, payload)
+
+    def _apply(self, method: str, path: str, payload: Dict) -> Tuple[int, Dict]:
+        if method == 'POST' and path == '/charges':
+            return self._charge(payload)
+        if method == 'POST' and path == '/refunds':
+            return self._refund(payload)
+        if method == 'GET' and path.startswith('/charges/'):
+            charge = self.charges.get(path[len('/charges/'):])
+            if charge is None:
+                return 404, {'status': 'not_found', 'message': 'Transaction not found'}
+            return 200, charge
+        return 404, {'error': 'Not found'}
+
+    def _charge(self, payload: Dict) -> Tuple[int, Dict]:
+        amount, patron_id = payload.get('amount', 0), str(payload.get('customer_id', ''))
+        if amount <= 0:
+            return 400, {'error': 'Invalid amount: must be greater than 0'}
+        if amount > 1000:
+            return 402, {'error': 'Payment declined: amount exceeds limit'}
+        if len(patron_id) != 6:
+            return 400, {'error': 'Invalid patron ID format'}
+        txn = f'txn_{patron_id}_{int(time.time())}_{next(self._ids)}'
+        with self._lock:
+            self.charges[txn] = {'transaction_id': txn, 'status': 'completed', 'amount': amount,
+                                 'description': payload.get('description', ''),
+                                 'line_items': payload.get('line_items', []), 'timestamp': time.time()}
+        return 200, {'id': txn, 'message': f'Payment of ${amount:.2f} processed successfully'}
+
+    def _refund(self, payload: Dict) -> Tuple[int, Dict]:
+        txn, amount = payload.get('transaction_id', ''), payload.get('amount', 0)
+        if not txn or not txn.startswith('txn_'):
+            return 400, {'error': 'Invalid transaction ID'}
+        if amount <= 0:
+            return 400, {'error': 'Invalid refund amount'}
+        refund_id = f'refund_{txn}_{int(time.time())}'
+        return 200, {'id': refund_id,
+                     'message': f'Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}'}
+
+    def start(self) -> 'PaymentStubServer':
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,), name='payment-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub payment gateway.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request.')
+    args = parser.parse_args()
+    server = PaymentStubServer(args.host, args.port, args.latency)
+    print(f'Payment stub listening on {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
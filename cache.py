@@ -0,0 +1,146 @@
+"""
+In-process caching primitives for the Library Management System.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU cache with an optional time-to-live.
+    With max_weight, entries are also evicted while the sum of
+    weigh(value) over all entries exceeds it (e.g. a memory budget in
+    bytes); a value heavier than max_weight on its own is not stored.
+
+    Loads race with invalidations: a reader may fetch a row, a writer then
+    changes and invalidates it, and the reader stores its now-stale copy.
+    To close that window, take load_token() before reading from the source
+    and pass it to put(); the put is dropped if any invalidation happened
+    in between.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, max_weight: Optional[int] = None,
+                 weigh: Callable[[Any], int] = lambda value: 1):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self._weight = 0
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Cached value for key (marking it most recently used), or default."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires, weight = entry
+            if expires is not None and self._clock() >= expires:
+                del self._entries[key]
+                self._weight -= weight
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def load_token(self) -> int:
+        """Token to pass to put() for a value about to be loaded from the source."""
+        with self._lock:
+            return self._epoch
+
+    def put(self, key: Hashable, value: Any, token: Optional[int] = None) -> bool:
+        """
+        Store value, evicting the least recently used entry when full.
+
+        Returns:
+            bool: False if the value was dropped because an invalidation
+            happened after token was taken
+        """
+        with self._lock:
+            if token is not None and token != self._epoch:
+                self.stale_puts += 1
+                return False
+            weight = self._weigh(value)
+            if self.max_weight is not None and weight > self.max_weight:
+                self._pop(key)
+                return False
+            expires = self._clock() + self.ttl if self.ttl is not None else None
+            self._pop(key)
+            self._entries[key] = (value, expires, weight)
+            self._weight += weight
+            while len(self._entries) > self.max_size or (
+                    self.max_weight is not None and self._weight > self.max_weight):
+                self._weight -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+            return True
+
+    def _pop(self, key: Hashable) -> bool:
+        # Drop key, keeping the total weight in step; call with _lock held
+        entry = self._entries.pop(key, _MISSING)
+        if entry is _MISSING:
+            return False
+        self._weight -= entry[2]
+        return True
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop one key (a no-op if it is not cached)."""
+        self.invalidate_many((key,))
+
+    def invalidate_many(self, keys: Iterable[Hashable]) -> None:
+        """Drop several keys at once."""
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if self._pop(key):
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._weight = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Size, configuration and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'weight': self._weight,
+                'max_weight': self.max_weight,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'stale_puts': self.stale_puts,
+            }
@@ -0,0 +1,235 @@
+"""
+Command-line interface for the Library Management System.
+
+Commands are registered on the Flask app, so they run against the same
+configured database as the web app:
+
+    flask --app app export books --format csv --output books.csv
+    flask --app app import-books feed.csv --on-duplicate upsert
+    flask --app app patron-summary roll-forward
+    flask --app app backfill-loan-epochs
+    flask --app app analyze
+    flask --app app overdue run
+    flask --app app jobs worker --threads 4
+"""
+
+import sys
+import threading
+from datetime import datetime
+
+import click
+
+from database import LOAN_EPOCH_BATCH_SIZE, analyze_database, backfill_loan_epochs, get_dead_letters, requeue_dead_job
+from services.export_service import EXPORT_FORMATS, export_books, export_loans
+from services.import_service import BULK_BATCH_SIZE, IMPORT_FORMATS, import_books
+from services.job_service import JOB_WORKER_THREADS, JobWorker
+from services.library_service import calculate_outstanding_fees, check_patron_summary, roll_forward_patron_fees
+from services.overdue_service import OVERDUE_CHUNK_SIZE, get_overdue_report, run_overdue_job
+
+
+def _write_chunks(chunks, output):
+    """Write export chunks to a file path, or stdout for '-'."""
+    if output == '-':
+        for chunk in chunks:
+            click.echo(chunk, nl=False)
+        return
+    with open(output, 'w', encoding='utf-8', newline='') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def _parse_as_of(as_of):
+    try:
+        return datetime.fromisoformat(as_of) if as_of else None
+    except ValueError:
+        raise click.BadParameter('must be an ISO date or datetime', param_hint='--as-of')
+
+
+@click.group('export')
+def export_cli():
+    """Export catalog or loan data for offline backups."""
+
+
+@export_cli.command('books')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson', show_default=True)
+@click.option('--output', '-o', default='-', show_default=True, help="File to write, or '-' for stdout.")
+def export_books_command(fmt, output):
+    """Export the whole catalog."""
+    _write_chunks(export_books(fmt), output)
+
+
+@export_cli.command('loans')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson', show_default=True)
+@click.option('--output', '-o', default='-', show_default=True, help="File to write, or '-' for stdout.")
+@click.option('--patron-id', default=None, help='Only this patron\'s loans.')
+@click.option('--start', default=None, help='Borrowed on or after this ISO date.')
+@click.option('--end', default=None, help='Borrowed before this ISO date.')
+def export_loans_command(fmt, output, patron_id, start, end):
+    """Export borrow records, optionally filtered by patron and borrow date."""
+    try:
+        chunks = export_loans(fmt, patron_id=patron_id, start=start, end=end)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    _write_chunks(chunks, output)
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default='csv', show_default=True)
+@click.option('--on-duplicate', type=click.Choice(['skip', 'upsert']), default='skip', show_default=True)
+@click.option('--batch-size', type=click.IntRange(min=1), default=BULK_BATCH_SIZE, show_default=True)
+def import_books_command(path, fmt, on_duplicate, batch_size):
+    """Bulk-import books from a CSV, NDJSON or MARC-lite feed."""
+    if path == '-':
+        report = import_books(sys.stdin, fmt, on_duplicate, batch_size)
+    else:
+        with open(path, encoding='utf-8', newline='') as stream:
+            report = import_books(stream, fmt, on_duplicate, batch_size)
+
+    click.echo(f"Processed {report['processed']} rows in {report['elapsed_seconds']}s "
+               f"({report['rows_per_second']} rows/s): {report['inserted']} inserted, "
+               f"{report['updated']} updated, {report['skipped']} skipped, {report['error_count']} errors.")
+    for error in report['errors']:
+        click.echo(f"  row {error['row']}: {error['error']}", err=True)
+
+
+@click.command('outstanding-fees')
+@click.option('--as-of', default=None, help='Assess fees at this ISO datetime instead of now.')
+def outstanding_fees_command(as_of):
+    """Total late fees owed on open loans across all patrons."""
+    report = calculate_outstanding_fees(_parse_as_of(as_of))
+    click.echo(f"As of {report['as_of']}: ${report['total_outstanding']:.2f} owed on "
+               f"{report['overdue_loans']} overdue loans by {len(report['by_patron'])} patrons.")
+
+
+@click.group('patron-summary')
+def patron_summary_cli():
+    """Maintain the materialized per-patron loan and fee summary."""
+
+
+@patron_summary_cli.command('roll-forward')
+@click.option('--as-of', default=None, help='Assess fees at this ISO datetime instead of now.')
+def roll_forward_command(as_of):
+    """Daily fee accrual: reassess every patron's outstanding fees."""
+    report = roll_forward_patron_fees(_parse_as_of(as_of))
+    click.echo(f"Rolled fees forward to {report['as_of']}: ${report['total_outstanding']:.2f} owed by "
+               f"{report['patrons_with_fees']} patrons.")
+
+
+@patron_summary_cli.command('check')
+@click.option('--repair', is_flag=True, help='Rebuild the table from borrow_records if it is inconsistent.')
+def check_command(repair):
+    """Compare patron_summary with borrow_records."""
+    report = check_patron_summary(repair=repair)
+    for m in report['mismatches']:
+        click.echo(f"  {m['patron_id']} {m['field']}: stored {m['stored']!r}, expected {m['expected']!r}", err=True)
+    click.echo(f"{report['patrons_checked']} patrons checked, {len(report['mismatches'])} mismatches "
+               f"({report['status']}).")
+    if report['status'] == 'mismatch':
+        sys.exit(1)
+
+
+@click.command('backfill-loan-epochs')
+@click.option('--batch-size', type=click.IntRange(min=1), default=LOAN_EPOCH_BATCH_SIZE, show_default=True)
+@click.option('--max-batches', type=click.IntRange(min=1), default=None, help='Stop after this many batches.')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def backfill_loan_epochs_command(batch_size, max_batches, pause):
+    """Fill the integer epoch columns of loans written before they existed."""
+    report = backfill_loan_epochs(batch_size, max_batches, pause)
+    state = 'finished' if report['ready'] else f"next id {report['next_id']} of {report['end_id']}"
+    click.echo(f"Backfilled {report['updated']} loans ({state}).")
+    if report['unparsed']:
+        click.echo(f"  {report['unparsed']} loans have a due_date SQLite cannot parse.", err=True)
+
+
+@click.command('analyze')
+def analyze_command():
+    """Refresh the query planner's statistics (after large imports, or from cron)."""
+    analyze_database()
+    click.echo('Planner statistics updated.')
+
+
+@click.group('overdue')
+def overdue_cli():
+    """Library-wide overdue snapshot and nightly fee accrual."""
+
+
+@overdue_cli.command('run')
+@click.option('--as-of', default=None, help='Assess a new run at this ISO datetime instead of now.')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=OVERDUE_CHUNK_SIZE, show_default=True)
+@click.option('--fresh', is_flag=True, help='Start a new run instead of resuming an unfinished one.')
+@click.option('--no-accrue', is_flag=True, help='Do not roll patron fees forward afterwards.')
+def overdue_run_command(as_of, chunk_size, fresh, no_accrue):
+    """Snapshot every overdue loan with its fee, resuming an interrupted run."""
+    report = run_overdue_job(_parse_as_of(as_of), chunk_size, resume=not fresh, accrue=not no_accrue)
+    resumed = ' (resumed)' if report['resumed'] else ''
+    click.echo(f"Run {report['run_id']} as of {report['as_of']} {report['status']}{resumed}: "
+               f"{report['loans']} overdue loans, ${report['total_fees']:.2f} in fees, "
+               f"{report['elapsed_seconds']}s ({report['loans_per_second']} loans/s).")
+    if report['status'] == 'busy':
+        sys.exit(1)
+
+
+@overdue_cli.command('report')
+@click.option('--run-id', type=int, default=None, help='Run to show (default: latest finished).')
+@click.option('--limit', type=click.IntRange(1, 500), default=50, show_default=True)
+def overdue_report_command(run_id, limit):
+    """Show a finished run's totals and its first overdue loans."""
+    report = get_overdue_report(run_id, limit=limit)
+    if report['status'] != 'ok':
+        raise click.ClickException(report['message'])
+    run = report['run']
+    click.echo(f"Run {run['run_id']} as of {run['as_of']}: {run['loans']} overdue loans, "
+               f"${run['total_fees']:.2f} in fees.")
+    for loan in report['loans']:
+        click.echo(f"  loan {loan['loan_id']} patron {loan['patron_id']} {loan['title'] or loan['book_id']}: "
+                   f"due {loan['due_date']}, {loan['days_overdue']} days, ${loan['fee']:.2f}")
+
+
+@click.group('jobs')
+def jobs_cli():
+    """Background job queue for payments and refunds."""
+
+
+@jobs_cli.command('worker')
+@click.option('--threads', type=click.IntRange(min=1), default=JOB_WORKER_THREADS, show_default=True)
+def jobs_worker_command(threads):
+    """Run queued jobs until interrupted."""
+    worker = JobWorker(threads).start()
+    click.echo(f'Job worker {worker.owner} running with {threads} threads; Ctrl-C to stop.')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+
+
+@jobs_cli.command('dead')
+@click.option('--limit', type=click.IntRange(1, 500), default=50, show_default=True)
+def jobs_dead_command(limit):
+    """List jobs that ran out of attempts."""
+    for job in get_dead_letters(limit):
+        click.echo(f"job {job['job_id']} {job['kind']} {job['payload']}: {job['attempts']} attempts, "
+                   f"failed {job['failed_at']}: {job['error']}")
+
+
+@jobs_cli.command('requeue')
+@click.argument('job_id', type=int)
+def jobs_requeue_command(job_id):
+    """Give a dead-lettered job a fresh set of attempts."""
+    if not requeue_dead_job(job_id):
+        raise click.ClickException(f'Job {job_id} is not in the dead letter table.')
+    click.echo(f'Job {job_id} queued again.')
+
+
+def register_commands(app):
+    """Register all CLI command groups with the Flask app."""
+    app.cli.add_command(export_cli)
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(outstanding_fees_command)
+    app.cli.add_command(patron_summary_cli)
+    app.cli.add_command(backfill_loan_epochs_command)
+    app.cli.add_command(analyze_command)
+    app.cli.add_command(overdue_cli)
+    app.cli.add_command(jobs_cli)
@@ -3,23 +3,476 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import base64
+import json
+import os
 import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-# Database configuration
-DATABASE = 'library.db'
+from cache import LRUCache
+from records import Book, Loan, book_factory, loan_factory
+from search_index import PrefixIndex, TrigramIndex
+
+# Database configuration (overridable through the environment or configure_storage())
+DATABASE = os.environ.get('LIBRARY_DATABASE', 'library.db')
+
+# Connection pool configuration
+POOL_MAX_SIZE = 8
+POOL_TIMEOUT = 30.0
+
+# Rows fetched per round trip by the streaming iterators
+EXPORT_BATCH_SIZE = 500
+
+# Rows per transaction when backfilling the loan epoch columns; small enough
+# that borrows and returns queue behind each batch only briefly
+LOAN_EPOCH_BATCH_SIZE = 5000
+
+# Rows ANALYZE samples per index (PRAGMA analysis_limit)
+ANALYZE_SAMPLE_ROWS = 1000
+
+# Overdue job: how long a worker's claim on a run lasts without progress
+# before another worker may take it over, and how many finished runs (with
+# their snapshots) are kept
+OVERDUE_LEASE_SECONDS = 300.0
+OVERDUE_KEEP_RUNS = 7
+
+# Payments ledger: how long a 'processing' entry counts as in flight. Must
+# exceed a gateway call with all its retries; after that a request with the
+# same idempotency key takes the entry over and sends it again
+PAYMENT_PROCESSING_SECONDS = 120.0
+
+# Job queue: how long a claimed job stays invisible to other workers (a job
+# whose worker died is picked up again after this), how often a job is
+# tried before it goes to the dead letter table, and the retry backoff:
+# base * 2**(attempt - 1) seconds, capped, with full jitter
+JOB_VISIBILITY_SECONDS = 60.0
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 1.0
+JOB_RETRY_BACKOFF_MAX = 60.0
+
+# Storage profiles: PRAGMAs applied once, when a pooled connection is first opened.
+# Both profiles use WAL so readers never block behind a writer. "safe" fsyncs on
+# every commit; "throughput" fsyncs only at checkpoints, so a power loss may drop
+# the last few commits (but never corrupts the database).
+STORAGE_PROFILES = {
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,        # KiB (negative = size rather than pages)
+        'mmap_size': 0,
+        'temp_store': 'MEMORY',
+    },
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 268435456,      # 256 MiB
+        'temp_store': 'MEMORY',
+    },
+    # SQLite defaults (rollback journal); kept for comparison benchmarks
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+}
+
+STORAGE_PROFILE = os.environ.get('LIBRARY_DB_PROFILE', 'safe')
+STORAGE_OVERRIDES: Dict = {}
+
+# Book lookup cache in front of get_book_by_id()/get_book_by_isbn().
+# 'full' serves whole rows from memory; 'metadata' serves title, author, isbn
+# and copy totals from memory but always reads available_copies from the
+# database (so availability shown to borrowers is never stale); 'off'
+# disables it. Writes made through this module invalidate entries
+# explicitly; writes made by other processes are picked up through the
+# change counters (see poll_changes()), with the TTL as a last resort.
+BOOK_CACHE_MODES = ('off', 'metadata', 'full')
+BOOK_CACHE_MODE = os.environ.get('LIBRARY_BOOK_CACHE', 'full')
+BOOK_CACHE_SIZE = 4096
+BOOK_CACHE_TTL = 300.0
+
+# Search result cache: pages of search results keyed on the normalized
+# query and stamped with the catalog version they were computed at, within a
+# memory budget (estimated bytes). available_copies is never served from it.
+SEARCH_CACHE_BYTES = 16 * 2 ** 20
+SEARCH_CACHE_SIZE = 10000
+
+# How often (seconds) a process re-reads change_counters to pick up writes
+# made by other processes; this bounds how stale in-process caches can be.
+CHANGE_POLL_INTERVAL = 0.5
+
+def get_connection_pragmas() -> Dict:
+    """PRAGMAs for new connections: the active profile plus any overrides."""
+    pragmas = dict(STORAGE_PROFILES[STORAGE_PROFILE])
+    pragmas.update(STORAGE_OVERRIDES)
+    return pragmas
+
+def configure_storage(profile: Optional[str] = None, database: Optional[str] = None, **overrides) -> None:
+    """
+    Select the database file, durability profile and PRAGMA overrides.
+    Open pools are closed so that new connections pick up the settings.
+
+    Raises:
+        ValueError: if the profile is unknown
+    """
+    global DATABASE, STORAGE_PROFILE, STORAGE_OVERRIDES
+    if profile is not None:
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile '{profile}'. Choose from: {', '.join(STORAGE_PROFILES)}.")
+        STORAGE_PROFILE = profile
+    if database is not None:
+        DATABASE = database
+    STORAGE_OVERRIDES = dict(overrides)
+    close_all_connections()
+
+def _search_page_weight(entry) -> int:
+    # Rough bytes held by a cached (catalog version, page) entry
+    page = entry[1]
+    return 400 + len(page.get('next_cursor') or '') + sum(
+        300 + len(book.title) + len(book.author) + len(book.isbn) for book in page['books'])
+
+def configure_search_cache(max_bytes: Optional[int] = None, max_size: Optional[int] = None) -> None:
+    """Set the search result cache's memory budget (bytes) and entry limit. The cache is emptied and its statistics reset."""
+    global SEARCH_CACHE_BYTES, SEARCH_CACHE_SIZE, _search_cache
+    if max_bytes is not None:
+        SEARCH_CACHE_BYTES = max_bytes
+    if max_size is not None:
+        SEARCH_CACHE_SIZE = max_size
+    _search_cache = LRUCache(SEARCH_CACHE_SIZE, max_weight=SEARCH_CACHE_BYTES, weigh=_search_page_weight)
+
+def configure_book_cache(mode: Optional[str] = None, max_size: Optional[int] = None,
+                         ttl: Optional[float] = None) -> None:
+    """
+    Select the book cache mode, capacity and TTL (seconds). The cache is
+    emptied and its statistics reset.
+
+    Raises:
+        ValueError: if the mode is unknown
+    """
+    global BOOK_CACHE_MODE, BOOK_CACHE_SIZE, BOOK_CACHE_TTL, _book_cache, _isbn_cache
+    if mode is not None:
+        if mode not in BOOK_CACHE_MODES:
+            raise ValueError(f"Unknown book cache mode '{mode}'. Choose from: {', '.join(BOOK_CACHE_MODES)}.")
+        BOOK_CACHE_MODE = mode
+    if max_size is not None:
+        BOOK_CACHE_SIZE = max_size
+    if ttl is not None:
+        BOOK_CACHE_TTL = ttl
+    _book_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+    _isbn_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of SQLite connections for one database file.
+
+    Connections are opened lazily up to ``max_size`` and handed out LIFO so the
+    most recently used (and therefore warmest) connection is reused first.
+    """
+
+    def __init__(self, database: str, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle: List[sqlite3.Connection] = []
+        self._size = 0
+        self._closed = False
+        # Connections opened before the last recycle() are closed on release
+        self._generation = 0
+        self._opened_in: Dict[int, int] = {}
+        # Metrics
+        self._created = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection and apply the per-connection PRAGMAs."""
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        for name, value in get_connection_pragmas().items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Check out a connection, waiting up to ``timeout`` seconds for one to free up."""
+        start = time.perf_counter()
+        waited_for_release = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError('Connection pool is closed.')
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection.')
+                if not waited_for_release:
+                    waited_for_release = True
+                    self._waits += 1
+                self._cond.wait(remaining)
+
+            waited = time.perf_counter() - start
+            self._checkouts += 1
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+                self._opened_in[id(conn)] = self._generation
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, rolling back anything left uncommitted."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped instead of being reused
+            with self._cond:
+                self._size -= 1
+                self._opened_in.pop(id(conn), None)
+                self._cond.notify()
+            conn.close()
+            return
+
+        with self._cond:
+            if self._closed or self._opened_in.get(id(conn)) != self._generation:
+                self._size -= 1
+                self._opened_in.pop(id(conn), None)
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def recycle(self) -> None:
+        """
+        Replace every connection with a new one as it comes free. SQLite reads
+        the planner statistics when a connection opens, so this is how the
+        pool picks up a fresh ANALYZE.
+        """
+        with self._cond:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            for conn in idle:
+                self._opened_in.pop(id(conn), None)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def close(self) -> None:
+        """Close idle connections; connections still checked out are closed on release."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            for conn in idle:
+                self._opened_in.pop(id(conn), None)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict:
+        """Snapshot of pool size, checkout and wait-time metrics."""
+        with self._cond:
+            return {
+                'database': self.database,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'created': self._created,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'total_wait_seconds': round(self._wait_time, 6),
+                'max_wait_seconds': round(self._max_wait, 6),
+                'avg_wait_seconds': round(self._wait_time / self._checkouts, 6) if self._checkouts else 0.0,
+            }
+
+
+class PooledConnection:
+    """
+    Proxy for a pooled connection. Behaves like ``sqlite3.Connection`` except
+    that ``close()`` hands the connection back to its pool, as does leaving a
+    ``with get_db_connection() as conn:`` block. Connections borrowed from an
+    active ``db_session()`` are not owned, so closing them is a no-op.
+    """
+
+    def __init__(self, pool: Optional[ConnectionPool], conn: sqlite3.Connection, owned: bool = True):
+        self._pool = pool
+        self._conn = conn
+        self._owned = owned
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Unlike sqlite3.Connection, leaving the block returns the connection
+        # (rolling back anything not committed), whether or not it raised
+        self.close()
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and self._owned:
+            self._pool.release(conn)
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+# Book rows keyed by (DATABASE, id), and ISBN -> id keyed by (DATABASE, isbn)
+_book_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+_isbn_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+# Search result pages keyed by (DATABASE, catalog version, normalized query...)
+_search_cache = LRUCache(SEARCH_CACHE_SIZE, max_weight=SEARCH_CACHE_BYTES, weigh=_search_page_weight)
+_search_cache_versions: Dict[str, int] = {}
+
+def get_pool() -> ConnectionPool:
+    """Get (or lazily create) the connection pool for the current DATABASE."""
+    with _pools_lock:
+        pool = _pools.get(DATABASE)
+        if pool is None:
+            pool = _pools[DATABASE] = ConnectionPool(DATABASE, POOL_MAX_SIZE, POOL_TIMEOUT)
+        return pool
+
+def close_all_connections() -> None:
+    """Close every pool, e.g. before the database file is removed or replaced."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+    invalidate_book_cache()
+    reset_change_tracking()
+    with _search_index_lock:
+        _search_indexes.clear()
+        _suggest_indexes.clear()
+    _search_cache.clear()
+    _search_cache_versions.clear()
+
+def get_pool_stats() -> Dict:
+    """Get metrics for the connection pool of the current DATABASE."""
+    return get_pool().stats()
+
+def _current_session() -> Optional[sqlite3.Connection]:
+    """The connection bound to this thread by db_session(), if any."""
+    session = getattr(_local, 'session', None)
+    if session is not None and session[0] == DATABASE:
+        return session[1]
+    return None
 
 def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    return conn
+    """
+    Get a database connection from the pool.
+    Inside db_session() this is the session's shared connection.
+    """
+    conn = _current_session()
+    if conn is not None:
+        return PooledConnection(None, conn, owned=False)
+    pool = get_pool()
+    return PooledConnection(pool, pool.acquire())
 
-def init_database():
-    """Initialize the database with required tables."""
-    conn = get_db_connection()
-    
+@contextmanager
+def db_session():
+    """
+    Share one pooled connection across all helpers called within the block,
+    so a logical operation checks out a single connection. Nested sessions
+    reuse the outer one. Commits on success and rolls back on error.
+    """
+    conn = _current_session()
+    if conn is not None:
+        yield PooledConnection(None, conn, owned=False)
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    _local.session = (DATABASE, conn)
+    _local.invalidated_books = set()
+    try:
+        yield PooledConnection(None, conn, owned=False)
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        _local.session = None
+        pool.release(conn)
+        # Invalidate again now that the writes are committed (or rolled
+        # back): another thread may have cached the old row in between.
+        invalidated, _local.invalidated_books = _local.invalidated_books, None
+        if invalidated:
+            invalidate_book_cache(None if None in invalidated else invalidated)
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """
+    Run the block as one transaction on a single pooled connection.
+    BEGIN IMMEDIATE takes the write lock up front, so reads made inside the
+    block cannot be invalidated by a concurrent writer before we commit.
+    Nested calls become savepoints of the outer transaction.
+    """
+    with db_session() as conn:
+        if conn.in_transaction:
+            conn.execute('SAVEPOINT nested_txn')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK TO nested_txn')
+                conn.execute('RELEASE nested_txn')
+                raise
+            conn.execute('RELEASE nested_txn')
+            return
+
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+# Schema migrations
+#
+# Each migration is (version, name, step). step(conn) runs inside its own
+# BEGIN IMMEDIATE transaction together with the row recording it in
+# schema_migrations, so a crash never leaves a half-applied version and
+# concurrent workers starting up apply each migration exactly once.
+
+def _migration_initial_schema(conn):
+    """Books and borrow_records tables (adopts databases created before migrations)."""
     # Create books table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS books (
@@ -44,158 +497,1870 @@ def init_database():
             FOREIGN KEY (book_id) REFERENCES books (id)
         )
     ''')
+
+def _migration_borrow_record_indexes(conn):
+    """Indexes for the per-patron loan lookups."""
+    # Open loans of a patron: borrow count, currently borrowed books, returns.
+    # Partial, so it stays small however much history accumulates. Without
+    # statistics the planner takes it for no better than the full patron
+    # indexes; once analyze_database() has measured the table it picks it.
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_open_patron
+        ON borrow_records (patron_id, borrow_date) WHERE return_date IS NULL
+    ''')
+    # Latest loan of a patron for a given book (late fee fallback)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_book_date
+        ON borrow_records (patron_id, book_id, borrow_date DESC)
+    ''')
+    # Borrowing history of a patron, newest first
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_date
+        ON borrow_records (patron_id, borrow_date DESC)
+    ''')
+
+def _migration_books_fts(conn):
+    """FTS5 index over book titles and authors, kept in sync with books by triggers."""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+        END
+    ''')
+    # Only title/author changes touch the index, not availability updates
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+def _migration_books_title_index(conn):
+    """(title, id) index for keyset pagination of the catalog."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_title_id ON books (title, id)')
+
+_PATRON_SUMMARY_COUNTS_SQL = '''
+    INSERT INTO patron_summary (patron_id, active_count, total_loans, last_activity)
+    SELECT patron_id, SUM(return_date IS NULL), COUNT(*),
+           MAX(MAX(borrow_date, COALESCE(return_date, '')))
+    FROM borrow_records
+    GROUP BY patron_id
+'''
+
+def _migration_patron_summary(conn):
+    """Per-patron loan counters and outstanding fees, maintained incrementally."""
+    # Counts and last activity are kept exact by triggers, so every writer of
+    # borrow_records (atomic paths, legacy helpers, raw SQL) updates them in
+    # its own transaction. outstanding_fees is the R5 fee on open loans
+    # assessed at fees_as_of; the service layer refreshes it on borrow/return
+    # and the daily roll-forward moves every patron to a new as_of.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patron_summary (
+            patron_id TEXT PRIMARY KEY,
+            active_count INTEGER NOT NULL DEFAULT 0,
+            total_loans INTEGER NOT NULL DEFAULT 0,
+            last_activity TEXT,
+            outstanding_fees REAL NOT NULL DEFAULT 0,
+            fees_as_of TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patron_summary_loan_ai AFTER INSERT ON borrow_records BEGIN
+            INSERT INTO patron_summary (patron_id, active_count, total_loans, last_activity)
+            VALUES (new.patron_id, new.return_date IS NULL, 1, MAX(new.borrow_date, COALESCE(new.return_date, '')))
+            ON CONFLICT (patron_id) DO UPDATE SET
+                active_count = active_count + excluded.active_count,
+                total_loans = total_loans + 1,
+                last_activity = MAX(COALESCE(last_activity, ''), excluded.last_activity);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patron_summary_loan_au AFTER UPDATE OF return_date ON borrow_records BEGIN
+            UPDATE patron_summary SET
+                active_count = active_count + (new.return_date IS NULL) - (old.return_date IS NULL),
+                last_activity = MAX(COALESCE(last_activity, ''), COALESCE(new.return_date, ''))
+            WHERE patron_id = new.patron_id;
+        END
+    ''')
+    # Deletes are rare (data fixes), so last activity is simply recomputed
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patron_summary_loan_ad AFTER DELETE ON borrow_records BEGIN
+            UPDATE patron_summary SET
+                active_count = active_count - (old.return_date IS NULL),
+                total_loans = total_loans - 1,
+                last_activity = (SELECT MAX(MAX(borrow_date, COALESCE(return_date, '')))
+                                 FROM borrow_records WHERE patron_id = old.patron_id)
+            WHERE patron_id = old.patron_id;
+            DELETE FROM patron_summary WHERE patron_id = old.patron_id AND total_loans <= 0;
+        END
+    ''')
+    conn.execute(_PATRON_SUMMARY_COUNTS_SQL)
+
+# Change counters: one monotonically increasing version per data domain,
+# bumped by triggers in the writing transaction whoever the writer is (this
+# module, another worker process, or a maintenance script). In-process
+# caches poll them to notice writes made by other processes. Since
+# migration 12 the triggers also stamp changed_at (Unix seconds), which
+# HTTP responses use as Last-Modified.
+CHANGE_COUNTERS = ('catalog', 'availability', 'loans')
+
+_CHANGE_TRIGGERS = [
+    # (trigger name, event, WHEN condition, counter bumped)
+    ('books_changes_ai', 'AFTER INSERT ON books', None, 'catalog'),
+    ('books_changes_ad', 'AFTER DELETE ON books', None, 'catalog'),
+    ('books_changes_au', 'AFTER UPDATE OF title, author, isbn, total_copies ON books', None, 'catalog'),
+    ('books_availability_au', 'AFTER UPDATE OF available_copies ON books',
+     'old.available_copies IS NOT new.available_copies', 'availability'),
+    ('borrow_records_changes_ai', 'AFTER INSERT ON borrow_records', None, 'loans'),
+    ('borrow_records_changes_au', 'AFTER UPDATE ON borrow_records', None, 'loans'),
+    ('borrow_records_changes_ad', 'AFTER DELETE ON borrow_records', None, 'loans'),
+]
+
+def _migration_change_counters(conn):
+    """Per-domain version counters kept current by triggers."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.executemany('INSERT OR IGNORE INTO change_counters (name) VALUES (?)',
+                     [(name,) for name in CHANGE_COUNTERS])
+    for trigger, event, condition, counter in _CHANGE_TRIGGERS:
+        when = f'WHEN {condition}' if condition else ''
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {trigger} {event} {when} BEGIN
+                UPDATE change_counters SET version = version + 1 WHERE name = '{counter}';
+            END
+        ''')
+
+_NOW_UNIX_SQL = "(julianday('now') - 2440587.5) * 86400.0"
+
+def _migration_change_timestamps(conn):
+    """When each change counter last moved, kept current by the same triggers."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(change_counters)')}
+    if 'changed_at' not in columns:
+        conn.execute('ALTER TABLE change_counters ADD COLUMN changed_at REAL')
+    conn.execute(f'UPDATE change_counters SET changed_at = {_NOW_UNIX_SQL} WHERE changed_at IS NULL')
+    # Rewrite the triggers as later migrations left them (7 narrowed one)
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({})".format(
+        ','.join('?' * len(_CHANGE_TRIGGERS))), [trigger[0] for trigger in _CHANGE_TRIGGERS]).fetchall()
+    for name, sql in triggers:
+        if 'changed_at' not in sql:
+            conn.execute(f'DROP TRIGGER {name}')
+            conn.execute(sql.replace('SET version = version + 1',
+                                     f'SET version = version + 1, changed_at = {_NOW_UNIX_SQL}'))
+
+def _migration_database_id(conn):
+    """A random id for this database, so version stamps from a recreated one never match."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS database_id (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            token TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO database_id (id, token, created_at) VALUES (1, ?, ?)',
+                 (uuid.uuid4().hex[:16], datetime.now().isoformat()))
+
+def _analyze(conn):
+    # A sample is enough to tell a small partial index from a full one; a
+    # complete ANALYZE would read every index of a large database
+    conn.execute(f'PRAGMA analysis_limit = {ANALYZE_SAMPLE_ROWS}')
+    conn.execute('ANALYZE')
+
+def _migration_planner_stats(conn):
+    """Measure the existing data for the query planner (see analyze_database())."""
+    _analyze(conn)
+
+# Loan epochs: borrow_ts, due_ts and return_ts mirror the ISO TEXT dates as
+# integer seconds since 1970-01-01 (naive, like the stored text), so overdue
+# scans can seek a partial index on due_ts instead of parsing every open
+# loan's due_date. The TEXT columns stay authoritative and every read/write
+# API keeps using them; triggers derive the epochs on any insert or date
+# update, whoever the writer is. Rows that predate migration 7 are filled in
+# by backfill_loan_epochs() in short batches while the app keeps running.
+# The fraction is cut off before converting because strftime() would round
+# it, and the epochs must never be later than the text they come from.
+_EPOCH_SQL = "CAST(strftime('%s', substr({}, 1, 19)) AS INTEGER)"
+_LOAN_EPOCH_SET = ', '.join(f'{column}_ts = ' + _EPOCH_SQL.format(f'{column}_date')
+                            for column in ('borrow', 'due', 'return'))
+
+def _migration_loan_epochs(conn):
+    """Integer epoch columns for borrow_records, with triggers, an open-loan due index and a backfill marker."""
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(borrow_records)')}
+    for column in ('borrow_ts', 'due_ts', 'return_ts'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE borrow_records ADD COLUMN {column} INTEGER')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS borrow_records_epochs_ai AFTER INSERT ON borrow_records BEGIN
+            UPDATE borrow_records SET {_LOAN_EPOCH_SET} WHERE id = new.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS borrow_records_epochs_au
+        AFTER UPDATE OF borrow_date, due_date, return_date ON borrow_records BEGIN
+            UPDATE borrow_records SET {_LOAN_EPOCH_SET} WHERE id = new.id;
+        END
+    ''')
+    # The loans counter only needs to move for real changes, not for the
+    # epoch triggers' own updates
+    conn.execute('DROP TRIGGER IF EXISTS borrow_records_changes_au')
+    conn.execute('''
+        CREATE TRIGGER borrow_records_changes_au
+        AFTER UPDATE OF patron_id, book_id, borrow_date, due_date, return_date ON borrow_records BEGIN
+            UPDATE change_counters SET version = version + 1 WHERE name = 'loans';
+        END
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrow_records_open_due
+        ON borrow_records (due_ts) WHERE return_date IS NULL
+    ''')
+    # Rows up to end_id existed before the triggers and still need their
+    # epochs; next_id is how far backfill_loan_epochs() has got
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS loan_epoch_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_id INTEGER NOT NULL,
+            end_id INTEGER NOT NULL,
+            finished_at TEXT
+        )
+    ''')
+    end_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM borrow_records').fetchone()[0]
+    conn.execute('INSERT OR IGNORE INTO loan_epoch_backfill (id, next_id, end_id, finished_at) VALUES (1, 1, ?, ?)',
+                 (end_id, None if end_id else datetime.now().isoformat()))
+
+def _migration_overdue_runs(conn):
+    """Overdue job runs, with their checkpoint and lease, and the per-loan snapshot each run writes."""
+    # scheduled_for is the date of a nightly run (unique, so only one worker
+    # starts it); manual runs leave it NULL. The checkpoint is the
+    # (due_ts, id) key of the last loan written, which is where a resumed run
+    # continues its scan of idx_borrow_records_open_due.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS overdue_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            as_of TEXT NOT NULL,
+            scheduled_for TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            lease_owner TEXT,
+            lease_expires REAL,
+            checkpoint_due_ts INTEGER,
+            checkpoint_id INTEGER,
+            loans INTEGER NOT NULL DEFAULT 0,
+            total_fees REAL NOT NULL DEFAULT 0,
+            elapsed_seconds REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS overdue_snapshot (
+            run_id INTEGER NOT NULL REFERENCES overdue_runs (id),
+            loan_id INTEGER NOT NULL,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            due_date TEXT NOT NULL,
+            days_overdue INTEGER NOT NULL,
+            fee REAL NOT NULL,
+            PRIMARY KEY (run_id, loan_id)
+        )
+    ''')
+
+def _migration_fee_settlements(conn):
+    """Late-fee settlements (one gateway charge each) and the per-loan amounts each one covers."""
+    # A settlement is written 'pending' before its charge is sent and marked
+    # 'paid' or 'failed' from the gateway's answer. Items of pending and paid
+    # settlements count as settled, so a repeated or concurrent request
+    # cannot charge the same fee again while the first charge is in flight.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fee_settlements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patron_id TEXT NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            transaction_id TEXT,
+            message TEXT,
+            as_of TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            settled_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fee_settlements_patron ON fee_settlements (patron_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fee_settlement_items (
+            settlement_id INTEGER NOT NULL REFERENCES fee_settlements (id),
+            loan_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            days_overdue INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (settlement_id, loan_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fee_settlement_items_loan ON fee_settlement_items (loan_id)')
+
+def _migration_payments(conn):
+    """Payments ledger: every gateway charge and refund, keyed by its idempotency key."""
+    # status: 'processing' while the gateway call is in flight, then
+    # 'succeeded', 'declined', 'error' (certainly not applied) or 'unknown'
+    # (the request may have reached the gateway; sending it again under the
+    # same key finds out). request holds the charge's description and line
+    # items so it can be sent again; refund_of is a refund's charge.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            patron_id TEXT,
+            amount REAL NOT NULL,
+            request TEXT NOT NULL DEFAULT '{}',
+            refund_of TEXT,
+            settlement_id INTEGER REFERENCES fee_settlements (id),
+            status TEXT NOT NULL DEFAULT 'processing',
+            transaction_id TEXT,
+            message TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_transaction ON payments (transaction_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_refund_of ON payments (refund_of)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_patron ON payments (patron_id, status)')
+
+def _migration_jobs(conn):
+    """Background job queue and its dead letter table."""
+    # status: 'queued', 'running' (claimed by locked_by until visible_at),
+    # 'succeeded' or 'dead'. A queued job becomes claimable at visible_at;
+    # so does a running one whose worker did not finish it in time.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            visible_at REAL NOT NULL,
+            locked_by TEXT,
+            result TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (visible_at) WHERE status IN ('queued', 'running')
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dead_letter (
+            job_id INTEGER PRIMARY KEY REFERENCES jobs (id),
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            failed_at TEXT NOT NULL
+        )
+    ''')
+
+def _migration_unique_charge_ids(conn):
+    """One charge per gateway transaction id, which refunds and get_charge() look it up by."""
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge_transaction
+        ON payments (transaction_id) WHERE kind = 'charge'
+    ''')
+
+MIGRATIONS = [
+    (1, 'initial schema', _migration_initial_schema),
+    (2, 'borrow_records indexes', _migration_borrow_record_indexes),
+    (3, 'books full-text index', _migration_books_fts),
+    (4, 'books title index', _migration_books_title_index),
+    (5, 'patron summary', _migration_patron_summary),
+    (6, 'change counters', _migration_change_counters),
+    (7, 'loan epoch columns', _migration_loan_epochs),
+    (8, 'overdue runs', _migration_overdue_runs),
+    (9, 'fee settlements', _migration_fee_settlements),
+    (10, 'payments ledger', _migration_payments),
+    (11, 'job queue', _migration_jobs),
+    (12, 'change counter timestamps', _migration_change_timestamps),
+    (13, 'database id', _migration_database_id),
+    (14, 'planner statistics', _migration_planner_stats),
+    (15, 'unique charge transaction ids', _migration_unique_charge_ids),
+]
+
+def get_schema_version() -> int:
+    """Get the highest migration version applied to the current DATABASE."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT MAX(version) AS version FROM schema_migrations').fetchone()
+        return row['version'] or 0
+    except sqlite3.OperationalError:
+        return 0  # schema_migrations does not exist yet
+    finally:
+        conn.close()
+
+def migrate(target: Optional[int] = None) -> int:
+    """
+    Apply pending migrations up to target (default: latest).
     
-    conn.commit()
-    conn.close()
+    Returns:
+        int: the schema version after migrating
+    """
+    with get_db_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    for version, name, step in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with transaction() as conn:
+            # Re-checked under the write lock in case another worker got here first
+            applied = conn.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone()
+            if applied:
+                continue
+            step(conn)
+            conn.execute('INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                         (version, name, datetime.now().isoformat()))
+    return get_schema_version()
+
+def analyze_database() -> None:
+    """
+    Refresh the query planner's statistics (sqlite_stat1) from the current
+    data, then recycle the connection pool so every connection uses them.
+    Run it after large imports or periodically (`flask analyze`): they are
+    what lets the planner prefer the partial open-loan indexes.
+    """
+    with get_db_connection() as conn:
+        _analyze(conn)
+        conn.commit()
+    get_pool().recycle()
+
+def init_database():
+    """Initialize the database by applying any pending schema migrations."""
+    invalidate_book_cache()
+    reset_change_tracking()
+    migrate()
 
 def add_sample_data():
     """Add sample data to the database if it's empty."""
-    conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+    with get_db_connection() as conn:
+        book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
     
-    if book_count == 0:
-        # Add sample books
-        sample_books = [
-            ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
-            ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
-            ('1984', 'George Orwell', '9780451524935', 1)
-        ]
+        if book_count == 0:
+            # Add sample books
+            sample_books = [
+                ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
+                ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
+                ('1984', 'George Orwell', '9780451524935', 1)
+            ]
         
-        for title, author, isbn, copies in sample_books:
-            conn.execute('''
-                INSERT INTO books (title, author, isbn, total_copies, available_copies)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (title, author, isbn, copies, copies))
+            for title, author, isbn, copies in sample_books:
+                conn.execute('''
+                    INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (title, author, isbn, copies, copies))
         
-        # Make 1984 unavailable by adding a borrow record
-        conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', ('123456', 3, 
-              (datetime.now() - timedelta(days=5)).isoformat(),
-              (datetime.now() + timedelta(days=9)).isoformat()))
-        
-        # Update available copies for 1984
-        conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
+            # Make 1984 unavailable by adding a borrow record
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', ('123456', 3, 
+                  (datetime.now() - timedelta(days=5)).isoformat(),
+                  (datetime.now() + timedelta(days=9)).isoformat()))
         
-        conn.commit()
-    
-    conn.close()
+            # Update available copies for 1984
+            conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
+
+            conn.commit()
+            invalidate_book_cache()
+
 
 # Helper Functions for Database Operations
 
-def get_all_books() -> List[Dict]:
+# Column lists matching the Book and Loan constructors, for their row factories
+BOOK_COLUMNS = 'id, title, author, isbn, total_copies, available_copies'
+_JOINED_BOOK_COLUMNS = 'b.id, b.title, b.author, b.isbn, b.total_copies, b.available_copies'
+_LOAN_COLUMNS = 'br.id, br.patron_id, br.book_id, b.title, b.author, br.borrow_date, br.due_date, br.return_date'
+
+def _fetch_records(conn, factory, sql: str, params: tuple = ()) -> list:
+    """Run a query whose rows are built by factory instead of sqlite3.Row."""
+    cursor = conn.cursor()
+    cursor.row_factory = factory
+    return cursor.execute(sql, params).fetchall()
+
+def get_all_books() -> List[Book]:
     """Get all books from the database."""
-    conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
-    return [dict(book) for book in books]
+    with get_db_connection() as conn:
+        books = _fetch_records(conn, book_factory, f'SELECT {BOOK_COLUMNS} FROM books ORDER BY title')
+    return books
+
+def encode_cursor(values) -> str:
+    """Encode a keyset position (a JSON-serializable value) as an opaque URL-safe cursor."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str):
+    """
+    Decode a cursor produced by encode_cursor().
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor.') from e
 
-def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
+def get_books_page(after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None,
+                   limit: int = 20) -> List[Book]:
+    """
+    Get up to limit books in (title, id) order, strictly after or before the
+    given (title, id) key. Seeks through idx_books_title_id, so every page
+    costs the same however deep it is.
+    """
+    with get_db_connection() as conn:
+        if after is not None:
+            books = _fetch_records(conn, book_factory, f'''
+                SELECT {BOOK_COLUMNS} FROM books WHERE (title, id) > (?, ?) ORDER BY title, id LIMIT ?
+            ''', (after[0], after[1], limit))
+        elif before is not None:
+            books = _fetch_records(conn, book_factory, f'''
+                SELECT {BOOK_COLUMNS} FROM books WHERE (title, id) < (?, ?) ORDER BY title DESC, id DESC LIMIT ?
+            ''', (before[0], before[1], limit))
+            books.reverse()
+        else:
+            books = _fetch_records(conn, book_factory, f'SELECT {BOOK_COLUMNS} FROM books ORDER BY title, id LIMIT ?',
+                                   (limit,))
+    return books
+
+def _iter_rows(sql: str, params: tuple, batch_size: int, factory=None) -> Iterator:
+    """
+    Stream a query's rows with fetchmany(), holding one pooled connection
+    until the iterator is exhausted or closed. Memory stays at one batch
+    however large the result is. Rows are dicts unless a record factory is given.
+    """
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        cursor = conn.cursor()
+        if factory is not None:
+            cursor.row_factory = factory
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if factory is not None:
+                yield from rows
+            else:
+                for row in rows:
+                    yield dict(row)
+    finally:
+        conn.close()
+
+def iter_books(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Book]:
+    """Yield every book in id order."""
+    return _iter_rows(f'SELECT {BOOK_COLUMNS} FROM books ORDER BY id', (), batch_size, book_factory)
+
+def iter_loans(patron_id: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+               batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """
+    Yield borrow records in id order with the book title, optionally only one
+    patron's and only those borrowed in [start, end).
+    """
+    clauses, params = [], []
+    if patron_id is not None:
+        clauses.append('br.patron_id = ?')
+        params.append(patron_id)
+    if start is not None:
+        clauses.append('br.borrow_date >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        clauses.append('br.borrow_date < ?')
+        params.append(end.isoformat())
+    where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    return _iter_rows(f'''
+        SELECT br.id, br.patron_id, br.book_id, b.title,
+               br.borrow_date, br.due_date, br.return_date
+        FROM borrow_records br
+        LEFT JOIN books b ON b.id = br.book_id
+        {where}
+        ORDER BY br.id
+    ''', tuple(params), batch_size)
+
+def iter_open_loans(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Yield id, patron_id, book_id and due_date of every loan not yet returned."""
+    return _iter_rows('''
+        SELECT id, patron_id, book_id, due_date FROM borrow_records
+        WHERE return_date IS NULL
+        ORDER BY id
+    ''', (), batch_size)
 
-def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
+def _epoch_seconds(value: datetime) -> int:
+    """value as whole seconds since 1970-01-01, matching the *_ts columns."""
+    return (value - datetime(1970, 1, 1)) // timedelta(seconds=1)
+
+def get_loan_epoch_status() -> Dict:
+    """Backfill progress of the loan epoch columns: next_id, end_id, finished_at and ready."""
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        row = conn.execute('SELECT next_id, end_id, finished_at FROM loan_epoch_backfill').fetchone()
+    except sqlite3.OperationalError:
+        row = None  # migration 7 not applied
+    finally:
+        conn.close()
+    if row is None:
+        return {'next_id': None, 'end_id': None, 'finished_at': None, 'ready': False}
+    status = dict(row)
+    status['ready'] = status['finished_at'] is not None
+    return status
+
+def backfill_loan_epochs(batch_size: int = LOAN_EPOCH_BATCH_SIZE, max_batches: Optional[int] = None,
+                         pause: float = 0.0) -> Dict:
+    """
+    Fill borrow_ts/due_ts/return_ts for rows written before migration 7.
+
+    Walks the rowid range those rows occupy in batches of batch_size, each
+    in its own short write transaction that also records how far it got,
+    so it can run next to live traffic, be stopped at any point and resume
+    where it left off. Rows written since the migration already have their
+    epochs from the triggers. Overdue scans switch to the due_ts index once
+    the last batch commits.
+
+    Returns:
+        Dict: {'updated': rows filled by this call, 'unparsed': rows whose
+        due_date SQLite could not read, plus get_loan_epoch_status()}
+    """
+    updated = unparsed = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction() as conn:
+            row = conn.execute('SELECT next_id, end_id, finished_at FROM loan_epoch_backfill').fetchone()
+            if row is None or row['finished_at'] is not None:
+                break
+            start, end = row['next_id'], min(row['next_id'] + batch_size - 1, row['end_id'])
+            cursor = conn.execute(f'''
+                UPDATE borrow_records SET {_LOAN_EPOCH_SET} WHERE id BETWEEN ? AND ?
+            ''', (start, end))
+            updated += cursor.rowcount
+            unparsed += conn.execute('''
+                SELECT COUNT(*) FROM borrow_records WHERE id BETWEEN ? AND ? AND due_ts IS NULL
+            ''', (start, end)).fetchone()[0]
+            finished = datetime.now().isoformat() if end >= row['end_id'] else None
+            conn.execute('UPDATE loan_epoch_backfill SET next_id = ?, finished_at = ?', (end + 1, finished))
+        batches += 1
+        if finished:
+            analyze_database()  # due_ts is filled in: let the planner see it
+        if pause:
+            time.sleep(pause)
+    return {'updated': updated, 'unparsed': unparsed, **get_loan_epoch_status()}
+
+def iter_overdue_loans(as_of: datetime, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """
+    Yield id, patron_id, book_id and due_date of every open loan due at or
+    before as_of, in due order.
+
+    Once the epoch backfill has finished this is a range scan over
+    idx_borrow_records_open_due, reading only the loans that are actually
+    overdue; the due_date text settles the one boundary second that whole
+    epoch seconds cannot. Before that it falls back to checking every open
+    loan's due_date.
+    """
+    if not get_loan_epoch_status()['ready']:
+        return (loan for loan in iter_open_loans(batch_size)
+                if datetime.fromisoformat(loan['due_date']) <= as_of)
+    sql, params = _overdue_query(as_of)
+    return _iter_rows(sql, params, batch_size)
+
+def _overdue_query(as_of: datetime, after: Optional[Tuple[int, int]] = None) -> Tuple[str, Tuple]:
+    """SQL for open loans due at or before as_of in (due_ts, id) order, optionally after a (due_ts, id) key."""
+    cutoff = _epoch_seconds(as_of)
+    keyset, params = '', (cutoff, cutoff, as_of.isoformat())
+    if after is not None:
+        keyset, params = 'AND (due_ts, id) > (?, ?)', params + tuple(after)
+    return f'''
+        SELECT id, patron_id, book_id, due_date, due_ts
+        FROM borrow_records
+        WHERE return_date IS NULL AND due_ts <= ? AND (due_ts < ? OR due_date <= ?) {keyset}
+        ORDER BY due_ts, id
+    ''', params
+
+def get_overdue_loans_page(as_of: datetime, after: Optional[Tuple[int, int]] = None,
+                           limit: int = EXPORT_BATCH_SIZE) -> List[Dict]:
+    """
+    Up to limit open loans due at or before as_of, in (due_ts, id) order and
+    strictly after the given (due_ts, id) key, as dicts with id, patron_id,
+    book_id, due_date and due_ts. Needs the loan epoch backfill to be
+    finished (see backfill_loan_epochs()).
+    """
+    sql, params = _overdue_query(as_of, after)
+    with get_db_connection() as conn:
+        rows = conn.execute(sql + ' LIMIT ?', params + (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+# Overdue job runs. A worker holds a run through a lease (lease_owner,
+# lease_expires) that it renews with every chunk it saves; a run whose
+# lease has lapsed was interrupted and can be claimed and resumed from its
+# checkpoint by any worker.
+
+def claim_overdue_run(as_of: datetime, owner: str, scheduled_for: Optional[str] = None,
+                      resume: bool = True) -> Tuple[Dict, bool]:
+    """
+    Find or start the overdue run to work on and take its lease.
+
+    With scheduled_for, that date's nightly run (started at as_of if it does
+    not exist yet); otherwise the latest unfinished run if resume is set, or
+    a new run at as_of.
+
+    Returns:
+        tuple: (run row as a dict, whether owner now holds it) - a run that is
+        finished or leased by another live worker is returned unclaimed
+    """
+    now = time.time()
+    with transaction() as conn:
+        if scheduled_for is not None:
+            row = conn.execute('SELECT * FROM overdue_runs WHERE scheduled_for = ?', (scheduled_for,)).fetchone()
+        elif resume:
+            row = conn.execute('''
+                SELECT * FROM overdue_runs WHERE status = 'running' ORDER BY id DESC LIMIT 1
+            ''').fetchone()
+        else:
+            row = None
+        if row is None:
+            run_id = conn.execute('''
+                INSERT INTO overdue_runs (as_of, scheduled_for, started_at, lease_owner, lease_expires)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (as_of.isoformat(), scheduled_for, datetime.now().isoformat(), owner,
+                  now + OVERDUE_LEASE_SECONDS)).lastrowid
+        else:
+            run_id = row['id']
+            held = row['lease_expires'] is not None and row['lease_expires'] > now and row['lease_owner'] != owner
+            if row['status'] != 'running' or held:
+                return dict(row), False
+            conn.execute('UPDATE overdue_runs SET lease_owner = ?, lease_expires = ? WHERE id = ?',
+                         (owner, now + OVERDUE_LEASE_SECONDS, run_id))
+        return dict(conn.execute('SELECT * FROM overdue_runs WHERE id = ?', (run_id,)).fetchone()), True
+
+def save_overdue_chunk(run_id: int, owner: str, rows: List[Tuple], checkpoint: Tuple[int, int],
+                       fees: float, elapsed: float) -> bool:
+    """
+    Write one chunk of snapshot rows (loan_id, patron_id, book_id, due_date,
+    days_overdue, fee) and move the run's checkpoint past them, in one
+    transaction, renewing owner's lease.
+
+    Returns:
+        bool: False (and nothing written) if owner no longer holds the run
+    """
+    with transaction() as conn:
+        updated = conn.execute('''
+            UPDATE overdue_runs SET
+                checkpoint_due_ts = ?, checkpoint_id = ?,
+                loans = loans + ?, total_fees = total_fees + ?, elapsed_seconds = elapsed_seconds + ?,
+                lease_expires = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'running'
+        ''', (checkpoint[0], checkpoint[1], len(rows), fees, elapsed,
+              time.time() + OVERDUE_LEASE_SECONDS, run_id, owner)).rowcount
+        if not updated:
+            return False
+        conn.executemany('''
+            INSERT OR REPLACE INTO overdue_snapshot
+                (run_id, loan_id, patron_id, book_id, due_date, days_overdue, fee)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(run_id,) + row for row in rows])
+    return True
+
+def release_overdue_run(run_id: int, owner: str) -> None:
+    """Give up owner's lease on an unfinished run so it can be resumed straight away."""
+    with transaction() as conn:
+        conn.execute('UPDATE overdue_runs SET lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?',
+                     (run_id, owner))
+
+def finish_overdue_run(run_id: int, owner: str) -> bool:
+    """Mark owner's run finished and drop all but the newest OVERDUE_KEEP_RUNS finished runs."""
+    with transaction() as conn:
+        updated = conn.execute('''
+            UPDATE overdue_runs SET status = 'finished', finished_at = ?, lease_owner = NULL, lease_expires = NULL
+            WHERE id = ? AND lease_owner = ? AND status = 'running'
+        ''', (datetime.now().isoformat(), run_id, owner)).rowcount
+        stale = [row[0] for row in conn.execute('''
+            SELECT id FROM overdue_runs WHERE status = 'finished' ORDER BY id DESC LIMIT -1 OFFSET ?
+        ''', (OVERDUE_KEEP_RUNS,))]
+        conn.executemany('DELETE FROM overdue_snapshot WHERE run_id = ?', [(i,) for i in stale])
+        conn.executemany('DELETE FROM overdue_runs WHERE id = ?', [(i,) for i in stale])
+    return bool(updated)
+
+def get_overdue_run(run_id: Optional[int] = None) -> Optional[Dict]:
+    """One overdue run by id, or the latest finished run."""
+    with get_db_connection() as conn:
+        if run_id is None:
+            row = conn.execute("SELECT * FROM overdue_runs WHERE status = 'finished' ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            row = conn.execute('SELECT * FROM overdue_runs WHERE id = ?', (run_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_overdue_snapshot_page(run_id: int, after: Optional[int] = None, limit: int = 50) -> List[Dict]:
+    """Up to limit snapshot rows of a run in loan id order, strictly after loan id after."""
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT s.loan_id, s.patron_id, s.book_id, b.title, s.due_date, s.days_overdue, s.fee
+            FROM overdue_snapshot s
+            LEFT JOIN books b ON b.id = s.book_id
+            WHERE s.run_id = ? AND s.loan_id > ?
+            ORDER BY s.loan_id
+            LIMIT ?
+        ''', (run_id, after or 0, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+# Late-fee settlements. The amount a loan still owes is its fee as of now
+# minus what its pending and paid settlement items already cover, so fees
+# that keep accruing on an open loan can be settled again for the
+# difference, but never twice for the same days.
+
+def get_patron_fee_lines(patron_id: str) -> List[Dict]:
+    """
+    Every open loan of a patron with its book title, due_date and the amount
+    already settled, in one query (through the open-loan index).
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT br.id AS loan_id, br.book_id, b.title, br.due_date, COALESCE(paid.amount, 0) AS settled
+            FROM borrow_records br
+            JOIN books b ON b.id = br.book_id
+            LEFT JOIN (
+                SELECT i.loan_id, SUM(i.amount) AS amount
+                FROM fee_settlements s JOIN fee_settlement_items i ON i.settlement_id = s.id
+                WHERE s.patron_id = ? AND s.status != 'failed'
+                GROUP BY i.loan_id
+            ) paid ON paid.loan_id = br.id
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date, br.id
+        ''', (patron_id, patron_id)).fetchall()
+    return [dict(row) for row in rows]
+
+def get_fee_loan(patron_id: str, book_id: int) -> Optional[Dict]:
+    """
+    The loan R5 charges for a patron and book (the open one, else the most
+    recent) as {'loan_id', 'settled'}, or None if they never borrowed it.
+    """
+    with get_db_connection() as conn:
+        row = conn.execute('''
+            SELECT br.id AS loan_id, (
+                SELECT COALESCE(SUM(i.amount), 0)
+                FROM fee_settlement_items i JOIN fee_settlements s ON s.id = i.settlement_id
+                WHERE i.loan_id = br.id AND s.status != 'failed'
+            ) AS settled
+            FROM borrow_records br
+            WHERE br.patron_id = ? AND br.book_id = ?
+            ORDER BY br.return_date IS NULL DESC, br.borrow_date DESC
+            LIMIT 1
+        ''', (patron_id, book_id)).fetchone()
+    return dict(row) if row else None
+
+def create_fee_settlement(patron_id: str, as_of: datetime, items: List[Tuple[int, int, int, float]]) -> int:
+    """
+    Record a pending settlement of items (loan_id, book_id, days_overdue,
+    amount). Call it in the transaction that read the amounts owed.
+
+    Returns:
+        int: the settlement id
+    """
+    with transaction() as conn:
+        settlement_id = conn.execute('''
+            INSERT INTO fee_settlements (patron_id, amount, as_of, created_at) VALUES (?, ?, ?, ?)
+        ''', (patron_id, round(sum(item[3] for item in items), 2), as_of.isoformat(),
+              datetime.now().isoformat())).lastrowid
+        conn.executemany('''
+            INSERT INTO fee_settlement_items (settlement_id, loan_id, book_id, days_overdue, amount)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(settlement_id,) + tuple(item) for item in items])
+    return settlement_id
+
+def complete_fee_settlement(settlement_id: int, status: str, transaction_id: Optional[str] = None,
+                            message: Optional[str] = None) -> None:
+    """Mark a pending settlement 'paid' (with the gateway's transaction id) or 'failed'."""
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE fee_settlements SET status = ?, transaction_id = ?, message = ?, settled_at = ?
+            WHERE id = ? AND status = 'pending'
+        ''', (status, transaction_id, message, datetime.now().isoformat(), settlement_id))
+
+def get_fee_settlement(settlement_id: int) -> Optional[Dict]:
+    """One settlement with its items (a list of dicts under 'items')."""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT * FROM fee_settlements WHERE id = ?', (settlement_id,)).fetchone()
+        items = conn.execute('''
+            SELECT i.loan_id, i.book_id, b.title, i.days_overdue, i.amount
+            FROM fee_settlement_items i LEFT JOIN books b ON b.id = i.book_id
+            WHERE i.settlement_id = ? ORDER BY i.loan_id
+        ''', (settlement_id,)).fetchall()
+    if row is None:
+        return None
+    return dict(row) | {'items': [dict(item) for item in items]}
+
+# Payments ledger. Every charge and refund is recorded under its idempotency
+# key before the gateway is called and updated with the outcome, so a
+# repeated request finds the stored result instead of paying twice.
+
+_PAYMENT_SETTLEMENT_STATUS = {'succeeded': 'paid', 'declined': 'failed', 'error': 'failed'}
+
+def get_payment(idempotency_key: str) -> Optional[Dict]:
+    """The ledger entry for an idempotency key, if any."""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+    return dict(row) if row else None
+
+def record_payment(idempotency_key: str, kind: str, amount: float, request: Optional[Dict] = None,
+                   patron_id: Optional[str] = None, refund_of: Optional[str] = None,
+                   settlement_id: Optional[int] = None) -> Tuple[Dict, bool]:
+    """
+    Add a 'processing' ledger entry for a charge or refund about to be sent,
+    unless one with the key already exists.
+
+    Returns:
+        tuple: (ledger entry as a dict, whether it was created)
+    """
+    with transaction() as conn:
+        created = conn.execute('''
+            INSERT OR IGNORE INTO payments
+                (idempotency_key, kind, patron_id, amount, request, refund_of, settlement_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, kind, patron_id, amount, json.dumps(request or {}), refund_of, settlement_id,
+              datetime.now().isoformat(), time.time())).rowcount
+        row = conn.execute('SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+    return dict(row), bool(created)
+
+def claim_payment(payment_id: int) -> bool:
+    """
+    Take over an 'unknown' entry, or a 'processing' one older than
+    PAYMENT_PROCESSING_SECONDS, to send it again. False if it is not one of
+    those (any more), e.g. because another request claimed it first.
+    """
+    with transaction() as conn:
+        return bool(conn.execute('''
+            UPDATE payments SET status = 'processing', attempts = attempts + 1, updated_at = ?
+            WHERE id = ? AND (status = 'unknown' OR (status = 'processing' AND updated_at < ?))
+        ''', (time.time(), payment_id, time.time() - PAYMENT_PROCESSING_SECONDS)).rowcount)
+
+def finish_payment(payment_id: int, status: str, transaction_id: Optional[str] = None,
+                   message: Optional[str] = None) -> Dict:
+    """
+    Store the gateway's outcome of a ledger entry, and settle or release the
+    fee settlement it pays for ('unknown' keeps the fees held).
+    Returns the updated entry.
+    """
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE payments SET status = ?, transaction_id = ?, message = ?, updated_at = ? WHERE id = ?
+        ''', (status, transaction_id, message, time.time(), payment_id))
+        row = dict(conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone())
+        if row['settlement_id'] is not None and status in _PAYMENT_SETTLEMENT_STATUS:
+            complete_fee_settlement(row['settlement_id'], _PAYMENT_SETTLEMENT_STATUS[status], transaction_id, message)
+    return row
+
+def get_unresolved_payments(patron_id: str) -> List[Dict]:
+    """A patron's charges whose outcome is unknown, or whose processing has stalled."""
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT * FROM payments
+            WHERE patron_id = ? AND kind = 'charge'
+              AND (status = 'unknown' OR (status = 'processing' AND updated_at < ?))
+            ORDER BY id
+        ''', (patron_id, time.time() - PAYMENT_PROCESSING_SECONDS)).fetchall()
+    return [dict(row) for row in rows]
 
-def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
-    """Get currently borrowed books for a patron."""
+def get_charge(transaction_id: str) -> Optional[Dict]:
+    """
+    A succeeded charge by gateway transaction id, with 'refunded': the sum of
+    its refunds that succeeded or may still succeed.
+    """
+    with get_db_connection() as conn:
+        row = conn.execute('''
+            SELECT p.*, (
+                SELECT COALESCE(SUM(r.amount), 0) FROM payments r
+                WHERE r.refund_of = p.transaction_id AND r.kind = 'refund'
+                  AND r.status IN ('processing', 'succeeded', 'unknown')
+            ) AS refunded
+            FROM payments p
+            WHERE p.transaction_id = ? AND p.kind = 'charge' AND p.status = 'succeeded'
+        ''', (transaction_id,)).fetchone()
+    return dict(row) if row else None
+
+# Job queue. Workers claim jobs with a visibility timeout instead of a lock,
+# so a job whose worker died simply becomes claimable again; each claim
+# counts as an attempt, and a job out of attempts moves to dead_letter.
+
+def _job_dict(row) -> Dict:
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    return job
+
+def enqueue_job(kind: str, payload: Dict, idempotency_key: Optional[str] = None,
+                max_attempts: int = JOB_MAX_ATTEMPTS) -> Tuple[Dict, bool]:
+    """
+    Queue a job, unless one with the same idempotency key exists.
+
+    Returns:
+        tuple: (job as a dict, whether it was created)
+    """
+    with transaction() as conn:
+        if idempotency_key is not None:
+            row = conn.execute('SELECT * FROM jobs WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+            if row is not None:
+                return _job_dict(row), False
+        row = conn.execute('''
+            INSERT INTO jobs (kind, payload, idempotency_key, max_attempts, visible_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING *
+        ''', (kind, json.dumps(payload), idempotency_key, max_attempts, time.time(),
+              datetime.now().isoformat())).fetchone()
+    return _job_dict(row), True
+
+def _dead_letter(conn, job, error: Optional[str]) -> None:
+    conn.execute('''
+        UPDATE jobs SET status = 'dead', error = ?, locked_by = NULL, finished_at = ? WHERE id = ?
+    ''', (error, datetime.now().isoformat(), job['id']))
+    conn.execute('''
+        INSERT OR REPLACE INTO dead_letter (job_id, kind, payload, attempts, error, failed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (job['id'], job['kind'], job['payload'], job['attempts'], error, datetime.now().isoformat()))
+
+def claim_job(owner: str, visibility: float = JOB_VISIBILITY_SECONDS) -> Optional[Dict]:
+    """
+    Claim the next claimable job for owner, hiding it from other workers for
+    visibility seconds. A job that has already used up its attempts (its
+    workers kept dying) goes to the dead letter table instead.
+    Returns the claimed job, or None if there is none.
+    """
+    while True:
+        with transaction() as conn:
+            now = time.time()
+            row = conn.execute('''
+                UPDATE jobs SET status = 'running', locked_by = ?, attempts = attempts + 1, visible_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status IN ('queued', 'running') AND visible_at <= ?
+                    ORDER BY visible_at LIMIT 1
+                )
+                RETURNING *
+            ''', (owner, now + visibility, now)).fetchone()
+            if row is None:
+                return None
+            if row['attempts'] <= row['max_attempts']:
+                return _job_dict(row)
+            _dead_letter(conn, row, row['error'] or 'Worker did not finish the job in time')
+
+def complete_job(job_id: int, owner: str, result: Dict) -> bool:
+    """Store a job's result. False if owner no longer holds the job (its visibility timed out)."""
+    with transaction() as conn:
+        return bool(conn.execute('''
+            UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, locked_by = NULL, finished_at = ?
+            WHERE id = ? AND locked_by = ? AND status = 'running'
+        ''', (json.dumps(result), datetime.now().isoformat(), job_id, owner)).rowcount)
+
+def fail_job(job_id: int, owner: str, error: str, retry_in: float, payload: Optional[Dict] = None) -> Optional[str]:
+    """
+    Record a failed attempt of owner's job: queue it again in retry_in
+    seconds (with payload, if given, replacing its payload), or move it to
+    the dead letter table once it is out of attempts.
+
+    Returns:
+        str: the job's new status ('queued' or 'dead'), or None if owner no
+        longer holds it
+    """
+    with transaction() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ? AND locked_by = ? AND status = 'running'",
+                           (job_id, owner)).fetchone()
+        if row is None:
+            return None
+        if payload is not None:
+            conn.execute('UPDATE jobs SET payload = ? WHERE id = ?', (json.dumps(payload), job_id))
+            row = dict(row) | {'payload': json.dumps(payload)}
+        if row['attempts'] >= row['max_attempts']:
+            _dead_letter(conn, row, error)
+            return 'dead'
+        conn.execute('''
+            UPDATE jobs SET status = 'queued', error = ?, locked_by = NULL, visible_at = ? WHERE id = ?
+        ''', (error, time.time() + retry_in, job_id))
+    return 'queued'
+
+def get_job(job_id: int) -> Optional[Dict]:
+    """One job with its payload and result decoded."""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return _job_dict(row) if row else None
+
+def get_dead_letters(limit: int = 50) -> List[Dict]:
+    """The most recent dead-lettered jobs."""
+    with get_db_connection() as conn:
+        rows = conn.execute('SELECT * FROM dead_letter ORDER BY failed_at DESC, job_id DESC LIMIT ?',
+                            (limit,)).fetchall()
+    return [dict(row) | {'payload': json.loads(row['payload'])} for row in rows]
+
+def requeue_dead_job(job_id: int) -> bool:
+    """Give a dead-lettered job a fresh set of attempts. False if it is not dead-lettered."""
+    with transaction() as conn:
+        if not conn.execute('DELETE FROM dead_letter WHERE job_id = ?', (job_id,)).rowcount:
+            return False
+        conn.execute('''
+            UPDATE jobs SET status = 'queued', attempts = 0, visible_at = ?, finished_at = NULL WHERE id = ?
+        ''', (time.time(), job_id))
+    return True
+
+def get_job_stats() -> Dict:
+    """Jobs per status, and how long the oldest claimable job has been waiting."""
+    with get_db_connection() as conn:
+        counts = {row['status']: row['count'] for row in
+                  conn.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')}
+        oldest = conn.execute('''
+            SELECT MIN(visible_at) FROM jobs WHERE status IN ('queued', 'running') AND visible_at <= ?
+        ''', (time.time(),)).fetchone()[0]
+    return {
+        'by_status': counts,
+        'oldest_ready_seconds': round(time.time() - oldest, 3) if oldest is not None else 0.0,
+    }
+
+def _patron_history_query(patron_id: str, before: Optional[Tuple[str, int]], start: Optional[datetime],
+                          end: Optional[datetime]) -> Tuple[str, List]:
+    """SQL for a patron's loans newest first, keyed on (borrow_date, id) and read through idx_borrow_records_patron_date."""
+    clauses, params = ['br.patron_id = ?'], [patron_id]
+    if before is not None:
+        clauses.append('(br.borrow_date, br.id) < (?, ?)')
+        params.extend(before)
+    if start is not None:
+        clauses.append('br.borrow_date >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        clauses.append('br.borrow_date < ?')
+        params.append(end.isoformat())
+    sql = f'''
+        SELECT br.id, br.book_id, b.title, b.author,
+               br.borrow_date, br.due_date, br.return_date
+        FROM borrow_records br
+        JOIN books b ON b.id = br.book_id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY br.borrow_date DESC, br.id DESC
+    '''
+    return sql, params
+
+def get_patron_history_page(patron_id: str, before: Optional[Tuple[str, int]] = None, limit: int = 20,
+                            start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict]:
+    """
+    One page of a patron's borrowing history, newest first, optionally only
+    loans borrowed in [start, end). before is the (borrow_date, id) of the
+    last row of the previous page; dates are returned as stored (ISO text).
+    """
+    sql, params = _patron_history_query(patron_id, before, start, end)
+    with get_db_connection() as conn:
+        rows = conn.execute(sql + ' LIMIT ?', (*params, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+def iter_patron_history(patron_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Yield a patron's whole borrowing history in get_patron_history_page order."""
+    sql, params = _patron_history_query(patron_id, None, start, end)
+    return _iter_rows(sql, tuple(params), batch_size)
+
+def invalidate_book_cache(book_ids: Optional[Iterable[int]] = None, isbns: Iterable[str] = ()) -> None:
+    """
+    Drop cached rows for book_ids (and ISBN mappings for isbns), or the whole
+    book cache when book_ids is None. Inside db_session() the ids are
+    invalidated again when the session ends.
+    """
+    if book_ids is None:
+        _book_cache.clear()
+        _isbn_cache.clear()
+        keys = [None]
+    else:
+        keys = list(book_ids)
+        _book_cache.invalidate_many((DATABASE, book_id) for book_id in keys)
+        _isbn_cache.invalidate_many((DATABASE, isbn) for isbn in isbns)
+    pending = getattr(_local, 'invalidated_books', None)
+    if pending is not None and _current_session() is not None:
+        pending.update(keys)
+
+_change_listeners: Dict[str, List[Callable[[str], None]]] = {}
+_seen_versions: Dict[str, Dict[str, int]] = {}   # DATABASE -> last versions seen
+_next_poll: Dict[str, float] = {}
+_poll_lock = threading.Lock()
+_poll_stats = {'polls': 0, 'changes': 0}
+
+def get_change_versions() -> Dict[str, int]:
+    """Current version of every change counter ({} before the table exists)."""
     conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
-    
-    borrowed_books = []
-    for record in records:
-        borrowed_books.append({
-            'book_id': record['book_id'],
-            'title': record['title'],
-            'author': record['author'],
-            'borrow_date': datetime.fromisoformat(record['borrow_date']),
-            'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
-        })
+    try:
+        rows = conn.execute('SELECT name, version FROM change_counters').fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+    return {row['name']: row['version'] for row in rows}
+
+def get_change_stamps(counters: Iterable[str]) -> Tuple[str, Tuple[int, ...], Optional[float]]:
+    """
+    The database's random id (counters restart at 0 when a database is
+    recreated, the id does not repeat), the versions of the given change
+    counters in that order (0 for unknown names), and when the latest of
+    them moved (Unix seconds; None before anything was recorded). Two
+    indexed reads, cheap enough for every request.
+    """
+    counters = tuple(counters)
+    with get_db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT name, version, changed_at FROM change_counters WHERE name IN ({','.join('?' * len(counters))})
+        ''', counters).fetchall()
+        row = conn.execute('SELECT token FROM database_id WHERE id = 1').fetchone()
+    found = {row['name']: row for row in rows}
+    changed = [found[name]['changed_at'] for name in counters if name in found and found[name]['changed_at']]
+    versions = tuple(found[name]['version'] if name in found else 0 for name in counters)
+    return row['token'] if row else '', versions, max(changed, default=None)
+
+def add_change_listener(counter: str, callback: Callable[[str], None]) -> None:
+    """Call callback(counter) when poll_changes() sees that counter move."""
+    _change_listeners.setdefault(counter, []).append(callback)
+
+def reset_change_tracking() -> None:
+    """Forget the versions seen for the current DATABASE; the next poll sets a new baseline."""
+    with _poll_lock:
+        _seen_versions.pop(DATABASE, None)
+        _next_poll.pop(DATABASE, None)
+
+def poll_changes(force: bool = False) -> List[str]:
+    """
+    Check change_counters for writes made since the last poll (by any
+    process) and notify the listeners of every counter that moved. Without
+    force this reads the database at most once per CHANGE_POLL_INTERVAL, so
+    it is cheap enough to call before every cache lookup. The first poll
+    for a database only records a baseline.
+
+    Returns:
+        list: names of the counters that changed
+    """
+    now = time.monotonic()
+    with _poll_lock:
+        if not force and now < _next_poll.get(DATABASE, 0.0):
+            return []
+        _next_poll[DATABASE] = now + CHANGE_POLL_INTERVAL
+
+    versions = get_change_versions()
+    with _poll_lock:
+        _poll_stats['polls'] += 1
+        seen = _seen_versions.get(DATABASE)
+        merged = dict(seen or {})
+        changed = []
+        for name, version in versions.items():
+            if seen is not None and version > seen.get(name, 0):
+                changed.append(name)
+            merged[name] = max(version, merged.get(name, version))
+        _seen_versions[DATABASE] = merged
+        _poll_stats['changes'] += len(changed)
+
+    for name in changed:
+        for callback in _change_listeners.get(name, []):
+            callback(name)
+    return changed
+
+def get_change_stats() -> Dict:
+    """Poll interval, counter versions last seen and how many changes were picked up."""
+    with _poll_lock:
+        return {
+            'poll_interval': CHANGE_POLL_INTERVAL,
+            'versions': dict(_seen_versions.get(DATABASE, {})),
+            'polls': _poll_stats['polls'],
+            'changes': _poll_stats['changes'],
+        }
+
+def _on_book_change(counter: str) -> None:
+    # Another process may have changed any row, so drop everything affected
+    if counter == 'catalog':
+        _book_cache.clear()
+        _isbn_cache.clear()
+    elif BOOK_CACHE_MODE == 'full':
+        _book_cache.clear()
+
+add_change_listener('catalog', _on_book_change)
+add_change_listener('availability', _on_book_change)
+
+def get_book_cache_stats() -> Dict:
+    """Mode and hit/miss/eviction counters of the book lookup cache."""
+    return {'mode': BOOK_CACHE_MODE, 'books': _book_cache.stats(), 'isbn': _isbn_cache.stats()}
+
+def _fetch_book(column: str, value) -> Optional[Book]:
+    with get_db_connection() as conn:
+        books = _fetch_records(conn, book_factory, f'SELECT {BOOK_COLUMNS} FROM books WHERE {column} = ?', (value,))
+    return books[0] if books else None
+
+def _cache_bypassed() -> bool:
+    # Reads inside a session may see uncommitted writes, which must never be cached
+    if BOOK_CACHE_MODE == 'off' or _current_session() is not None:
+        return True
+    poll_changes()
+    return False
+
+def get_book_by_id(book_id: int) -> Optional[Book]:
+    """Get a specific book by ID (read through the book cache)."""
+    if _cache_bypassed():
+        return _fetch_book('id', book_id)
+
+    key = (DATABASE, book_id)
+    book = _book_cache.get(key)
+    if book is None:
+        token, isbn_token = _book_cache.load_token(), _isbn_cache.load_token()
+        book = _fetch_book('id', book_id)
+        if book:
+            _book_cache.put(key, book, token)
+            _isbn_cache.put((DATABASE, book.isbn), book_id, isbn_token)
+            book = book.copy()
+        return book
+
+    book = book.copy()
+    if BOOK_CACHE_MODE == 'metadata':
+        with get_db_connection() as conn:
+            row = conn.execute('SELECT available_copies FROM books WHERE id = ?', (book_id,)).fetchone()
+        if row is None:
+            _book_cache.invalidate(key)
+            return None
+        book.available_copies = row['available_copies']
+    return book
+
+def get_book_by_isbn(isbn: str) -> Optional[Book]:
+    """Get a specific book by ISBN (read through the book cache)."""
+    if _cache_bypassed():
+        return _fetch_book('isbn', isbn)
+
+    key = (DATABASE, isbn)
+    book_id = _isbn_cache.get(key)
+    if book_id is not None:
+        book = get_book_by_id(book_id)
+        if book is not None and book.isbn == isbn:
+            return book
+        _isbn_cache.invalidate(key)
+
+    token, row_token = _isbn_cache.load_token(), _book_cache.load_token()
+    book = _fetch_book('isbn', isbn)
+    if book:
+        _isbn_cache.put(key, book.id, token)
+        _book_cache.put((DATABASE, book.id), book.copy(), row_token)
+    return book
+
+def search_books_by_substring(term: str, field: str) -> List[Book]:
+    """
+    Get books whose title or author contains term, ordered like get_all_books().
+    Uses LIKE, which only folds ASCII case; callers needing full Unicode
+    case-insensitivity must re-check the returned rows.
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f"Cannot search books by '{field}'.")
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    with get_db_connection() as conn:
+        books = _fetch_records(conn, book_factory, f'''
+            SELECT {BOOK_COLUMNS} FROM books WHERE {field} LIKE ? ESCAPE '\\' ORDER BY title
+        ''', (f'%{escaped}%',))
+    return books
+
+# Trigram (search) and prefix (suggestion) indexes of titles and authors,
+# keyed by (DATABASE, field), each with the catalog version and highest
+# book id it reflects
+_search_indexes: Dict[Tuple[str, str], Dict] = {}
+_suggest_indexes: Dict[Tuple[str, str], Dict] = {}
+_search_index_lock = threading.Lock()
+
+def _synced_index(conn, field: str, indexes: Dict = _search_indexes, factory=TrigramIndex):
+    """
+    The field's index in indexes (a factory() instance), brought up to date
+    with what conn sees. The catalog counter moves once per inserted,
+    updated or deleted row, so when it has moved by exactly the number of
+    rows added past the last indexed id, those inserts were the only changes
+    and are appended; anything else (an edit or a delete) rebuilds the index.
+    """
+    version = conn.execute("SELECT version FROM change_counters WHERE name = 'catalog'").fetchone()[0]
+    key = (DATABASE, field)
+    with _search_index_lock:
+        entry = indexes.get(key)
+        if entry is not None and entry['version'] >= version:
+            # (ahead of conn when another thread synced from a later snapshot)
+            return entry['index']
+        if entry is not None and version > entry['version']:
+            rows = conn.execute(f'SELECT id, {field} FROM books WHERE id > ? ORDER BY id',
+                                (entry['last_id'],)).fetchall()
+            if len(rows) == version - entry['version']:
+                entry['index'].add_many(rows)
+                entry.update(version=version, last_id=rows[-1][0])
+                return entry['index']
+        index = factory()
+        rows = conn.execute(f'SELECT id, {field} FROM books ORDER BY id').fetchall()
+        index.add_many(rows)
+        indexes[key] = {'index': index, 'version': version, 'last_id': rows[-1][0] if rows else 0}
+        return index
+
+@contextmanager
+def _search_snapshot(field: str, indexes: Dict = _search_indexes, factory=TrigramIndex):
+    """
+    (conn, index) for one consistent read: the field's shared index synced
+    in a read transaction, or inside db_session(), whose uncommitted writes
+    must not reach the shared index, a throwaway index of what it sees.
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f"Cannot search books by '{field}'.")
+    if _current_session() is not None:
+        with db_session() as conn:
+            index = factory()
+            index.add_many(conn.execute(f'SELECT id, {field} FROM books ORDER BY id'))
+            yield conn, index
+        return
+    with transaction(immediate=False) as conn:
+        yield conn, _synced_index(conn, field, indexes, factory)
+
+def _fetch_books_by_id(conn, ids: List[int]) -> Dict[int, Book]:
+    books = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        books.update((book.id, book) for book in _fetch_records(conn, book_factory, f'''
+            SELECT {BOOK_COLUMNS} FROM books WHERE id IN ({','.join('?' * len(chunk))})
+        ''', tuple(chunk)))
+    return books
+
+def get_books_availability(book_ids: List[int]) -> Dict[int, int]:
+    """available_copies of each of book_ids that still exists."""
+    with get_db_connection() as conn:
+        availability = {}
+        for i in range(0, len(book_ids), 500):
+            chunk = book_ids[i:i + 500]
+            availability.update(conn.execute(f'''
+                SELECT id, available_copies FROM books WHERE id IN ({','.join('?' * len(chunk))})
+            ''', tuple(chunk)).fetchall())
+    return availability
+
+def search_books_indexed(term: str, field: str) -> List[Book]:
+    """
+    Get books whose title or author contains term, ignoring case (full
+    Unicode folding, as str.lower() does), ordered like get_all_books().
+    Candidates come from the field's in-memory trigram index instead of a
+    scan of every row.
+    """
+    with _search_snapshot(field) as (conn, index):
+        books = list(_fetch_books_by_id(conn, index.search(term)).values())
+    books.sort(key=lambda book: (book.title, book.id))
+    return books
+
+def search_books_ranked(term: str, field: str, limit: int,
+                        after: Optional[Tuple[int, str, int]] = None) -> Tuple[List[Tuple[Tuple, Book]], int]:
+    """
+    The best limit books whose title or author contains term (matched as
+    search_books_indexed() does), ranked exact match first, then prefix,
+    word-boundary and infix matches, each tier by the field's lowercased
+    text and then id. after is the rank key of the last book of the
+    previous page. Only the returned rows are read from the table.
+
+    Returns:
+        tuple: ([(rank key, book), ...], number of matching books)
+    """
+    with _search_snapshot(field) as (conn, index):
+        keys, total = index.rank(term, limit, after)
+        books = _fetch_books_by_id(conn, [key[2] for key in keys])
+    return [(key, books[key[2]]) for key in keys if key[2] in books], total
+
+def cached_search_page(key: Tuple, compute: Callable[[], Dict]) -> Dict:
+    """
+    compute()'s page of search results ({'status': 'ok', 'books': [...],
+    ...}; other statuses are not cached) for key, a normalized description
+    of the query and page. It is served from the search result cache as
+    long as the catalog version is unchanged, with every book's
+    available_copies read from the database. Bypassed inside db_session(),
+    whose uncommitted writes must never be cached.
+    """
+    if _current_session() is not None:
+        return compute()
+    version = get_change_versions().get('catalog', 0)
+    if _search_cache_versions.get(DATABASE, version) != version:
+        # Everything cached for the old catalog is dead weight now
+        _search_cache.clear()
+    _search_cache_versions[DATABASE] = version
+
+    cache_key = (DATABASE, version) + tuple(key)
+    entry = _search_cache.get(cache_key)
+    if entry is not None:
+        page = dict(entry[1])
+        availability = get_books_availability([book.id for book in page['books']])
+        books = []
+        for book in page['books']:
+            if book.id in availability:
+                book = book.copy()
+                book.available_copies = availability[book.id]
+                books.append(book)
+        page['books'] = books
+        return page
+
+    token = _search_cache.load_token()
+    page = compute()
+    if page.get('status') == 'ok':
+        _search_cache.put(cache_key, (version, dict(page, books=[book.copy() for book in page['books']])), token)
+    return page
+
+def get_search_cache_stats() -> Dict:
+    """Size, memory budget and hit/miss/eviction counters of the search result cache."""
+    return _search_cache.stats()
+
+def suggest_books(prefix: str, limit: int, fields: Tuple[str, ...] = ('title', 'author')) -> List[Dict]:
+    """
+    Up to limit distinct titles and authors for typeahead: those starting
+    with prefix (ignoring case) first, then those with a later word starting
+    with it, each group alphabetically. Served by the fields' in-memory
+    prefix indexes, kept in step with the catalog like the search indexes.
+
+    Returns:
+        list: {'text', 'field', 'books'} dicts, books being how many share the text
+    """
+    found = []
+    for field in fields:
+        with _search_snapshot(field, _suggest_indexes, PrefixIndex) as (_, index):
+            found += [(tier, text, field, label, count) for tier, text, label, count in index.suggest(prefix, limit)]
+    found.sort()
+    return [{'text': label, 'field': field, 'books': count} for _, _, field, label, count in found[:limit]]
+
+def warm_suggest_index() -> None:
+    """Build the title and author prefix indexes now rather than on the first suggestion."""
+    suggest_books('', 1)
+
+def _index_stats(indexes: Dict) -> Dict:
+    with _search_index_lock:
+        entries = {field: entry for (database, field), entry in indexes.items() if database == DATABASE}
+    return {field: entry['index'].stats() | {'catalog_version': entry['version']}
+            for field, entry in entries.items()}
+
+def get_search_index_stats() -> Dict:
+    """Size of the title and author trigram indexes built for the current DATABASE."""
+    return _index_stats(_search_indexes)
+
+def get_suggest_index_stats() -> Dict:
+    """Size of the title and author prefix indexes built for the current DATABASE."""
+    return _index_stats(_suggest_indexes)
+
+FTS_MODES = ('token', 'prefix', 'phrase')
+
+def _fts_query(text: str, mode: str) -> str:
+    """
+    Build an FTS5 MATCH expression from free text. Words are quoted, so FTS5
+    operators typed by users (AND, NEAR, *, ...) are matched as plain words.
+    """
+    words = [w.replace('"', '""') for w in text.split()]
+    if mode == 'phrase':
+        return '"' + ' '.join(words) + '"'
+    if mode == 'prefix':
+        return ' '.join(f'"{w}"*' for w in words)
+    return ' '.join(f'"{w}"' for w in words)
+
+def _fts_match(text: str, field: Optional[str], mode: str) -> Optional[str]:
+    """The MATCH expression for a full-text search, or None when text has no words."""
+    if mode not in FTS_MODES:
+        raise ValueError(f"Unknown full-text mode '{mode}'.")
+    if field not in (None, 'title', 'author'):
+        raise ValueError(f"Cannot search books by '{field}'.")
+    if not text or not text.split():
+        return None
+    query = _fts_query(text, mode)
+    return f'{field} : ({query})' if field else query
+
+def search_books_fulltext(text: str, field: Optional[str] = None, mode: str = 'token', limit: int = 50,
+                          offset: int = 0) -> List[Book]:
+    """
+    Full-text search over title and/or author, best BM25 match first
+    (title matches weigh twice as much as author matches).
     
+    Args:
+        text: words to look for
+        field: 'title', 'author' or None for both
+        mode: 'token' (all words), 'prefix' (all words as prefixes) or 'phrase' (exact word sequence)
+        limit: maximum number of books returned
+        offset: number of best matches to skip
+    """
+    query = _fts_match(text, field, mode)
+    if query is None:
+        return []
+
+    with get_db_connection() as conn:
+        books = _fetch_records(conn, book_factory, f'''
+            SELECT {_JOINED_BOOK_COLUMNS} FROM books_fts
+            JOIN books b ON b.id = books_fts.rowid
+            WHERE books_fts MATCH ?
+            ORDER BY bm25(books_fts, 2.0, 1.0)
+            LIMIT ? OFFSET ?
+        ''', (query, limit, offset))
+    return books
+
+def count_books_fulltext(text: str, field: Optional[str] = None, mode: str = 'token') -> int:
+    """Number of books search_books_fulltext() would find without a limit."""
+    query = _fts_match(text, field, mode)
+    if query is None:
+        return 0
+
+    with get_db_connection() as conn:
+        count = conn.execute('SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH ?', (query,)).fetchone()[0]
+    return count
+
+def get_patron_borrowed_books(patron_id: str) -> List[Loan]:
+    """
+    Get currently borrowed books for a patron. Each Loan parses its
+    borrow_date/due_date on first access and computes is_overdue on read.
+    """
+    with get_db_connection() as conn:
+        borrowed_books = _fetch_records(conn, loan_factory, f'''
+            SELECT {_LOAN_COLUMNS}
+            FROM borrow_records br
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date
+        ''', (patron_id,))
     return borrowed_books
 
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
-    conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrow_records 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
-    conn.close()
+    with get_db_connection() as conn:
+        count = conn.execute('''
+            SELECT COUNT(*) as count FROM borrow_records
+            WHERE patron_id = ? AND return_date IS NULL
+        ''', (patron_id,)).fetchone()['count']
     return count
 
+def get_patron_summary(patron_id: str) -> Optional[Dict]:
+    """Get a patron's materialized summary row (None if they never borrowed)."""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT * FROM patron_summary WHERE patron_id = ?', (patron_id,)).fetchone()
+    return dict(row) if row else None
+
+def iter_patron_summaries(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Yield every stored patron_summary row in patron order."""
+    return _iter_rows('SELECT * FROM patron_summary ORDER BY patron_id', (), batch_size)
+
+def iter_expected_patron_summaries(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Yield patron_id, active_count, total_loans and last_activity recomputed from borrow_records."""
+    return _iter_rows('''
+        SELECT patron_id, SUM(return_date IS NULL) AS active_count, COUNT(*) AS total_loans,
+               MAX(MAX(borrow_date, COALESCE(return_date, ''))) AS last_activity
+        FROM borrow_records
+        GROUP BY patron_id
+        ORDER BY patron_id
+    ''', (), batch_size)
+
+def set_patron_fees(fees: Dict[str, float], as_of: datetime, reset_all: bool = False) -> None:
+    """
+    Store outstanding fees assessed at as_of for the given patrons. With
+    reset_all every other patron is set to 0 at as_of in the same
+    transaction (used by the roll-forward, where fees lists only debtors).
+    """
+    as_of_text = as_of.isoformat()
+    with transaction() as conn:
+        if reset_all:
+            conn.execute('UPDATE patron_summary SET outstanding_fees = 0, fees_as_of = ?', (as_of_text,))
+        conn.executemany('UPDATE patron_summary SET outstanding_fees = ?, fees_as_of = ? WHERE patron_id = ?',
+                         [(amount, as_of_text, patron_id) for patron_id, amount in fees.items()])
+
+def rebuild_patron_summary() -> int:
+    """
+    Recreate every patron_summary row from borrow_records. Fees are reset to
+    0 with no as_of; run the fee roll-forward afterwards.
+    
+    Returns:
+        int: number of patron rows written
+    """
+    with transaction() as conn:
+        conn.execute('DELETE FROM patron_summary')
+        return conn.execute(_PATRON_SUMMARY_COUNTS_SQL).rowcount
+
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
-    conn = get_db_connection()
     try:
-        conn.execute('''
-            INSERT INTO books (title, author, isbn, total_copies, available_copies)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (title, author, isbn, total_copies, available_copies))
-        conn.commit()
-        conn.close()
-        return True
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (title, author, isbn, total_copies, available_copies))
+            conn.commit()
     except Exception as e:
-        conn.close()
         return False
+    invalidate_book_cache([], isbns=[isbn])
+    return True
+
+def insert_books_bulk(books: List[Tuple[str, str, str, int]], on_duplicate: str = 'skip') -> Dict:
+    """
+    Insert a batch of (title, author, isbn, total_copies) rows in one transaction
+    with executemany. Rows whose ISBN is already in the catalog are skipped,
+    or with on_duplicate='upsert' have their title, author and copy count
+    updated (availability moves by the change in total copies, never below 0).
+    
+    Returns:
+        dict: {'inserted': int, 'updated': int, 'duplicates': [isbn, ...]}
+    """
+    if on_duplicate not in ('skip', 'upsert'):
+        raise ValueError("on_duplicate must be 'skip' or 'upsert'.")
+
+    with transaction() as conn:
+        existing: Dict[str, int] = {}
+        isbns = [book[2] for book in books]
+        for i in range(0, len(isbns), 500):
+            chunk = isbns[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT id, isbn FROM books WHERE isbn IN ({placeholders})', chunk).fetchall()
+            existing.update((row['isbn'], row['id']) for row in rows)
+
+        new_books = [book for book in books if book[2] not in existing]
+        duplicates = [book for book in books if book[2] in existing]
+
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(title, author, isbn, copies, copies) for title, author, isbn, copies in new_books])
+
+        updated = 0
+        if on_duplicate == 'upsert' and duplicates:
+            conn.executemany('''
+                UPDATE books
+                SET title = ?, author = ?, total_copies = ?,
+                    available_copies = MAX(0, available_copies + ? - total_copies)
+                WHERE isbn = ?
+            ''', [(title, author, copies, copies, isbn) for title, author, isbn, copies in duplicates])
+            updated = len(duplicates)
+            invalidate_book_cache(existing[book[2]] for book in duplicates)
+
+    return {
+        'inserted': len(new_books),
+        'updated': updated,
+        'duplicates': [] if on_duplicate == 'upsert' else [book[2] for book in duplicates],
+    }
 
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
-    conn = get_db_connection()
     try:
-        conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
-        conn.commit()
-        conn.close()
-        return True
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+            conn.commit()
     except Exception as e:
-        conn.close()
         return False
+    return True
 
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
-    conn = get_db_connection()
     try:
-        conn.execute('''
-            UPDATE books SET available_copies = available_copies + ? WHERE id = ?
-        ''', (change, book_id))
-        conn.commit()
-        conn.close()
-        return True
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE books SET available_copies = available_copies + ? WHERE id = ?
+            ''', (change, book_id))
+            conn.commit()
     except Exception as e:
-        conn.close()
         return False
+    invalidate_book_cache([book_id])
+    return True
 
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
     """Update the return date for a borrow record."""
-    conn = get_db_connection()
     try:
-        conn.execute('''
-            UPDATE borrow_records 
-            SET return_date = ? 
-            WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
-        ''', (return_date.isoformat(), patron_id, book_id))
-        conn.commit()
-        conn.close()
-        return True
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE borrow_records
+                SET return_date = ? 
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+            ''', (return_date.isoformat(), patron_id, book_id))
+            conn.commit()
     except Exception as e:
-        conn.close()
         return False
+    return True
+
+def borrow_book_atomic(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                       max_borrowed: int) -> Tuple[str, Optional[Book]]:
+    """
+    Borrow a book in a single transaction: check the book and the patron's
+    limit, decrement availability and insert the borrow record, then commit once.
+
+    Returns:
+        tuple: (status, book) where status is one of 'ok', 'not_found',
+        'unavailable', 'limit_reached' or 'error'
+    """
+    try:
+        with transaction() as conn:
+            row = conn.execute(f'SELECT {BOOK_COLUMNS} FROM books WHERE id = ?', (book_id,)).fetchone()
+            if not row:
+                return 'not_found', None
+            book = Book(*row)
+            if book.available_copies <= 0:
+                return 'unavailable', book
+
+            count = conn.execute('''
+                SELECT COUNT(*) as count FROM borrow_records
+                WHERE patron_id = ? AND return_date IS NULL
+            ''', (patron_id,)).fetchone()['count']
+            if count >= max_borrowed:
+                return 'limit_reached', book
+
+            # Conditional decrement: never lets available_copies go negative
+            updated = conn.execute('''
+                UPDATE books SET available_copies = available_copies - 1
+                WHERE id = ? AND available_copies > 0
+            ''', (book_id,)).rowcount
+            if not updated:
+                return 'unavailable', book
+
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+            invalidate_book_cache([book_id])
+            return 'ok', book
+    except sqlite3.Error:
+        return 'error', None
+
+def return_book_atomic(patron_id: str, book_id: int, return_date: datetime) -> Tuple[str, Optional[Loan]]:
+    """
+    Return a book in a single transaction: close the patron's oldest open
+    borrow record for the book and increment availability, then commit once.
+
+    Returns:
+        tuple: (status, loan) where status is one of 'ok', 'not_found',
+        'no_record' or 'error'. On success loan is the closed Loan.
+    """
+    try:
+        with transaction() as conn:
+            book = conn.execute('SELECT title, author FROM books WHERE id = ?', (book_id,)).fetchone()
+            if not book:
+                return 'not_found', None
+
+            loan = conn.execute('''
+                SELECT id, borrow_date, due_date FROM borrow_records
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+                ORDER BY borrow_date
+                LIMIT 1
+            ''', (patron_id, book_id)).fetchone()
+            if not loan:
+                return 'no_record', None
+
+            conn.execute('UPDATE borrow_records SET return_date = ? WHERE id = ?',
+                         (return_date.isoformat(), loan['id']))
+            conn.execute('''
+                UPDATE books SET available_copies = available_copies + 1
+                WHERE id = ? AND available_copies < total_copies
+            ''', (book_id,))
+            invalidate_book_cache([book_id])
+            return 'ok', Loan(loan['id'], patron_id, book_id, book['title'], book['author'],
+                              loan['borrow_date'], loan['due_date'], return_date.isoformat())
+    except sqlite3.Error:
+        return 'error', None
@@ -0,0 +1,137 @@
+"""
+Compact record types for rows read from the database.
+
+Book and Loan keep one attribute slot per column instead of a per-row dict,
+and are built straight from the cursor by a row_factory. Both behave as
+read-mostly mappings (record['title'], .get(), dict(record), == with a
+dict) so code and templates written against the old dict rows keep
+working; attribute access (record.title) is the fast path. Loan dates are
+stored as the ISO text SQLite returns and parsed only when first read.
+"""
+
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+class Record(Mapping):
+    """Base for slotted records: a fixed set of keys backed by attributes."""
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self._fields)
+        return f'{type(self).__name__}({values})'
+
+    def to_json(self) -> Dict:
+        """Plain dict for JSON encoding; datetimes become ISO strings."""
+        return {name: (value.isoformat() if isinstance(value, datetime) else value)
+                for name, value in ((name, getattr(self, name)) for name in self._fields)}
+
+
+class Book(Record):
+    """A books row."""
+
+    __slots__ = ('id', 'title', 'author', 'isbn', 'total_copies', 'available_copies')
+    _fields = __slots__
+
+    def __init__(self, id: int, title: str, author: str, isbn: str, total_copies: int, available_copies: int):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.total_copies = total_copies
+        self.available_copies = available_copies
+
+    def copy(self) -> 'Book':
+        return Book(self.id, self.title, self.author, self.isbn, self.total_copies, self.available_copies)
+
+
+def _parse(text: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(text) if text else None
+
+
+class Loan(Record):
+    """
+    A borrow_records row joined with its book's title and author.
+    borrow_date, due_date and return_date are datetimes parsed on first
+    access; the *_iso attributes hold the stored text.
+    """
+
+    __slots__ = ('id', 'patron_id', 'book_id', 'title', 'author',
+                 'borrow_date_iso', 'due_date_iso', 'return_date_iso',
+                 '_borrow_date', '_due_date', '_return_date')
+    _fields = ('id', 'patron_id', 'book_id', 'title', 'author',
+               'borrow_date', 'due_date', 'return_date', 'is_overdue')
+
+    def __init__(self, id: int, patron_id: str, book_id: int, title: Optional[str], author: Optional[str],
+                 borrow_date: str, due_date: str, return_date: Optional[str]):
+        self.id = id
+        self.patron_id = patron_id
+        self.book_id = book_id
+        self.title = title
+        self.author = author
+        self.borrow_date_iso = borrow_date
+        self.due_date_iso = due_date
+        self.return_date_iso = return_date
+        self._borrow_date = self._due_date = self._return_date = None
+
+    @property
+    def borrow_date(self) -> datetime:
+        if self._borrow_date is None:
+            self._borrow_date = _parse(self.borrow_date_iso)
+        return self._borrow_date
+
+    @property
+    def due_date(self) -> datetime:
+        if self._due_date is None:
+            self._due_date = _parse(self.due_date_iso)
+        return self._due_date
+
+    @property
+    def return_date(self) -> Optional[datetime]:
+        if self._return_date is None and self.return_date_iso:
+            self._return_date = _parse(self.return_date_iso)
+        return self._return_date
+
+    @property
+    def is_overdue(self) -> bool:
+        return self.return_date_iso is None and datetime.now() > self.due_date
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        raise TypeError('Loan records are read-only.')
+
+
+def _factory(cls):
+    """row_factory building cls from rows whose columns are exactly cls's constructor arguments, in order."""
+    def row_factory(cursor, row):
+        return cls(*row)
+    return row_factory
+
+
+book_factory = _factory(Book)
+loan_factory = _factory(Loan)
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps default= hook for records."""
+    if isinstance(value, Record):
+        return value.to_json()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -2,11 +2,33 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from library_service import calculate_late_fee_for_book, search_books_in_catalog
+import io
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context, url_for
+from database import (
+    get_book_cache_stats, get_change_stats, get_job_stats, get_loan_epoch_status, get_pool_stats,
+    get_search_cache_stats, get_search_index_stats, get_suggest_index_stats,
+)
+from services.export_service import EXPORT_FORMATS, export_books, export_loans, export_patron_history
+from services.import_service import import_books
+from services.job_service import enqueue_late_fee_payment, enqueue_refund, wait_for_job
+from services.overdue_service import get_overdue_report
+from services.payment_service import get_payment_stats
+from routes.http_cache import conditional_get
+from library_service import (
+    calculate_late_fee_for_book, search_books_page, SEARCH_PAGE_SIZE, get_catalog_page, CATALOG_PAGE_SIZE,
+    get_patron_status_report, get_patron_history, HISTORY_PAGE_SIZE, get_patron_fees_due,
+    get_search_suggestions, SUGGEST_LIMIT
+)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+@api_bp.after_request
+def default_cache_control(response):
+    """Patron, payment and job responses are private and change without notice: never store them."""
+    response.headers.setdefault('Cache-Control', 'no-store')
+    return response
+
 @api_bp.route('/late_fee/<patron_id>/<int:book_id>')
 def get_late_fee(patron_id, book_id):
     """
@@ -16,24 +38,304 @@ def get_late_fee(patron_id, book_id):
     result = calculate_late_fee_for_book(patron_id, book_id)
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
+@api_bp.route('/books')
+@conditional_get('catalog', 'availability')
+def list_books_api():
+    """
+    List catalog books one page at a time, in title order.
+    Pass the returned next_cursor/prev_cursor back as ?cursor= to move between pages.
+    """
+    cursor = request.args.get('cursor') or None
+    try:
+        limit = int(request.args.get('limit', CATALOG_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    page = get_catalog_page(cursor, limit)
+    if page['status'] != 'ok':
+        return jsonify({'error': page['message']}), 400
+    
+    return jsonify({
+        'books': page['books'],
+        'count': len(page['books']),
+        'limit': page['limit'],
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor'],
+    })
+
+@api_bp.route('/books/bulk', methods=['POST'])
+def bulk_import_books_api():
+    """
+    Bulk-import books from the request body or an uploaded 'file' field.
+    Query parameters: format (csv, ndjson or marc; default csv) and
+    on_duplicate (skip or upsert; default skip).
+    Returns the import report with per-row errors.
+    """
+    fmt = request.args.get('format', 'csv')
+    on_duplicate = request.args.get('on_duplicate', 'skip')
+    
+    upload = request.files.get('file')
+    raw = upload.stream if upload else request.stream
+    stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    
+    try:
+        report = import_books(stream, fmt, on_duplicate)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(report)
+
 @api_bp.route('/search')
+@conditional_get('catalog', 'availability')
 def search_books_api():
     """
-    Search for books via API endpoint.
     Alternative API interface for R5: Book Search Functionality
+    Returns one page of matches, best first, with the total number of
+    matches; pass next_cursor back as ?cursor= for the next page.
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    mode = request.args.get('mode', 'substring')
+    cursor = request.args.get('cursor') or None
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
+    if mode not in ('substring', 'token', 'prefix', 'phrase'):
+        return jsonify({'error': 'Search mode must be one of substring, token, prefix, phrase'}), 400
+    
+    try:
+        limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    page = search_books_page(search_term, search_type, mode, limit, cursor)
+    if page['status'] != 'ok':
+        return jsonify({'error': page['message']}), 400
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
-        'results': books,
-        'count': len(books)
+        'mode': mode,
+        'results': page['books'],
+        'count': len(page['books']),
+        'total': page['total'],
+        'limit': page['limit'],
+        'next_cursor': page['next_cursor'],
+    })
+
+@api_bp.route('/suggest')
+@conditional_get('catalog', cache_control='public, max-age=60')
+def suggest_api():
+    """
+    Typeahead suggestions for the search box: ?q= is what has been typed so
+    far, optionally with ?type=title|author and ?limit=. Answered from
+    in-memory prefix indexes, so it is cheap enough to call per keystroke.
+    """
+    try:
+        limit = int(request.args.get('limit', SUGGEST_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    result = get_search_suggestions(request.args.get('q', ''), request.args.get('type') or None, limit)
+    if result['status'] != 'ok':
+        return jsonify({'error': result['message']}), 400
+    
+    return jsonify({'query': request.args.get('q', ''), 'suggestions': result['suggestions']})
+
+
+def _export_response(chunks, fmt, name):
+    """Stream export chunks as a downloadable file."""
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={name}.{fmt}'},
+    )
+
+@api_bp.route('/export/books')
+def export_books_api():
+    """
+    Stream the whole catalog as NDJSON (default) or CSV (?format=csv).
+    """
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        chunks = export_books(fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _export_response(chunks, fmt, 'books')
+
+@api_bp.route('/export/loans')
+def export_loans_api():
+    """
+    Stream borrow records as NDJSON (default) or CSV (?format=csv).
+    Optional filters: ?patron_id=, ?start= and ?end= (ISO dates, end exclusive).
+    """
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        chunks = export_loans(
+            fmt,
+            patron_id=request.args.get('patron_id') or None,
+            start=request.args.get('start') or None,
+            end=request.args.get('end') or None,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _export_response(chunks, fmt, 'loans')
+
+@api_bp.route('/patron/<patron_id>/status')
+def patron_status_api(patron_id):
+    """
+    R7 patron status: current loans, fees, summary and the first history page.
+    """
+    report = get_patron_status_report(patron_id)
+    if report['status'] != 'ok':
+        return jsonify({'error': report['message']}), 400
+    return jsonify(report)
+
+@api_bp.route('/patron/<patron_id>/fees')
+def patron_fees_api(patron_id):
+    """
+    Late fees a patron still owes, one line item per open loan.
+    """
+    if not patron_id.isdigit() or len(patron_id) != 6:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    return jsonify(get_patron_fees_due(patron_id))
+
+def _job_response(job, created):
+    """202 with the job and its status URL (200 for a job already queued under the same Idempotency-Key)."""
+    url = url_for('api.job_status_api', job_id=job['id'])
+    body = {'job': job, 'status_url': url}
+    return jsonify(body), 202 if created else 200, {'Location': url}
+
+@api_bp.route('/patron/<patron_id>/fees/pay', methods=['POST'])
+@api_bp.route('/patron/<patron_id>/fees/pay/<int:book_id>', methods=['POST'])
+def pay_patron_fees_api(patron_id, book_id=None):
+    """
+    Queue payment of every outstanding late fee of a patron (one gateway
+    charge), or of one book's, and return the job at once; poll status_url
+    for the result. Send an Idempotency-Key header to make retrying the
+    request safe: a repeat returns the same job.
+    """
+    if not patron_id.isdigit() or len(patron_id) != 6:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    return _job_response(*enqueue_late_fee_payment(patron_id, book_id, request.headers.get('Idempotency-Key') or None))
+
+@api_bp.route('/payments/<transaction_id>/refund', methods=['POST'])
+def refund_payment_api(transaction_id):
+    """
+    Queue a refund of a late-fee payment; the JSON body gives the amount.
+    Returns the job like the payment endpoint.
+    """
+    amount = (request.get_json(silent=True) or {}).get('amount')
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount <= 0:
+        return jsonify({'error': 'amount must be a number greater than 0'}), 400
+    if not transaction_id.startswith('txn_'):
+        return jsonify({'error': 'Invalid transaction ID.'}), 400
+    return _job_response(*enqueue_refund(transaction_id, amount, request.headers.get('Idempotency-Key') or None))
+
+@api_bp.route('/jobs/<int:job_id>')
+def job_status_api(job_id):
+    """
+    A background job's status ('queued', 'running', 'succeeded' or 'dead')
+    and result. ?wait=<seconds> long-polls: the response comes as soon as
+    the job finishes, or after that long (at most JOB_MAX_WAIT).
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = -1.0
+    if not wait >= 0:  # also rejects nan
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    job = wait_for_job(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@api_bp.route('/patron/<patron_id>/history')
+def patron_history_api(patron_id):
+    """
+    A patron's borrowing history one page at a time, newest first.
+    Query parameters: cursor (next_cursor of the previous page), limit,
+    start and end (ISO dates, end exclusive).
+    """
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    page = get_patron_history(
+        patron_id,
+        cursor=request.args.get('cursor') or None,
+        limit=limit,
+        start=request.args.get('start') or None,
+        end=request.args.get('end') or None,
+    )
+    if page['status'] != 'ok':
+        return jsonify({'error': page['message']}), 400
+    
+    return jsonify({
+        'patron_id': patron_id,
+        'history': page['history'],
+        'count': len(page['history']),
+        'limit': page['limit'],
+        'next_cursor': page['next_cursor'],
+    })
+
+@api_bp.route('/patron/<patron_id>/history/export')
+def patron_history_export_api(patron_id):
+    """
+    Stream a patron's full borrowing history as a single JSON document.
+    Optional ?start= and ?end= filters as for the paged history.
+    """
+    try:
+        chunks = export_patron_history(
+            patron_id,
+            start=request.args.get('start') or None,
+            end=request.args.get('end') or None,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename=history_{patron_id}.json'},
+    )
+
+@api_bp.route('/overdue')
+def overdue_report_api():
+    """
+    The latest finished overdue snapshot (or ?run_id=), one page of loans at
+    a time: ?cursor= is next_cursor of the previous page, ?limit= at most 500.
+    """
+    try:
+        run_id = int(request.args['run_id']) if request.args.get('run_id') else None
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'run_id, cursor and limit must be integers'}), 400
+    report = get_overdue_report(run_id, cursor, limit)
+    if report['status'] != 'ok':
+        return jsonify({'error': report['message']}), 404 if report['message'].startswith('No ') else 400
+    return jsonify(report)
+
+@api_bp.route('/stats')
+def get_stats():
+    """
+    Runtime metrics for the storage layer (connection pool size, checkouts,
+    wait time), the book lookup cache (hits, misses, evictions), the
+    cross-process change counters, the loan epoch backfill, the payment
+    gateway's circuit breaker, the job queue, the search and suggestion
+    indexes and the search result cache (hit ratio).
+    """
+    return jsonify({
+        'db_pool': get_pool_stats(),
+        'book_cache': get_book_cache_stats(),
+        'changes': get_change_stats(),
+        'loan_epochs': get_loan_epoch_status(),
+        'payments': get_payment_stats(),
+        'jobs': get_job_stats(),
+        'search_index': get_search_index_stats(),
+        'search_cache': get_search_cache_stats(),
+        'suggest_index': get_suggest_index_stats(),
     })
@@ -3,8 +3,8 @@ Catalog Routes - Book catalog related endpoints
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
-from library_service import add_book_to_catalog
+from library_service import add_book_to_catalog, get_catalog_page, CATALOG_PAGE_SIZE
+from routes.http_cache import conditional_get
 
 catalog_bp = Blueprint('catalog', __name__)
 
@@ -14,13 +14,22 @@ def index():
     return redirect(url_for('catalog.catalog'))
 
 @catalog_bp.route('/catalog')
+@conditional_get('catalog', 'availability')
 def catalog():
     """
-    Display all books in the catalog.
+    Display the books in the catalog, one page at a time.
     Implements R2: Book Catalog Display
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', CATALOG_PAGE_SIZE, type=int)
+    
+    page = get_catalog_page(cursor, limit)
+    if page['status'] != 'ok':
+        flash(page['message'], 'error')
+        page = get_catalog_page()
+    
+    return render_template('catalog.html', books=page['books'], limit=page['limit'],
+                           next_cursor=page['next_cursor'], prev_cursor=page['prev_cursor'])
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
@@ -0,0 +1,64 @@
+"""
+HTTP caching for read-only pages and JSON endpoints.
+
+conditional_get() tags a view's responses with an ETag built from the
+database's id and the change counters its output depends on, and a
+Last-Modified from when the latest of them moved. A request whose
+If-None-Match (or If-Modified-Since) still matches gets 304 Not Modified
+before the view runs, so nothing is queried or rendered. Cache-Control is
+set per endpoint and can be overridden through the CACHE_CONTROL app
+setting ({endpoint: value}).
+"""
+
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from database import get_change_stamps
+
+
+def _cache_control(default: str) -> str:
+    return current_app.config.get('CACHE_CONTROL', {}).get(request.endpoint, default)
+
+
+def conditional_get(*counters: str, cache_control: str = 'no-cache'):
+    """
+    Decorate a GET view whose output only changes when one of the named
+    change counters ('catalog', 'availability', 'loans') moves.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                # A pending flash message is shown once: never tag or cache that page
+                response = make_response(view(*args, **kwargs))
+                response.headers['Cache-Control'] = 'private, no-store'
+                return response
+
+            database_id, versions, changed_at = get_change_stamps(counters)
+            etag = '-'.join([database_id] + [f'{name}{version}' for name, version in zip(counters, versions)])
+            # Only whole seconds go over the wire, so a change later in the
+            # current second would not move Last-Modified: omit it until then
+            last_modified = None
+            if changed_at is not None and changed_at < int(time.time()):
+                last_modified = datetime.fromtimestamp(int(changed_at), timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = last_modified is not None and since is not None and last_modified <= since
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = _cache_control(cache_control)
+            return response
+        return wrapper
+    return decorator
@@ -3,11 +3,13 @@ Search Routes - Book search functionality
 """
 
 from flask import Blueprint, render_template, request, flash
-from library_service import search_books_in_catalog
+from library_service import search_books_page, SEARCH_PAGE_SIZE
+from routes.http_cache import conditional_get
 
 search_bp = Blueprint('search', __name__)
 
 @search_bp.route('/search')
+@conditional_get('catalog', 'availability')
 def search_books():
     """
     Search for books in the catalog.
@@ -15,14 +17,21 @@ def search_books():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
     
     if not search_term:
         return render_template('search.html', books=[], search_term='', search_type=search_type)
     
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    page = search_books_page(search_term, search_type, limit=limit, cursor=cursor)
+    if page['status'] != 'ok':
+        flash(page['message'], 'error')
+        page = search_books_page(search_term, search_type)
+    books = page['books']
     
     if not books:
         flash('Search functionality is not yet implemented.', 'error')
     
-    return render_template('search.html', books=books, search_term=search_term, search_type=search_type)
+    return render_template('search.html', books=books, search_term=search_term, search_type=search_type,
+                           total=page['total'], limit=page['limit'], next_cursor=page['next_cursor'])
@@ -0,0 +1,263 @@
+"""
+In-memory substring index for title and author search.
+
+TrigramIndex maps every three-character slice of a lowercased text to the
+documents containing it. A query's trigrams must all occur in any text that
+contains the query, so intersecting their postings lists (rarest first)
+leaves a small candidate set, and only those candidates are checked with
+`in`. Matching is therefore exactly `query.lower() in text.lower()`.
+Matches can also be ranked: exact text first, then prefix, word-boundary
+and other infix matches, kept in a bounded top-K heap.
+
+PrefixIndex serves typeahead suggestions: distinct texts sorted for bisect,
+so the texts (or words within them) starting with a prefix are one
+contiguous run and the first few are found without scanning.
+"""
+
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Stop intersecting once this few candidates remain: checking them directly
+# is cheaper than walking another postings list
+VERIFY_THRESHOLD = 64
+# Intersect by binary search when the candidates are at least this many
+# times fewer than the postings list, instead of walking the whole list
+BISECT_RATIO = 16
+
+
+# Match tiers, best first
+MATCH_EXACT, MATCH_PREFIX, MATCH_WORD, MATCH_INFIX = range(4)
+
+# Words starting further into a text than this are not suggested by PrefixIndex
+MAX_WORD_OFFSET = 255
+# add_many() re-sorts instead of inserting one by one past this many new texts
+INSERT_RESORT = 64
+
+
+def match_tier(text: str, needle: str) -> int:
+    """How well text (lowercased, containing needle) matches: one of the MATCH_* tiers."""
+    if text.startswith(needle):
+        return MATCH_EXACT if len(text) == len(needle) else MATCH_PREFIX
+    i = text.find(needle, 1)
+    while i != -1:
+        if not text[i - 1].isalnum():
+            return MATCH_WORD
+        i = text.find(needle, i + 1)
+    return MATCH_INFIX
+
+
+def trigrams(text: str) -> set:
+    """Distinct three-character slices of text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _intersect(candidates, postings) -> array:
+    # Both are ascending document positions
+    if len(candidates) * BISECT_RATIO < len(postings):
+        found, size = array('I'), len(postings)
+        for position in candidates:
+            i = bisect_left(postings, position)
+            if i < size and postings[i] == position:
+                found.append(position)
+        return found
+    wanted = set(candidates)
+    return array('I', (position for position in postings if position in wanted))
+
+
+class TrigramIndex:
+    """
+    Thread-safe trigram index over (doc_id, text) pairs, built by add() in
+    any order and only ever appended to. Documents are numbered by position,
+    so postings lists are compact unsigned int arrays kept in ascending
+    order without sorting.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.texts: List[str] = []
+        self._postings: Dict[str, array] = {}
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: int, text: str) -> None:
+        """Index one document."""
+        self.add_many(((doc_id, text),))
+
+    def add_many(self, docs: Iterable[Tuple[int, str]]) -> None:
+        """Index several documents."""
+        postings = self._postings
+        with self._lock:
+            for doc_id, text in docs:
+                lowered = str(text).lower()
+                position = len(self.texts)
+                self.texts.append(lowered)
+                self.ids.append(doc_id)
+                for gram in trigrams(lowered):
+                    postings_list = postings.get(gram)
+                    if postings_list is None:
+                        postings_list = postings[gram] = array('I')
+                    postings_list.append(position)
+
+    def _matches(self, needle: str) -> List[int]:
+        # Positions of the texts containing needle (already lowercased); call with _lock held
+        texts = self.texts
+        if len(needle) < 3:
+            # Too short to have a trigram; such queries match most of the
+            # catalog anyway
+            return [i for i, text in enumerate(texts) if needle in text]
+        lists = []
+        for gram in trigrams(needle):
+            postings_list = self._postings.get(gram)
+            if postings_list is None:
+                return []
+            lists.append(postings_list)
+        lists.sort(key=len)
+        candidates = lists[0]
+        for postings_list in lists[1:]:
+            if len(candidates) <= VERIFY_THRESHOLD:
+                break
+            candidates = _intersect(candidates, postings_list)
+        return [position for position in candidates if needle in texts[position]]
+
+    def search(self, query: str) -> List[int]:
+        """Ids of the documents whose text contains query, ignoring case, in the order they were added."""
+        with self._lock:
+            ids = self.ids
+            return [ids[position] for position in self._matches(query.lower())]
+
+    def rank(self, query: str, limit: int,
+             after: Optional[Tuple[int, str, int]] = None) -> Tuple[List[Tuple[int, str, int]], int]:
+        """
+        The best limit matches of query as (tier, lowercased text, doc_id)
+        keys in ascending order, i.e. by tier, then text, then id; with
+        after (a key from a previous page), only the matches that sort
+        after it. Selected with a heap of limit entries, never a full sort.
+
+        Returns:
+            tuple: (keys, number of matches in total)
+        """
+        needle = query.lower()
+        with self._lock:
+            texts, ids = self.texts, self.ids
+            positions = self._matches(needle)
+            keys = ((match_tier(texts[position], needle), texts[position], ids[position]) for position in positions)
+            if after is not None:
+                keys = (key for key in keys if key > after)
+            return heapq.nsmallest(limit, keys), len(positions)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def stats(self) -> Dict:
+        """Documents, distinct trigrams and postings (entries and bytes)."""
+        with self._lock:
+            entries = sum(len(postings_list) for postings_list in self._postings.values())
+            return {
+                'documents': len(self.texts),
+                'trigrams': len(self._postings),
+                'postings': entries,
+                'postings_bytes': entries * array('I').itemsize,
+            }
+
+
+def word_starts(text: str) -> List[int]:
+    """Offsets of the words in text after the first: letters or digits following anything else."""
+    return [i for i in range(1, min(len(text), MAX_WORD_OFFSET + 1))
+            if text[i].isalnum() and not text[i - 1].isalnum()]
+
+
+class PrefixIndex:
+    """
+    Thread-safe typeahead index over (doc_id, text) pairs, built by add()
+    and only ever appended to. Texts are folded with lower() and kept once,
+    with the number of documents sharing them and the spelling of the first.
+    Two sorted arrays of text positions answer a prefix with bisect: whole
+    texts, and (position, word offset) pairs for every later word, so
+    "gats" suggests "The Great Gatsby" after any text starting with it.
+    """
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.labels: List[str] = []
+        self.counts = array('I')
+        self._positions: Dict[str, int] = {}
+        self._whole = array('I')   # text positions, by text
+        self._words = array('Q')   # position << 8 | word offset, by the text from that word on
+        self._lock = threading.Lock()
+
+    def _word(self, entry: int) -> str:
+        return self.texts[entry >> 8][entry & 0xFF:]
+
+    def add(self, doc_id: int, text: str) -> None:
+        """Index one document."""
+        self.add_many(((doc_id, text),))
+
+    def add_many(self, docs: Iterable[Tuple[int, str]]) -> None:
+        """Index several documents (doc_id is not kept: suggestions are texts)."""
+        with self._lock:
+            new = []
+            for _, text in docs:
+                label = str(text).strip()
+                lowered = label.lower()
+                position = self._positions.get(lowered)
+                if position is not None:
+                    self.counts[position] += 1
+                    continue
+                position = self._positions[lowered] = len(self.texts)
+                self.texts.append(lowered)
+                self.labels.append(label)
+                self.counts.append(1)
+                new.append(position)
+            words = [position << 8 | offset for position in new for offset in word_starts(self.texts[position])]
+            if len(new) > INSERT_RESORT:
+                self._whole = array('I', sorted(self._whole.tolist() + new, key=self.texts.__getitem__))
+                self._words = array('Q', sorted(self._words.tolist() + words, key=self._word))
+                return
+            for position in new:
+                insort(self._whole, position, key=self.texts.__getitem__)
+            for entry in words:
+                insort(self._words, entry, key=self._word)
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[int, str, str, int]]:
+        """
+        Up to limit texts starting with prefix, ignoring case, then texts
+        with a later word starting with it, as (MATCH_PREFIX or MATCH_WORD,
+        matched lowercased text, label, number of documents) in that order.
+        """
+        needle = prefix.strip().lower()
+        if not needle or limit < 1:
+            return []
+        with self._lock:
+            texts = self.texts
+            found, seen = [], set()
+            whole = self._whole
+            i = bisect_left(whole, needle, key=texts.__getitem__)
+            while i < len(whole) and len(found) < limit and texts[whole[i]].startswith(needle):
+                seen.add(whole[i])
+                found.append((MATCH_PREFIX, texts[whole[i]], whole[i]))
+                i += 1
+            words = self._words
+            i = bisect_left(words, needle, key=self._word)
+            while i < len(words) and len(found) < limit:
+                word = self._word(words[i])
+                if not word.startswith(needle):
+                    break
+                if words[i] >> 8 not in seen:
+                    seen.add(words[i] >> 8)
+                    found.append((MATCH_WORD, word, words[i] >> 8))
+                i += 1
+            return [(tier, text, self.labels[position], self.counts[position]) for tier, text, position in found]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def stats(self) -> Dict:
+        """Distinct texts, indexed words and bytes held by the sorted arrays."""
+        with self._lock:
+            return {
+                'texts': len(self.texts),
+                'words': len(self._words),
+                'sorted_bytes': len(self._whole) * self._whole.itemsize + len(self._words) * self._words.itemsize,
+            }
@@ -0,0 +1,159 @@
+"""
+Export Service Module - Streaming bulk export of the catalog and loan history
+Rows are read in batches and serialized as they go, so memory use does not
+grow with table size. Used by the /api/export endpoints, the patron history
+export and the export CLI.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from database import iter_books, iter_loans, iter_patron_history
+from records import json_default
+from services.library_service import build_history_items, parse_date_range
+
+# Format name -> response mimetype
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+BOOK_FIELDS = ['id', 'title', 'author', 'isbn', 'total_copies', 'available_copies']
+LOAN_FIELDS = ['id', 'patron_id', 'book_id', 'title', 'borrow_date', 'due_date', 'return_date']
+
+# Rows serialized per chunk handed to the response or file
+CHUNK_ROWS = 500
+
+
+def _ndjson_chunks(rows: Iterable[Dict]) -> Iterator[str]:
+    """One JSON object per line, grouped into chunks of CHUNK_ROWS lines."""
+    lines: List[str] = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False, default=json_default))
+        if len(lines) >= CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _csv_chunks(rows: Iterable[Dict], fields: List[str]) -> Iterator[str]:
+    """A header line, then the rows, grouped into chunks of CHUNK_ROWS rows."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _serialize(rows: Iterable[Dict], fields: List[str], fmt: str) -> Iterator[str]:
+    if fmt == 'csv':
+        return _csv_chunks(rows, fields)
+    return _ndjson_chunks(rows)
+
+
+def _batched(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    batch: List[Dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _check_format(fmt: str) -> None:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Export format must be one of: {', '.join(EXPORT_FORMATS)}.")
+
+
+def export_books(fmt: str = 'ndjson') -> Iterator[str]:
+    """
+    Stream the whole catalog.
+
+    Args:
+        fmt: 'ndjson' or 'csv'
+
+    Returns:
+        Iterator of text chunks
+
+    Raises:
+        ValueError: if the format is unknown (raised before anything is read)
+    """
+    _check_format(fmt)
+    return _serialize(iter_books(), BOOK_FIELDS, fmt)
+
+
+def export_loans(fmt: str = 'ndjson', patron_id: Optional[str] = None,
+                 start: Optional[str] = None, end: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream borrow records, optionally for one patron and/or borrowed within [start, end).
+
+    Args:
+        fmt: 'ndjson' or 'csv'
+        patron_id: 6-digit library card ID to filter on
+        start: ISO date/datetime, inclusive
+        end: ISO date/datetime, exclusive
+
+    Returns:
+        Iterator of text chunks
+
+    Raises:
+        ValueError: for an unknown format, malformed patron ID or date
+            (raised before anything is read)
+    """
+    _check_format(fmt)
+    if patron_id is not None and not (patron_id.isdigit() and len(patron_id) == 6):
+        raise ValueError("Invalid patron ID. Must be exactly 6 digits.")
+    start_dt, end_dt = parse_date_range(start, end)
+
+    return _serialize(iter_loans(patron_id, start_dt, end_dt), LOAN_FIELDS, fmt)
+
+
+def export_patron_history(patron_id: str, start: Optional[str] = None,
+                          end: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream a patron's full borrowing history as one JSON document,
+    {"patron_id": ..., "as_of": ..., "history": [...]}, with items shaped
+    like get_patron_history() pages (newest first, fees included).
+
+    Args:
+        patron_id: 6-digit library card ID
+        start: ISO date/datetime, inclusive
+        end: ISO date/datetime, exclusive
+
+    Returns:
+        Iterator of text chunks
+
+    Raises:
+        ValueError: for a malformed patron ID or date (raised before anything is read)
+    """
+    if not (isinstance(patron_id, str) and patron_id.isdigit() and len(patron_id) == 6):
+        raise ValueError("Invalid patron ID. Must be exactly 6 digits.")
+    start_dt, end_dt = parse_date_range(start, end)
+    as_of = datetime.now()
+
+    def chunks() -> Iterator[str]:
+        yield f'{{"patron_id": {json.dumps(patron_id)}, "as_of": {json.dumps(as_of.isoformat())}, "history": ['
+        separator = ''
+        for batch in _batched(iter_patron_history(patron_id, start_dt, end_dt), CHUNK_ROWS):
+            # Serialize the batch as one list and strip its brackets
+            items = json.dumps(build_history_items(batch, as_of), ensure_ascii=False)
+            yield separator + items[1:-1]
+            separator = ', '
+        yield ']}\n'
+
+    return chunks()
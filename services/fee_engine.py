@@ -0,0 +1,106 @@
+"""
+Fee Engine Module - Batch late-fee computation
+Computes the R5 late fee (first 7 days at $0.50/day, then $1.00/day, capped
+at $15.00) for many loans at once. Dates are handled as integer microsecond
+epochs so whole batches can be processed as arrays: with NumPy the parsing
+and arithmetic are vectorized, without it a plain Python loop produces the
+same numbers. Results are identical to _fee_for_days() applied to
+timedelta.days, microsecond for microsecond.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure-Python path is used instead
+    np = None
+
+US_PER_DAY = 86_400_000_000
+
+FIRST_TIER_DAYS = 7
+FIRST_TIER_RATE = 0.50
+SECOND_TIER_RATE = 1.00
+MAX_FEE = 15.00
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+
+def has_numpy() -> bool:
+    """Whether the vectorized NumPy backend is available."""
+    return np is not None
+
+
+def _use_numpy(use_numpy: Optional[bool]) -> bool:
+    if use_numpy is None:
+        return np is not None
+    if use_numpy and np is None:
+        raise RuntimeError("NumPy is not installed.")
+    return use_numpy
+
+
+def to_epoch_us(value: Union[datetime, str]) -> int:
+    """Microseconds since 1970-01-01 for a naive (or UTC-normalized aware) datetime or ISO string."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _ONE_US
+
+
+def parse_epoch_us(iso_dates: Sequence[str], use_numpy: Optional[bool] = None):
+    """
+    Parse naive ISO-8601 strings into microsecond epochs.
+
+    Returns:
+        an int64 array with NumPy, otherwise a list of ints
+    """
+    if _use_numpy(use_numpy):
+        return np.array(iso_dates, dtype='datetime64[us]').astype(np.int64)
+    parse, epoch, one_us = datetime.fromisoformat, _EPOCH, _ONE_US
+    return [(parse(d) - epoch) // one_us for d in iso_dates]
+
+
+def compute_fees(due_us, basis_us, use_numpy: Optional[bool] = None) -> Tuple[List[int], List[float]]:
+    """
+    Days overdue and late fee for every loan.
+
+    Args:
+        due_us: due dates as microsecond epochs (sequence or array)
+        basis_us: the time each loan is assessed at (return date, or now) -
+            either one epoch for all loans or one per loan
+        use_numpy: force a backend; None picks NumPy when installed
+
+    Returns:
+        tuple: (days_overdue: list of int, fees: list of float)
+    """
+    if _use_numpy(use_numpy):
+        due = np.asarray(due_us, dtype=np.int64)
+        basis = np.asarray(basis_us, dtype=np.int64)
+        days = np.maximum((basis - due) // US_PER_DAY, 0)
+        first = np.minimum(days, FIRST_TIER_DAYS)
+        rest = np.maximum(days - FIRST_TIER_DAYS, 0)
+        fees = np.minimum(first * FIRST_TIER_RATE + rest * SECOND_TIER_RATE, MAX_FEE)
+        return days.tolist(), fees.tolist()
+
+    if isinstance(basis_us, int):
+        days_list = [(basis_us - due) // US_PER_DAY for due in due_us]
+    else:
+        days_list = [(basis - due) // US_PER_DAY for due, basis in zip(due_us, basis_us)]
+    days_list = [d if d > 0 else 0 for d in days_list]
+    return days_list, [_fee(d) for d in days_list]
+
+
+def _fee(days: int) -> float:
+    """Scalar fee for a non-negative day count (same arithmetic as the vectorized path)."""
+    if days <= FIRST_TIER_DAYS:
+        return days * FIRST_TIER_RATE
+    return min(FIRST_TIER_DAYS * FIRST_TIER_RATE + (days - FIRST_TIER_DAYS) * SECOND_TIER_RATE, MAX_FEE)
+
+
+def fees_for_due_dates(due_dates: Sequence[str], as_of: datetime,
+                       use_numpy: Optional[bool] = None) -> Tuple[List[int], List[float]]:
+    """Days overdue and fees for ISO due dates, all assessed at as_of."""
+    due_us = parse_epoch_us(due_dates, use_numpy)
+    return compute_fees(due_us, to_epoch_us(as_of), use_numpy)
@@ -0,0 +1,218 @@
+"""
+Import Service Module - Bulk catalog ingest
+Streams a vendor feed (CSV, NDJSON or MARC-lite), validates each record with
+the R1 rules and inserts valid books in large executemany batches, one
+transaction per batch. Bad rows are reported individually and never abort
+the rest of the import.
+"""
+
+import csv
+import json
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from database import insert_books_bulk
+from services.library_service import validate_book_fields
+
+IMPORT_FORMATS = ('csv', 'ndjson', 'marc')
+BULK_BATCH_SIZE = 1000
+MAX_REPORTED_ROWS = 1000
+
+# MARC-lite: one "TAG value" line per field, records separated by blank lines.
+# A leading "$a" subfield code on the value is ignored. 949 is the local
+# holdings field used here for the copy count.
+MARC_TAGS = {
+    '020': 'isbn',
+    '100': 'author',
+    '245': 'title',
+    '949': 'total_copies',
+}
+
+# (row number, record, parse error)
+ParsedRow = Tuple[int, Optional[Dict], Optional[str]]
+
+
+def _parse_csv(stream: TextIO) -> Iterator[ParsedRow]:
+    """CSV with a header row naming title, author, isbn and total_copies."""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        # Row numbers count the header as line 1, like a spreadsheet
+        yield reader.line_num, record, None
+
+
+def _parse_ndjson(stream: TextIO) -> Iterator[ParsedRow]:
+    """One JSON object per line; blank lines are ignored."""
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None, "Invalid JSON."
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "Each line must be a JSON object."
+            continue
+        yield line_no, record, None
+
+
+def _parse_marc(stream: TextIO) -> Iterator[ParsedRow]:
+    """MARC-lite records; the row number is the line the record starts on."""
+    record: Dict = {}
+    start = None
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            if record:
+                yield start, record, None
+            record, start = {}, None
+            continue
+        if start is None:
+            start = line_no
+        tag, _, value = line.partition(' ')
+        field = MARC_TAGS.get(tag)
+        if field:
+            value = value.strip()
+            if value.startswith('$a'):
+                value = value[2:].strip()
+            record[field] = value
+    if record:
+        yield start, record, None
+
+
+_PARSERS = {
+    'csv': _parse_csv,
+    'ndjson': _parse_ndjson,
+    'marc': _parse_marc,
+}
+
+
+def _coerce(record: Dict) -> Tuple[Optional[Tuple[str, str, str, int]], Optional[str]]:
+    """Turn a raw record into an insertable row, applying the R1 rules."""
+    title = str(record.get('title') or '')
+    author = str(record.get('author') or '')
+    isbn = str(record.get('isbn') or '').strip()
+    copies = record.get('total_copies', record.get('copies'))
+    if isinstance(copies, str):
+        try:
+            copies = int(copies.strip())
+        except ValueError:
+            pass
+    elif isinstance(copies, float) and copies.is_integer():
+        copies = int(copies)  # JSON 3.0; 3.5 stays a float and is rejected
+
+    error = validate_book_fields(title, author, isbn, copies)
+    if error:
+        return None, error
+    return (title.strip(), author.strip(), isbn, copies), None
+
+
+class _Report:
+    """Accumulates import counts and a bounded list of per-row problems."""
+
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+        self.skipped_rows: List[Dict] = []
+
+    def error(self, row: int, message: str, isbn: Optional[str] = None):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ROWS:
+            self.errors.append({'row': row, 'isbn': isbn, 'error': message})
+
+    def skip(self, row: int, isbn: str, reason: str = 'Duplicate ISBN.'):
+        self.skipped += 1
+        if len(self.skipped_rows) < MAX_REPORTED_ROWS:
+            self.skipped_rows.append({'row': row, 'isbn': isbn, 'reason': reason})
+
+
+def _flush(batch: Dict[str, Tuple[int, Tuple]], on_duplicate: str, report: _Report) -> None:
+    """Insert one batch (keyed by ISBN) in a single transaction."""
+    if not batch:
+        return
+    try:
+        result = insert_books_bulk([book for _, book in batch.values()], on_duplicate)
+    except sqlite3.Error as e:
+        for row, book in batch.values():
+            report.error(row, f"Database error: {e}", book[2])
+        return
+    report.inserted += result['inserted']
+    report.updated += result['updated']
+    for isbn in result['duplicates']:
+        report.skip(batch[isbn][0], isbn)
+
+
+def import_books(stream: TextIO, fmt: str = 'csv', on_duplicate: str = 'skip',
+                 batch_size: int = BULK_BATCH_SIZE) -> Dict:
+    """
+    Bulk-import books from a text stream.
+
+    Args:
+        stream: text file object with the feed
+        fmt: 'csv', 'ndjson' or 'marc'
+        on_duplicate: 'skip' keeps existing books, 'upsert' overwrites them
+        batch_size: rows per insert transaction
+
+    Returns:
+        dict: counts of processed/inserted/updated/skipped rows, per-row
+        errors and skips (at most MAX_REPORTED_ROWS of each), elapsed time
+        and rows per second
+
+    Raises:
+        ValueError: for an unknown format or duplicate policy
+    """
+    if fmt not in _PARSERS:
+        raise ValueError(f"Import format must be one of: {', '.join(IMPORT_FORMATS)}.")
+    if on_duplicate not in ('skip', 'upsert'):
+        raise ValueError("on_duplicate must be 'skip' or 'upsert'.")
+
+    report = _Report()
+    start = time.perf_counter()
+    batch: Dict[str, Tuple[int, Tuple]] = {}
+
+    for row, record, parse_error in _PARSERS[fmt](stream):
+        report.processed += 1
+        if parse_error:
+            report.error(row, parse_error)
+            continue
+
+        book, error = _coerce(record)
+        if error:
+            report.error(row, error, str(record.get('isbn') or '') or None)
+            continue
+
+        isbn = book[2]
+        if isbn in batch:
+            # The same ISBN twice in one batch: the first wins unless upserting,
+            # when the earlier row is never written and the later one counts
+            # as an insert or an update once the batch is flushed
+            if on_duplicate == 'skip':
+                report.skip(row, isbn)
+                continue
+            report.skip(batch[isbn][0], isbn, 'Superseded by a later row with the same ISBN.')
+        batch[isbn] = (row, book)
+
+        if len(batch) >= batch_size:
+            _flush(batch, on_duplicate, report)
+            batch = {}
+
+    _flush(batch, on_duplicate, report)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'status': 'ok',
+        'processed': report.processed,
+        'inserted': report.inserted,
+        'updated': report.updated,
+        'skipped': report.skipped,
+        'error_count': report.error_count,
+        'errors': report.errors,
+        'skipped_rows': report.skipped_rows,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(report.processed / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -0,0 +1,210 @@
+"""
+Job Service Module - Background jobs for gateway calls
+Payment and refund requests are queued in the SQLite jobs table and run by
+JobWorker threads (in the web process, or in `flask jobs worker`
+processes), so HTTP workers return a job id at once instead of waiting on
+the payment gateway. Clients poll, or long-poll, the job for its result.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from database import (
+    JOB_RETRY_BACKOFF, JOB_RETRY_BACKOFF_MAX, JOB_VISIBILITY_SECONDS, claim_job, complete_job, enqueue_job,
+    fail_job, get_job, get_payment,
+)
+from services.library_service import pay_all_late_fees, pay_late_fees, refund_late_fee_payment
+
+logger = logging.getLogger(__name__)
+
+# Worker threads started with the web app, and how often an idle worker
+# looks for jobs queued by other processes
+JOB_WORKER_THREADS = 2
+JOB_POLL_INTERVAL = 0.25
+# Longest a status request may wait for a job to finish
+JOB_MAX_WAIT = 30.0
+
+JOB_FINISHED = ('succeeded', 'dead')
+
+# Signalled when this process queues or finishes a job, so idle workers and
+# waiting status requests react at once instead of at their next poll
+_queue_changed = threading.Condition()
+
+
+class RetryJob(Exception):
+    """
+    Raised by a job handler for an outcome worth retrying. payload, if
+    given, replaces the job's payload for the next attempt.
+    """
+
+    def __init__(self, message: str, payload: Optional[Dict] = None):
+        super().__init__(message)
+        self.payload = payload
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict], Dict]] = {}
+
+
+def job_handler(kind: str):
+    """Register the function that runs jobs of this kind: payload dict in, JSON-able result dict out."""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def _notify() -> None:
+    with _queue_changed:
+        _queue_changed.notify_all()
+
+
+def _check_payment(payload: Dict) -> None:
+    """
+    Retry while the payment's outcome is unknown (under the same key, so the
+    gateway deduplicates it) or it never reached the gateway (under a new
+    key, since that attempt released its fees).
+    """
+    payment = get_payment(payload['idempotency_key'])
+    if payment is None:
+        return
+    if payment['status'] in ('unknown', 'processing'):
+        raise RetryJob(payment['message'] or 'Payment in progress')
+    if payment['status'] == 'error':
+        raise RetryJob(payment['message'], payload | {'idempotency_key': f'job-{uuid.uuid4().hex}'})
+
+
+@job_handler('pay_late_fees')
+def _run_pay_late_fees(payload: Dict) -> Dict:
+    success, message, transaction_id = pay_late_fees(payload['patron_id'], payload['book_id'],
+                                                     idempotency_key=payload['idempotency_key'])
+    _check_payment(payload)
+    return {'success': success, 'message': message, 'transaction_id': transaction_id}
+
+
+@job_handler('pay_all_late_fees')
+def _run_pay_all_late_fees(payload: Dict) -> Dict:
+    result = pay_all_late_fees(payload['patron_id'], idempotency_key=payload['idempotency_key'])
+    _check_payment(payload)
+    return result
+
+
+@job_handler('refund')
+def _run_refund(payload: Dict) -> Dict:
+    success, message = refund_late_fee_payment(payload['transaction_id'], payload['amount'],
+                                               idempotency_key=payload['idempotency_key'])
+    _check_payment(payload)
+    return {'success': success, 'message': message}
+
+
+def _enqueue(kind: str, payload: Dict, idempotency_key: Optional[str]) -> Tuple[Dict, bool]:
+    # The client's key dedupes the job and, through the payments ledger, the
+    # payment; without one the job gets its own key for the ledger
+    payload['idempotency_key'] = idempotency_key or f'job-{uuid.uuid4().hex}'
+    job, created = enqueue_job(kind, payload, idempotency_key)
+    if created:
+        _notify()
+    return job, created
+
+
+def enqueue_late_fee_payment(patron_id: str, book_id: Optional[int] = None,
+                             idempotency_key: Optional[str] = None) -> Tuple[Dict, bool]:
+    """
+    Queue pay_late_fees() for one book, or pay_all_late_fees() without
+    book_id. Returns (job, created); a repeated idempotency_key returns the
+    existing job.
+    """
+    if book_id is None:
+        return _enqueue('pay_all_late_fees', {'patron_id': patron_id}, idempotency_key)
+    return _enqueue('pay_late_fees', {'patron_id': patron_id, 'book_id': book_id}, idempotency_key)
+
+
+def enqueue_refund(transaction_id: str, amount: float, idempotency_key: Optional[str] = None) -> Tuple[Dict, bool]:
+    """Queue refund_late_fee_payment(). Returns (job, created) as enqueue_late_fee_payment()."""
+    return _enqueue('refund', {'transaction_id': transaction_id, 'amount': amount}, idempotency_key)
+
+
+def wait_for_job(job_id: int, timeout: float = 0.0) -> Optional[Dict]:
+    """
+    The job, once it has finished or after at most timeout seconds (capped
+    at JOB_MAX_WAIT), whichever comes first. None if there is no such job.
+    """
+    deadline = time.monotonic() + min(max(timeout, 0.0), JOB_MAX_WAIT)
+    while True:
+        job = get_job(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job['status'] in JOB_FINISHED or remaining <= 0:
+            return job
+        with _queue_changed:
+            _queue_changed.wait(min(remaining, JOB_POLL_INTERVAL))
+
+
+def _retry_delay(attempt: int) -> float:
+    return random.uniform(0, min(JOB_RETRY_BACKOFF_MAX, JOB_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+
+class JobWorker:
+    """
+    Runs queued jobs in daemon threads. Any number of workers, in any number
+    of processes, can share the queue: each job is claimed by one of them
+    at a time, and one that is not finished within the visibility timeout
+    (its worker died) is picked up by another. Failed attempts are retried
+    with jittered exponential backoff until the job runs out of attempts
+    and goes to the dead letter table.
+    """
+
+    def __init__(self, threads: int = JOB_WORKER_THREADS, visibility: float = JOB_VISIBILITY_SECONDS,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.threads = threads
+        self.visibility = visibility
+        self.poll_interval = poll_interval
+        self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._stop = threading.Event()
+        self._threads = []
+
+    def run_once(self) -> bool:
+        """Claim and run one job. False if none was ready."""
+        job = claim_job(self.owner, self.visibility)
+        if job is None:
+            return False
+        handler = JOB_HANDLERS.get(job['kind'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind '{job['kind']}'")
+            result = handler(job['payload'])
+        except RetryJob as e:
+            fail_job(job['id'], self.owner, str(e), _retry_delay(job['attempts']), e.payload)
+        except Exception as e:
+            logger.exception('Job %s (%s) failed', job['id'], job['kind'])
+            fail_job(job['id'], self.owner, f'{type(e).__name__}: {e}', _retry_delay(job['attempts']))
+        else:
+            complete_job(job['id'], self.owner, result)
+        _notify()
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception('Job worker error')
+            with _queue_changed:
+                _queue_changed.wait(self.poll_interval)
+
+    def start(self) -> 'JobWorker':
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        _notify()
+        for thread in self._threads:
+            thread.join(timeout)
@@ -3,14 +3,50 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
+import json
+import sqlite3
+import uuid
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
-from services.payment_service import PaymentGateway
+from records import Book
+from services.payment_service import PaymentGateway, PaymentGatewayError, get_payment_gateway
+from services.fee_engine import compute_fees, fees_for_due_dates, parse_epoch_us, to_epoch_us
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books, get_db_connection
+    get_book_by_id, get_book_by_isbn, insert_book, get_all_books, get_patron_borrowed_books,
+    get_db_connection, borrow_book_atomic, return_book_atomic, search_books_indexed,
+    search_books_ranked, search_books_fulltext, count_books_fulltext, cached_search_page, suggest_books, FTS_MODES, get_books_page, encode_cursor, decode_cursor, iter_open_loans,
+    transaction, get_patron_summary, iter_patron_summaries, iter_expected_patron_summaries,
+    set_patron_fees, rebuild_patron_summary, get_patron_history_page, iter_overdue_loans,
+    get_patron_fee_lines, get_fee_loan, create_fee_settlement, get_fee_settlement, get_payment, record_payment,
+    claim_payment, finish_payment, get_unresolved_payments, get_charge
 )
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
+    """
+    R1 input validation shared by single and bulk catalog additions.
+    
+    Returns:
+        The error message for the first rule broken, or None if the book is valid
+    """
+    if not title or not title.strip():
+        return "Title is required."
+    
+    if len(title.strip()) > 200:
+        return "Title must be less than 200 characters."
+    
+    if not author or not author.strip():
+        return "Author is required."
+    
+    if len(author.strip()) > 100:
+        return "Author must be less than 100 characters."
+    
+    if len(isbn) != 13:
+        return "ISBN must be exactly 13 digits."
+    
+    if not isinstance(total_copies, int) or isinstance(total_copies, bool) or total_copies <= 0:
+        return "Total copies must be a positive integer."
+    
+    return None
+
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
     Add a new book to the catalog.
@@ -26,23 +62,9 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
         tuple: (success: bool, message: str)
     """
     # Input validation
-    if not title or not title.strip():
-        return False, "Title is required."
-    
-    if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
-    
-    if not author or not author.strip():
-        return False, "Author is required."
-    
-    if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
-    
-    if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits."
-    
-    if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -61,6 +83,10 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     Allow a patron to borrow a book.
     Implements R3 as per requirements  
     
+    The availability check, limit check, decrement, borrow record and the
+    patron's summary row are applied in one transaction so concurrent
+    borrows cannot oversell a book.
+    
     Args:
         patron_id: 6-digit library card ID
         book_id: ID of the book to borrow
@@ -72,33 +98,29 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
     
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    
+    try:
+        with transaction():
+            status, book = borrow_book_atomic(patron_id, book_id, borrow_date, due_date, max_borrowed=5)
+            if status == 'ok':
+                refresh_patron_fees(patron_id, borrow_date)
+    except sqlite3.Error:
+        status = 'error'
+    
+    if status == 'not_found':
         return False, "Book not found."
     
-    if book['available_copies'] <= 0:
+    if status == 'unavailable':
         return False, "This book is currently not available."
     
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-    
-    if current_borrowed >= 5:
+    if status == 'limit_reached':
         return False, "You have reached the maximum borrowing limit of 5 books."
     
-    # Create borrow record
-    borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
-    
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
+    if status != 'ok':
         return False, "Database error occurred while creating borrow record."
     
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
-    
     return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
 
 def _fee_for_days(days_overdue: int) -> float:
@@ -114,42 +136,39 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Implements R4: Accepts patron ID & book ID, verifies active borrow,
     records return date, updates availability, and reports late fee.
+    The return date, availability and the patron's summary row are updated
+    in one transaction.
     """
 
     if not (isinstance(patron_id, str) and patron_id.isdigit() and len(patron_id) == 6):
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
-
-    book = get_book_by_id(book_id)
-    if not book:
+    now = datetime.now()
+    try:
+        with transaction():
+            status, loan = return_book_atomic(patron_id, book_id, now)
+            if status == 'ok':
+                refresh_patron_fees(patron_id, now)
+    except sqlite3.Error:
+        status = 'error'
+
+    if status == 'not_found':
         return False, "Book not found."
 
-    active = get_patron_borrowed_books(patron_id)
-    match = next((r for r in active if r["book_id"] == book_id), None)
-    if not match:
+    if status == 'no_record':
         return False, "No active borrow record for this patron and book."
 
-    now = datetime.now()
-
-    due_date = match["due_date"]
-    days_overdue = max(0, (now - due_date).days)
-    fee_amount = _fee_for_days(days_overdue)
-
-  
-    if not update_borrow_record_return_date(patron_id, book_id, now):
+    if status != 'ok':
         return False, "Database error occurred while updating return record."
 
-
-    if book["available_copies"] < book["total_copies"]:
-        if not update_book_availability(book_id, +1):
-            return False, "Database error occurred while updating book availability."
-
+    days_overdue = max(0, (now - loan.due_date).days)
+    fee_amount = _fee_for_days(days_overdue)
 
     fee_str = f"${fee_amount:.2f}"
     if days_overdue > 0:
-        return True, f'Returned "{book["title"]}". Overdue by {days_overdue} day(s). Late fee: {fee_str}.'
+        return True, f'Returned "{loan.title}". Overdue by {days_overdue} day(s). Late fee: {fee_str}.'
     else:
-        return True, f'Returned "{book["title"]}". No late fee (0.00).'
+        return True, f'Returned "{loan.title}". No late fee (0.00).'
 
 
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
@@ -173,17 +192,19 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
 
     try:
         conn = get_db_connection()
-        row = conn.execute(
-            """
-            SELECT borrow_date, due_date, return_date
-            FROM borrow_records
-            WHERE patron_id = ? AND book_id = ?
-            ORDER BY borrow_date DESC
-            LIMIT 1
-            """,
-            (patron_id, book_id),
-        ).fetchone()
-        conn.close()
+        try:
+            row = conn.execute(
+                """
+                SELECT borrow_date, due_date, return_date
+                FROM borrow_records
+                WHERE patron_id = ? AND book_id = ?
+                ORDER BY borrow_date DESC
+                LIMIT 1
+                """,
+                (patron_id, book_id),
+            ).fetchone()
+        finally:
+            conn.close()
     except Exception:
         row = None
 
@@ -206,12 +227,189 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         "status": status,
     }
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+CATALOG_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def get_catalog_page(cursor: Optional[str] = None, limit: int = CATALOG_PAGE_SIZE) -> Dict:
+    """
+    Keyset-paginated catalog listing in (title, id) order, used by R2's
+    catalog display. cursor is the next_cursor/prev_cursor of a previous
+    page, or None for the first page.
+    Returns: {'status': 'ok', 'books': [...], 'next_cursor', 'prev_cursor', 'limit'}
+             or {'status': 'error', 'message': str}
+    """
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PAGE_SIZE:
+        return {"status": "error", "message": f"Page size must be between 1 and {MAX_PAGE_SIZE}."}
+
+    direction, key = "next", None
+    if cursor:
+        try:
+            direction, title, book_id = decode_cursor(cursor)
+            if direction not in ("next", "prev") or not isinstance(title, str):
+                raise ValueError
+            key = (title, int(book_id))
+        except (ValueError, TypeError):
+            return {"status": "error", "message": "Invalid cursor."}
+
+    # Fetch one extra row to learn whether another page exists in that direction
+    if direction == "prev":
+        books = get_books_page(before=key, limit=limit + 1)
+        has_prev = len(books) > limit
+        books = books[-limit:]
+        has_next = True
+    else:
+        books = get_books_page(after=key, limit=limit + 1)
+        has_next = len(books) > limit
+        books = books[:limit]
+        has_prev = key is not None
+
+    next_cursor = prev_cursor = None
+    if books and has_next:
+        next_cursor = encode_cursor(["next", books[-1]["title"], books[-1]["id"]])
+    if books and has_prev:
+        prev_cursor = encode_cursor(["prev", books[0]["title"], books[0]["id"]])
+
+    return {
+        "status": "ok",
+        "books": books,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "limit": limit,
+    }
+
+def calculate_outstanding_fees(as_of: Optional[datetime] = None) -> Dict:
+    """
+    R5 late fees owed on every open loan, across all patrons, computed in one
+    batch by the fee engine instead of one _fee_for_days() call per loan.
+    Only loans at least a day past due can owe anything, so only those are
+    read (a range scan of the open-loan due index).
+    Returns: {'as_of': str, 'total_outstanding': float, 'overdue_loans': int,
+              'by_patron': {patron_id: float}}
+    """
+    as_of = as_of or datetime.now()
+    patron_ids, due_dates = [], []
+    for loan in iter_overdue_loans(as_of - timedelta(days=1)):
+        patron_ids.append(loan["patron_id"])
+        due_dates.append(loan["due_date"])
+
+    _, fees = fees_for_due_dates(due_dates, as_of)
+
+    by_patron: Dict[str, float] = {}
+    overdue = 0
+    for patron_id, fee in zip(patron_ids, fees):
+        if fee > 0:
+            overdue += 1
+            by_patron[patron_id] = by_patron.get(patron_id, 0.0) + fee
+
+    return {
+        "as_of": as_of.isoformat(),
+        "total_outstanding": round(sum(by_patron.values()), 2),
+        "overdue_loans": overdue,
+        "by_patron": {p: round(v, 2) for p, v in by_patron.items()},
+    }
+
+def refresh_patron_fees(patron_id: str, as_of: Optional[datetime] = None) -> float:
+    """
+    Recompute one patron's outstanding fees from their open loans (at most
+    the borrow limit, read through the open-loan index) and store them in
+    patron_summary. Called inside the borrow/return transaction.
+    Returns the stored amount.
+    """
+    as_of = as_of or datetime.now()
+    loans = get_patron_borrowed_books(patron_id)
+    _, fees = fees_for_due_dates([loan["due_date"].isoformat() for loan in loans], as_of)
+    amount = round(sum(fees), 2)
+    set_patron_fees({patron_id: amount}, as_of)
+    return amount
+
+def roll_forward_patron_fees(as_of: Optional[datetime] = None) -> Dict:
+    """
+    Daily fee accrual for patron_summary: reassess every patron's outstanding
+    fees at as_of. Runs in one write transaction so a borrow or return
+    cannot slip in between reading the open loans and storing the fees.
+    Returns: {'as_of': str, 'patrons_with_fees': int, 'total_outstanding': float}
+    """
+    as_of = as_of or datetime.now()
+    with transaction():
+        report = calculate_outstanding_fees(as_of)
+        set_patron_fees(report["by_patron"], as_of, reset_all=True)
+    return {
+        "as_of": report["as_of"],
+        "patrons_with_fees": len(report["by_patron"]),
+        "total_outstanding": report["total_outstanding"],
+    }
+
+def _expected_summary_fees(fees_as_of: Dict[str, str]) -> Dict[str, float]:
+    """Open-loan fees per patron, each assessed at that patron's stored fees_as_of."""
+    patron_ids, due_dates, basis = [], [], []
+    for loan in iter_open_loans():
+        as_of = fees_as_of.get(loan["patron_id"])
+        if as_of:
+            patron_ids.append(loan["patron_id"])
+            due_dates.append(loan["due_date"])
+            basis.append(to_epoch_us(as_of))
+
+    expected: Dict[str, float] = {}
+    if patron_ids:
+        _, fees = compute_fees(parse_epoch_us(due_dates), basis)
+        for patron_id, fee in zip(patron_ids, fees):
+            expected[patron_id] = expected.get(patron_id, 0.0) + fee
+    return {p: round(v, 2) for p, v in expected.items()}
+
+def check_patron_summary(repair: bool = False) -> Dict:
+    """
+    Consistency check of patron_summary against borrow_records. Counts and
+    last activity must match exactly; fees must match a fresh assessment at
+    the row's own fees_as_of (rows never rolled forward are not fee-checked).
+    With repair=True and any mismatch, the table is rebuilt and fees rolled
+    forward to now.
+    Returns: {'status': 'ok'|'mismatch'|'repaired', 'patrons_checked': int,
+              'mismatches': [{'patron_id', 'field', 'stored', 'expected'}]}
+    """
+    stored = {row["patron_id"]: row for row in iter_patron_summaries()}
+    expected = {row["patron_id"]: row for row in iter_expected_patron_summaries()}
+    expected_fees = _expected_summary_fees({p: row["fees_as_of"] for p, row in stored.items()})
+
+    mismatches: List[Dict] = []
+    for patron_id in sorted(stored.keys() | expected.keys()):
+        have, want = stored.get(patron_id), expected.get(patron_id)
+        if have is None or want is None:
+            mismatches.append({
+                "patron_id": patron_id, "field": "row",
+                "stored": have is not None, "expected": want is not None,
+            })
+            continue
+        for field in ("active_count", "total_loans", "last_activity"):
+            if have[field] != want[field]:
+                mismatches.append({"patron_id": patron_id, "field": field,
+                                   "stored": have[field], "expected": want[field]})
+        if have["fees_as_of"]:
+            fee = expected_fees.get(patron_id, 0.0)
+            if abs(have["outstanding_fees"] - fee) > 0.005:
+                mismatches.append({"patron_id": patron_id, "field": "outstanding_fees",
+                                   "stored": have["outstanding_fees"], "expected": fee})
+
+    status = "mismatch" if mismatches else "ok"
+    if mismatches and repair:
+        with transaction():
+            rebuild_patron_summary()
+            roll_forward_patron_fees()
+        status = "repaired"
+
+    return {
+        "status": status,
+        "patrons_checked": len(stored.keys() | expected.keys()),
+        "mismatches": mismatches,
+    }
+
+def search_books_in_catalog(search_term: str, search_type: str, mode: str = "substring") -> List[Book]:
     """
     Implements R6. type ∈ {'title','author','isbn'}.
     - title/author: partial, case-insensitive
-    - isbn: exact match
-    Returns a list of book dicts shaped like catalog rows.
+    - isbn: exact match (indexed lookup)
+    mode selects full-text matching for title/author instead of R6 substrings:
+    'token', 'prefix' or 'phrase', ranked best match first.
+    Returns a list of Book records, like the catalog.
     """
     if not search_type or search_type not in {"title", "author", "isbn"}:
         return []
@@ -219,23 +417,192 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
         return []
 
     term = search_term.strip()
-    books = get_all_books()
 
     if search_type == "isbn":
-        return [b for b in books if str(b.get("isbn", "")).strip() == term]
+        book = get_book_by_isbn(term)
+        return [book] if book else []
 
-    term_lower = term.lower()
     key = "title" if search_type == "title" else "author"
-    return [b for b in books if term_lower in str(b.get(key, "")).lower()]
 
+    if mode in FTS_MODES:
+        return search_books_fulltext(term, field=key, mode=mode)
+    if mode != "substring":
+        return []
 
-def get_patron_status_report(patron_id: str) -> Dict:
+    return search_books_indexed(term, key)
+
+
+SEARCH_PAGE_SIZE = 20
+
+def search_books_page(search_term: str, search_type: str, mode: str = "substring",
+                      limit: int = SEARCH_PAGE_SIZE, cursor: Optional[str] = None) -> Dict:
+    """
+    R6 search one page at a time, best match first. Substring matches (as
+    search_books_in_catalog()) rank exact title/author first, then prefix,
+    then word-boundary, then other infix matches; full-text modes rank by
+    BM25. cursor is the next_cursor of the previous page, or None.
+    Returns: {'status': 'ok', 'books': [...], 'total', 'next_cursor', 'limit'}
+             or {'status': 'error', 'message': str}
+    """
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PAGE_SIZE:
+        return {"status": "error", "message": f"Page size must be between 1 and {MAX_PAGE_SIZE}."}
+
+    key = None
+    if cursor:
+        try:
+            key = decode_cursor(cursor)
+            if mode in FTS_MODES:
+                if not isinstance(key, int) or isinstance(key, bool) or key < 0:
+                    raise ValueError
+            else:
+                tier, text, book_id = key
+                if not isinstance(tier, int) or not isinstance(text, str):
+                    raise ValueError
+                key = (tier, text, int(book_id))
+        except (ValueError, TypeError):
+            return {"status": "error", "message": "Invalid cursor."}
+
+    page = {"status": "ok", "books": [], "total": 0, "next_cursor": None, "limit": limit}
+    term = (search_term or "").strip()
+    if search_type not in {"title", "author", "isbn"} or not term or (mode != "substring" and mode not in FTS_MODES):
+        return page
+
+    if search_type == "isbn":
+        books = search_books_in_catalog(term, "isbn")
+        page.update(books=books if key is None else [], total=len(books))
+        return page
+
+    def compute():
+        if mode in FTS_MODES:
+            offset = key or 0
+            books = search_books_fulltext(term, field=search_type, mode=mode, limit=limit + 1, offset=offset)
+            page.update(books=books[:limit], total=count_books_fulltext(term, field=search_type, mode=mode))
+            if len(books) > limit:
+                page["next_cursor"] = encode_cursor(offset + limit)
+        else:
+            # One extra match tells whether another page exists
+            ranked, total = search_books_ranked(term, search_type, limit + 1, key)
+            page.update(books=[book for _, book in ranked[:limit]], total=total)
+            if len(ranked) > limit:
+                page["next_cursor"] = encode_cursor(list(ranked[limit - 1][0]))
+        return page
+
+    # Substring matching ignores case, and full-text matching case and spacing
+    normalized = term.lower() if mode == "substring" else " ".join(term.lower().split())
+    return cached_search_page((search_type, mode, normalized, limit, cursor), compute)
+
+
+SUGGEST_LIMIT = 8
+MAX_SUGGEST_LIMIT = 20
+
+def get_search_suggestions(query: str, search_type: Optional[str] = None, limit: int = SUGGEST_LIMIT) -> Dict:
+    """
+    Typeahead for the search page: titles and authors (or only search_type's,
+    'title' or 'author') starting with query, then those with a word starting
+    with it, ignoring case. ISBN searches get no suggestions.
+    Returns: {'status': 'ok', 'suggestions': [{'text', 'field', 'books'}, ...]}
+             or {'status': 'error', 'message': str}
+    """
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_SUGGEST_LIMIT:
+        return {"status": "error", "message": f"Suggestion limit must be between 1 and {MAX_SUGGEST_LIMIT}."}
+    if search_type not in (None, "title", "author", "isbn"):
+        return {"status": "error", "message": "Search type must be title, author or isbn."}
+    prefix = (query or "").strip()
+    if not prefix or search_type == "isbn":
+        return {"status": "ok", "suggestions": []}
+    fields = (search_type,) if search_type else ("title", "author")
+    return {"status": "ok", "suggestions": suggest_books(prefix, limit, fields)}
+
+
+HISTORY_PAGE_SIZE = 20
+
+def build_history_items(rows: List[Dict], as_of: datetime) -> List[Dict]:
+    """
+    Shape borrow_records rows (ISO date strings, as stored) into R7 history
+    items. Fees are assessed at the return date, or as_of for open loans,
+    in one fee-engine batch.
+    """
+    if not rows:
+        return []
+    as_of_text = as_of.isoformat()
+    due_us = parse_epoch_us([row["due_date"] for row in rows])
+    basis_us = parse_epoch_us([row["return_date"] or as_of_text for row in rows])
+    days, fees = compute_fees(due_us, basis_us)
+    return [{
+        "book_id": row["book_id"],
+        "title": row["title"],
+        "author": row["author"],
+        "borrow_date": row["borrow_date"],
+        "due_date": row["due_date"],
+        "return_date": row["return_date"],
+        "days_overdue": days_overdue,
+        "late_fee": round(fee, 2),
+    } for row, days_overdue, fee in zip(rows, days, fees)]
+
+def parse_date_range(start: Optional[str], end: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """ISO start/end filter values to datetimes; raises ValueError with a user-facing message."""
+    try:
+        return (datetime.fromisoformat(start) if start else None,
+                datetime.fromisoformat(end) if end else None)
+    except (TypeError, ValueError):
+        raise ValueError("Dates must be in ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS).")
+
+def get_patron_history(patron_id: str, cursor: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE,
+                       start: Optional[str] = None, end: Optional[str] = None) -> Dict:
+    """
+    One page of a patron's borrowing history (R7), newest first. start/end
+    are ISO dates limiting borrow_date to [start, end); cursor is the
+    next_cursor of the previous page (pass the same filters again).
+    Returns: {'status': 'ok', 'patron_id', 'history': [...], 'next_cursor', 'limit'}
+             or {'status': 'error', 'message': str}
+    """
+    if not (isinstance(patron_id, str) and patron_id.isdigit() and len(patron_id) == 6):
+        return {"status": "error", "message": "Invalid patron ID. Must be exactly 6 digits."}
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PAGE_SIZE:
+        return {"status": "error", "message": f"Page size must be between 1 and {MAX_PAGE_SIZE}."}
+    try:
+        start_dt, end_dt = parse_date_range(start, end)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    before = None
+    if cursor:
+        try:
+            borrow_date, record_id = decode_cursor(cursor)
+            if not isinstance(borrow_date, str):
+                raise ValueError
+            before = (borrow_date, int(record_id))
+        except (ValueError, TypeError):
+            return {"status": "error", "message": "Invalid cursor."}
+
+    try:
+        rows = get_patron_history_page(patron_id, before, limit + 1, start_dt, end_dt)
+    except sqlite3.Error:
+        rows = []
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]["borrow_date"], rows[-1]["id"]])
+
+    return {
+        "status": "ok",
+        "patron_id": patron_id,
+        "history": build_history_items(rows, datetime.now()),
+        "next_cursor": next_cursor,
+        "limit": limit,
+    }
+
+def get_patron_status_report(patron_id: str, history_limit: int = HISTORY_PAGE_SIZE) -> Dict:
     """
     Implements R7: report includes
       - currently borrowed (with due dates)
       - number of books currently borrowed
       - total late fees owed (sum over active borrows)
-      - borrowing history (all past borrows with return dates)
+      - borrowing history: the newest history_limit borrows with return
+        dates; history_next_cursor continues via get_patron_history()
+      - summary: the patron's materialized patron_summary row (lifetime loan
+        count, last activity, fees as of the last refresh or roll-forward)
     """
     if not (isinstance(patron_id, str) and patron_id.isdigit() and len(patron_id) == 6):
         return {"status": "error", "message": "Invalid patron ID. Must be exactly 6 digits."}
@@ -260,40 +627,14 @@ def get_patron_status_report(patron_id: str) -> Dict:
             "late_fee": round(fee, 2),
         })
 
-    history: List[Dict] = []
-    try:
-        conn = get_db_connection()
-        rows = conn.execute(
-            """
-            SELECT br.book_id, br.borrow_date, br.due_date, br.return_date,
-                   b.title, b.author
-            FROM borrow_records br
-            JOIN books b ON b.id = br.book_id
-            WHERE br.patron_id = ?
-            ORDER BY br.borrow_date DESC
-            """,
-            (patron_id,),
-        ).fetchall()
-        conn.close()
-
-        for row in rows:
-            borrow_date = datetime.fromisoformat(row["borrow_date"])
-            due_date = datetime.fromisoformat(row["due_date"])
-            return_date = datetime.fromisoformat(row["return_date"]) if row["return_date"] else None
-            basis_time = return_date or now
-            days_overdue = max(0, (basis_time - due_date).days)
-            history.append({
-                "book_id": row["book_id"],
-                "title": row["title"],
-                "author": row["author"],
-                "borrow_date": borrow_date.isoformat(),
-                "due_date": due_date.isoformat(),
-                "return_date": return_date.isoformat() if return_date else None,
-                "days_overdue": days_overdue,
-                "late_fee": round(_fee_for_days(days_overdue), 2),
-            })
-    except Exception:
-        history = []
+    history_page = get_patron_history(patron_id, limit=history_limit)
+    history = history_page.get("history", [])
+
+    summary = get_patron_summary(patron_id) or {
+        "active_count": 0, "total_loans": 0, "last_activity": None,
+        "outstanding_fees": 0.0, "fees_as_of": None,
+    }
+    summary.pop("patron_id", None)
 
     return {
         "status": "ok",
@@ -302,11 +643,14 @@ def get_patron_status_report(patron_id: str) -> Dict:
         "total_late_fees": round(total_fees, 2),
         "currently_borrowed": current_items,
         "history": history,
+        "history_next_cursor": history_page.get("next_cursor"),
+        "summary": summary,
     }
 
 
 
-def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str]]:
+def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None,
+                  idempotency_key: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
     """
     Process payment for late fees using external payment gateway.
     
@@ -317,6 +661,9 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         patron_id: 6-digit library card ID
         book_id: ID of the book with late fees
         payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Client-chosen key for this payment; repeating a
+            request with the same key returns the first one's result
+            instead of charging again
         
     Returns:
         tuple: (success: bool, message: str, transaction_id: Optional[str])
@@ -331,6 +678,16 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits.", None
     
+    # Use provided gateway or the shared (pooled) one
+    if payment_gateway is None:
+        payment_gateway = get_payment_gateway()
+    
+    # A repeated request gets the stored result
+    existing = get_payment(idempotency_key) if idempotency_key else None
+    if existing is not None:
+        return _charge_result(_replay_payment(existing, "charge", payment_gateway, patron_id=patron_id))
+    _resolve_unfinished_charges(patron_id, payment_gateway)
+    
     # Calculate late fee first
     fee_info = calculate_late_fee_for_book(patron_id, book_id)
     
@@ -348,39 +705,210 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
     if not book:
         return False, "Book not found.", None
     
-    # Use provided gateway or create new one
-    if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+    # Only charge what earlier settlements of this loan don't already cover,
+    # and record the payment in the ledger (with the fees it settles) before
+    # charging, so a second request can't charge it too
+    key = idempotency_key or uuid.uuid4().hex
+    with transaction():
+        existing = get_payment(key) if idempotency_key else None
+        if existing is None:
+            settlement_id = None
+            loan = get_fee_loan(patron_id, book_id)
+            if loan is not None:
+                fee_amount = round(fee_amount - loan["settled"], 2)
+                if fee_amount <= 0:
+                    return False, "No late fees to pay for this book.", None
+                settlement_id = create_fee_settlement(
+                    patron_id, datetime.now(),
+                    [(loan["loan_id"], book_id, fee_info.get("days_overdue", 0), fee_amount)])
+            payment, _ = record_payment(key, "charge", fee_amount, {"description": f"Late fees for '{book['title']}'"},
+                                        patron_id=patron_id, settlement_id=settlement_id)
+    if existing is not None:
+        return _charge_result(_replay_payment(existing, "charge", payment_gateway, patron_id=patron_id))
     
     # Process payment through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
+    return _charge_result(_send_payment(payment, payment_gateway))
+
+
+def _send_payment(payment: Dict, payment_gateway: PaymentGateway) -> Dict:
+    """
+    Send a ledger entry's charge or refund to the gateway under its
+    idempotency key and record the outcome; returns the updated entry.
+    Sending an entry again is safe, as the gateway answers a repeated key
+    with the first outcome.
+    """
+    key = payment["idempotency_key"]
+    transaction_id = None
     try:
-        success, transaction_id, message = payment_gateway.process_payment(
-            patron_id=patron_id,
-            amount=fee_amount,
-            description=f"Late fees for '{book['title']}'"
-        )
-        
-        if success:
-            return True, f"Payment successful! {message}", transaction_id
+        if payment["kind"] == "charge":
+            success, transaction_id, message = payment_gateway.process_payment(
+                patron_id=payment["patron_id"],
+                amount=payment["amount"],
+                idempotency_key=key,
+                **json.loads(payment["request"]),
+            )
         else:
-            return False, f"Payment failed: {message}", None
-            
+            success, message = payment_gateway.refund_payment(payment["refund_of"], payment["amount"],
+                                                              idempotency_key=key)
+    except PaymentGatewayError as e:
+        # Only an error the gateway certainly never saw is final
+        return finish_payment(payment["id"], "unknown" if e.sent else "error", message=str(e))
     except Exception as e:
-        # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+        return finish_payment(payment["id"], "unknown", message=str(e))
+    return finish_payment(payment["id"], "succeeded" if success else "declined",
+                          transaction_id if success else None, message)
+
+
+def _replay_payment(payment: Dict, kind: str, payment_gateway: PaymentGateway, **request) -> Dict:
+    """
+    The outcome for a request whose idempotency key is already in the
+    ledger. An entry whose outcome is unknown (or whose processing stalled)
+    is sent again; a key reused for a different request is refused.
+    """
+    if payment["kind"] != kind or any(payment[name] != value for name, value in request.items()):
+        return payment | {"status": "error", "message": "Idempotency key was already used for a different request"}
+    if claim_payment(payment["id"]):
+        return _send_payment(payment, payment_gateway)
+    return payment
+
+
+def _resolve_unfinished_charges(patron_id: str, payment_gateway: PaymentGateway) -> List[Dict]:
+    """
+    Send a patron's charges of unknown outcome again, so the fees they hold
+    are settled or released. Returns the entries sent.
+    """
+    return [_send_payment(payment, payment_gateway) for payment in get_unresolved_payments(patron_id)
+            if claim_payment(payment["id"])]
+
+
+def _charge_result(payment: Dict) -> Tuple[bool, str, Optional[str]]:
+    status, message = payment["status"], payment["message"]
+    if status == "succeeded":
+        return True, f"Payment successful! {message}", payment["transaction_id"]
+    if status == "declined":
+        return False, f"Payment failed: {message}", None
+    if status == "processing":
+        return False, "This payment is already being processed.", None
+    return False, f"Payment processing error: {message}", None
+
+
+def get_patron_fees_due(patron_id: str, as_of: Optional[datetime] = None) -> Dict:
+    """
+    R5 late fees a patron still owes on their open loans: each loan's fee at
+    as_of less what earlier settlements already paid for it.
+    Returns: {'patron_id', 'as_of', 'total': float,
+              'items': [{'loan_id', 'book_id', 'title', 'days_overdue', 'fee', 'settled', 'amount'}]}
+    """
+    as_of = as_of or datetime.now()
+    lines = get_patron_fee_lines(patron_id)
+    days, fees = fees_for_due_dates([line["due_date"] for line in lines], as_of)
+    items = []
+    for line, days_overdue, fee in zip(lines, days, fees):
+        amount = round(fee - line["settled"], 2)
+        if amount > 0:
+            items.append({
+                "loan_id": line["loan_id"],
+                "book_id": line["book_id"],
+                "title": line["title"],
+                "days_overdue": days_overdue,
+                "fee": fee,
+                "settled": round(line["settled"], 2),
+                "amount": amount,
+            })
+    return {
+        "patron_id": patron_id,
+        "as_of": as_of.isoformat(),
+        "total": round(sum(item["amount"] for item in items), 2),
+        "items": items,
+    }
+
+
+# pay_all_late_fees() status for each ledger status
+_SETTLEMENT_STATUS = {"succeeded": "paid", "declined": "declined", "processing": "in_progress",
+                      "error": "error", "unknown": "error"}
 
 
-def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
+def _settlement_result(payment: Dict) -> Dict:
+    _, message, transaction_id = _charge_result(payment)
+    settlement = get_fee_settlement(payment["settlement_id"]) if payment["settlement_id"] else None
+    return {
+        "status": _SETTLEMENT_STATUS[payment["status"]],
+        "message": message,
+        "transaction_id": transaction_id,
+        "settlement_id": payment["settlement_id"],
+        "idempotency_key": payment["idempotency_key"],
+        "amount": payment["amount"],
+        "items": settlement["items"] if settlement else [],
+    }
+
+
+def pay_all_late_fees(patron_id: str, payment_gateway: PaymentGateway = None,
+                      idempotency_key: Optional[str] = None) -> Dict:
+    """
+    Settle every late fee a patron owes with a single gateway charge that
+    lists one line item per book, instead of one pay_late_fees() call (and
+    gateway round trip) per book. The amounts are read, and recorded in the
+    payments ledger with a pending settlement, in one transaction before the
+    charge is sent, so the same fees cannot be charged twice; a declined
+    charge releases them again. idempotency_key works as for pay_late_fees().
+
+    Returns:
+        Dict: {'status': 'paid' | 'nothing_due' | 'declined' | 'in_progress' | 'error',
+               'message', 'transaction_id', 'settlement_id', 'idempotency_key', 'amount', 'items'}
+    """
+    result = {"status": "error", "transaction_id": None, "settlement_id": None,
+              "idempotency_key": idempotency_key, "amount": 0.0, "items": []}
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return result | {"message": "Invalid patron ID. Must be exactly 6 digits."}
+
+    if payment_gateway is None:
+        payment_gateway = get_payment_gateway()
+    existing = get_payment(idempotency_key) if idempotency_key else None
+    if existing is not None:
+        return _settlement_result(_replay_payment(existing, "charge", payment_gateway, patron_id=patron_id))
+    resolved = [p for p in _resolve_unfinished_charges(patron_id, payment_gateway) if p["status"] == "succeeded"]
+
+    key = idempotency_key or uuid.uuid4().hex
+    with transaction():
+        existing = get_payment(key) if idempotency_key else None
+        if existing is None:
+            due = get_patron_fees_due(patron_id)
+            if not due["items"] and resolved:
+                # A retry after a charge whose outcome we didn't know, and it had gone through
+                return _settlement_result(resolved[-1])
+            if not due["items"]:
+                return result | {"status": "nothing_due", "message": "No late fees to pay."}
+            settlement_id = create_fee_settlement(
+                patron_id, datetime.fromisoformat(due["as_of"]),
+                [(item["loan_id"], item["book_id"], item["days_overdue"], item["amount"]) for item in due["items"]])
+            count = len(due["items"])
+            payment, _ = record_payment(key, "charge", due["total"], {
+                "description": f"Late fees for {count} book{'s' if count != 1 else ''}",
+                "line_items": [{"description": f"'{item['title']}', {item['days_overdue']} days overdue",
+                                "amount": item["amount"]} for item in due["items"]],
+            }, patron_id=patron_id, settlement_id=settlement_id)
+    if existing is not None:
+        return _settlement_result(_replay_payment(existing, "charge", payment_gateway, patron_id=patron_id))
+
+    return _settlement_result(_send_payment(payment, payment_gateway))
+
+
+def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None,
+                            idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
     """
     Refund a late fee payment (e.g., if book was returned on time but fees were charged in error).
     
     NEW FEATURE FOR ASSIGNMENT 3: Another function requiring mocking
     
+    The charge must be in the payments ledger, and refunds of it (including
+    ones still in flight) can add up to at most the amount charged.
+    
     Args:
         transaction_id: Original transaction ID to refund
         amount: Amount to refund
         payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: As for pay_late_fees()
         
     Returns:
         tuple: (success: bool, message: str)
@@ -392,22 +920,36 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
     if amount <= 0:
         return False, "Refund amount must be greater than 0."
     
-    if amount > 15.00:  # Maximum late fee per book
-        return False, "Refund amount exceeds maximum late fee."
-    
-    # Use provided gateway or create new one
+    # Use provided gateway or the shared (pooled) one
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
-    
-    # Process refund through external gateway
-    # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
-    try:
-        success, message = payment_gateway.refund_payment(transaction_id, amount)
-        
-        if success:
-            return True, message
-        else:
-            return False, f"Refund failed: {message}"
-            
-    except Exception as e:
-        return False, f"Refund processing error: {str(e)}"
\ No newline at end of file
+        payment_gateway = get_payment_gateway()
+    
+    existing = get_payment(idempotency_key) if idempotency_key else None
+    if existing is None:
+        key = idempotency_key or uuid.uuid4().hex
+        with transaction():
+            existing = get_payment(key) if idempotency_key else None
+            if existing is None:
+                charge = get_charge(transaction_id)
+                if charge is None:
+                    return False, "Transaction not found."
+                refundable = round(charge["amount"] - charge["refunded"], 2)
+                if amount > refundable:
+                    return False, f"Refund amount exceeds the ${refundable:.2f} left to refund on this payment."
+                payment, _ = record_payment(key, "refund", amount, patron_id=charge["patron_id"],
+                                            refund_of=transaction_id)
+    if existing is not None:
+        payment = _replay_payment(existing, "refund", payment_gateway, refund_of=transaction_id, amount=amount)
+    else:
+        # Process refund through external gateway
+        # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
+        payment = _send_payment(payment, payment_gateway)
+    
+    status, message = payment["status"], payment["message"]
+    if status == "succeeded":
+        return True, message
+    if status == "declined":
+        return False, f"Refund failed: {message}"
+    if status == "processing":
+        return False, "This refund is already being processed."
+    return False, f"Refund processing error: {message}"
@@ -0,0 +1,179 @@
+"""
+Overdue Service Module - Library-wide overdue scan and nightly fee accrual
+Streams every open loan due before the run's as_of time through the due_ts
+index in chunks, computes each chunk's fees with the fee engine and writes
+them to the overdue_snapshot table together with a checkpoint, so a run
+that is interrupted resumes where it stopped. Runs from the CLI or from the
+in-process nightly scheduler.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from datetime import time as clock_time
+from typing import Dict, Optional
+
+from database import (
+    backfill_loan_epochs, claim_overdue_run, finish_overdue_run, get_overdue_loans_page, get_overdue_run,
+    get_overdue_snapshot_page, release_overdue_run, save_overdue_chunk,
+)
+from services.fee_engine import compute_fees, parse_epoch_us, to_epoch_us
+from services.library_service import roll_forward_patron_fees
+
+logger = logging.getLogger(__name__)
+
+# Loans read, assessed and written per transaction
+OVERDUE_CHUNK_SIZE = 2000
+
+
+def _worker_id() -> str:
+    return f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+def _run_report(run: Dict, resumed: bool = False, chunks: int = 0) -> Dict:
+    elapsed = run['elapsed_seconds']
+    return {
+        'run_id': run['id'],
+        'as_of': run['as_of'],
+        'status': run['status'],
+        'loans': run['loans'],
+        'total_fees': round(run['total_fees'], 2),
+        'elapsed_seconds': round(elapsed, 3),
+        'loans_per_second': round(run['loans'] / elapsed) if elapsed else 0,
+        'resumed': resumed,
+        'chunks': chunks,
+    }
+
+
+def run_overdue_job(as_of: Optional[datetime] = None, chunk_size: int = OVERDUE_CHUNK_SIZE, resume: bool = True,
+                    scheduled_for: Optional[str] = None, accrue: bool = True,
+                    max_chunks: Optional[int] = None) -> Dict:
+    """
+    Snapshot every open loan due at or before as_of with its days overdue and
+    late fee, then (with accrue) roll patron_summary fees forward to as_of.
+
+    Args:
+        as_of: assessment time of a new run (default now); a resumed run keeps
+            its original as_of so the snapshot stays consistent
+        chunk_size: loans per chunk; each chunk is one transaction
+        resume: continue the latest unfinished run instead of starting anew
+        scheduled_for: date (YYYY-MM-DD) of a nightly run; only one worker
+            runs each date
+        accrue: roll patron fees forward once the snapshot is complete
+        max_chunks: stop (leaving the run resumable) after this many chunks
+
+    Returns:
+        Dict: run_id, as_of, status ('running', 'finished' or 'busy' when
+        another worker holds the run), loans, total_fees, elapsed_seconds,
+        loans_per_second, resumed and chunks
+    """
+    backfill_loan_epochs()  # no-op once done; the scan needs due_ts everywhere
+    owner = _worker_id()
+    run, claimed = claim_overdue_run(as_of or datetime.now(), owner, scheduled_for, resume)
+    if not claimed:
+        report = _run_report(run)
+        if run['status'] == 'running':
+            report['status'] = 'busy'
+        return report
+
+    resumed = run['checkpoint_id'] is not None
+    run_as_of = datetime.fromisoformat(run['as_of'])
+    basis = to_epoch_us(run_as_of)
+    after = (run['checkpoint_due_ts'], run['checkpoint_id']) if resumed else None
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        start = time.perf_counter()
+        loans = get_overdue_loans_page(run_as_of, after, chunk_size)
+        if not loans:
+            break
+        days, fees = compute_fees(parse_epoch_us([loan['due_date'] for loan in loans]), basis)
+        rows = [(loan['id'], loan['patron_id'], loan['book_id'], loan['due_date'], d, f)
+                for loan, d, f in zip(loans, days, fees)]
+        after = (loans[-1]['due_ts'], loans[-1]['id'])
+        if not save_overdue_chunk(run['id'], owner, rows, after, sum(fees), time.perf_counter() - start):
+            return _run_report(get_overdue_run(run['id']), resumed, chunks) | {'status': 'busy'}
+        chunks += 1
+    else:
+        release_overdue_run(run['id'], owner)
+        return _run_report(get_overdue_run(run['id']), resumed, chunks)
+
+    finish_overdue_run(run['id'], owner)
+    if accrue:
+        roll_forward_patron_fees(run_as_of)
+    return _run_report(get_overdue_run(run['id']), resumed, chunks)
+
+
+def get_overdue_report(run_id: Optional[int] = None, cursor: Optional[int] = None, limit: int = 50) -> Dict:
+    """
+    A finished run (default the latest) with one page of its overdue loans.
+    Returns: {'status': 'ok', 'run': {...}, 'loans': [...], 'next_cursor': int | None}
+             or {'status': 'error', 'message': str}
+    """
+    if not 1 <= limit <= 500:
+        return {'status': 'error', 'message': 'limit must be between 1 and 500.'}
+    run = get_overdue_run(run_id)
+    if run is None:
+        return {'status': 'error', 'message': 'No overdue run found.'}
+    loans = get_overdue_snapshot_page(run['id'], cursor, limit + 1)
+    has_more = len(loans) > limit
+    loans = loans[:limit]
+    return {
+        'status': 'ok',
+        'run': _run_report(run),
+        'loans': loans,
+        'next_cursor': loans[-1]['loan_id'] if has_more else None,
+    }
+
+
+class OverdueScheduler:
+    """
+    Runs the overdue job once a day at a local wall-clock time in a daemon
+    thread. Every worker process may start one; the run for each date is
+    claimed by exactly one of them, and a run left unfinished by a worker
+    that died is taken over once its lease lapses.
+    """
+
+    def __init__(self, at: clock_time, retry_interval: float = 60.0, **job_options):
+        self.at = at
+        self.retry_interval = retry_interval
+        self.job_options = job_options
+        self.last_report: Optional[Dict] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def next_run(self, now: datetime) -> datetime:
+        run = datetime.combine(now.date(), self.at)
+        return run if run > now else run + timedelta(days=1)
+
+    def run_once(self, when: datetime) -> Dict:
+        self.last_report = run_overdue_job(when, scheduled_for=when.date().isoformat(), **self.job_options)
+        return self.last_report
+
+    def _loop(self) -> None:
+        while True:
+            when = self.next_run(datetime.now())
+            if self._stop.wait((when - datetime.now()).total_seconds()):
+                return
+            # Keep checking back while another worker holds the run, so a
+            # run it abandons is taken over when its lease lapses
+            while True:
+                try:
+                    if self.run_once(when)['status'] == 'finished':
+                        break
+                except Exception:
+                    logger.exception('Overdue job for %s failed', when.date())
+                if self._stop.wait(self.retry_interval):
+                    return
+
+    def start(self) -> 'OverdueScheduler':
+        self._thread = threading.Thread(target=self._loop, name='overdue-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
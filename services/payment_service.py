@@ -6,9 +6,43 @@ For Assignment 3: You will learn to mock this service in their tests
 since we cannot make actual payment API calls during testing.
 """
 
+import os
+import random
+import threading
+import uuid
+from collections import deque
 import requests
-from typing import Dict, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import time
+from cache import LRUCache
+
+# Real gateway endpoint; when unset the simulated PaymentGateway is used
+PAYMENT_GATEWAY_URL = os.environ.get('LIBRARY_PAYMENT_URL') or None
+PAYMENT_API_KEY = os.environ.get('LIBRARY_PAYMENT_API_KEY', 'test_key_12345')
+# Calls in flight at once from this process; also the keep-alive pool size.
+# A cap, so a slow gateway cannot tie up every thread: raise it towards the
+# number of threads calling the gateway if payments/s matters more
+# (python -m benchmarks.bench_payments compares limits)
+PAYMENT_MAX_CONCURRENCY = 16
+# (connect, read) timeouts in seconds
+PAYMENT_TIMEOUT = (3.05, 10.0)
+# Retries of a request that timed out, could not connect or got a 5xx,
+# after a random ("full jitter") pause of up to backoff * 2**(retry - 1)
+# seconds, capped at PAYMENT_RETRY_BACKOFF_MAX
+PAYMENT_RETRIES = 2
+PAYMENT_RETRY_BACKOFF = 0.1
+PAYMENT_RETRY_BACKOFF_MAX = 2.0
+# Circuit breaker: open once at least MIN_CALLS of the last WINDOW requests
+# were recorded and THRESHOLD of them failed, then fail fast for COOLDOWN seconds
+PAYMENT_BREAKER_THRESHOLD = 0.5
+PAYMENT_BREAKER_WINDOW = 20
+PAYMENT_BREAKER_MIN_CALLS = 10
+PAYMENT_BREAKER_COOLDOWN = 30.0
+# Results the simulated gateway remembers per idempotency key, and for how long
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_TTL = 24 * 3600.0
 
 
 class PaymentGateway:
@@ -31,8 +65,35 @@ class PaymentGateway:
         """
         self.api_key = api_key
         self.base_url = "https://api.payment-gateway.example.com"
+        self._idempotent = LRUCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+        self._key_locks: Dict[str, list] = {}
+        self._key_locks_lock = threading.Lock()
+
+    def _once(self, idempotency_key: Optional[str], call: Callable[[], Tuple]) -> Tuple:
+        # Run call() at most once per key while its successful result is
+        # remembered; concurrent calls with one key wait for the first
+        if not idempotency_key:
+            return call()
+        with self._key_locks_lock:
+            entry = self._key_locks.setdefault(idempotency_key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                result = self._idempotent.get(idempotency_key)
+                if result is None:
+                    result = call()
+                    if result[0]:
+                        self._idempotent.put(idempotency_key, result)
+                return result
+        finally:
+            with self._key_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[idempotency_key]
     
-    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        line_items: Optional[List[Dict]] = None,
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
         """
         Process a payment through the external gateway.
         
@@ -43,6 +104,10 @@ class PaymentGateway:
             patron_id: 6-digit patron/customer ID
             amount: Payment amount in dollars
             description: Payment description
+            line_items: Optional breakdown of amount, as dicts with
+                'description' and 'amount', shown on the patron's receipt
+            idempotency_key: Repeating a call with the same key returns the
+                first call's result instead of charging again
             
         Returns:
             tuple: (success: bool, transaction_id: str, message: str)
@@ -51,6 +116,9 @@ class PaymentGateway:
             gateway = PaymentGateway()
             success, txn_id, msg = gateway.process_payment("123456", 10.50, "Late fees")
         """
+        return self._once(idempotency_key, lambda: self._charge(patron_id, amount))
+
+    def _charge(self, patron_id: str, amount: float) -> Tuple[bool, str, str]:
         # Simulate API call delay
         time.sleep(0.5)
         
@@ -62,7 +130,8 @@ class PaymentGateway:
         #         "customer_id": patron_id,
         #         "amount": amount,
         #         "currency": "usd",
-        #         "description": description
+        #         "description": description,
+        #         "line_items": line_items or []
         #     }
         # )
         
@@ -79,10 +148,11 @@ class PaymentGateway:
             return False, "", "Invalid patron ID format"
         
         # Simulate successful payment
-        transaction_id = f"txn_{patron_id}_{int(time.time())}"
+        transaction_id = f"txn_{patron_id}_{int(time.time())}_{uuid.uuid4().hex}"
         return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
     
-    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+    def refund_payment(self, transaction_id: str, amount: float,
+                       idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
         """
         Refund a previous payment.
         
@@ -92,10 +162,14 @@ class PaymentGateway:
         Args:
             transaction_id: Original transaction ID to refund
             amount: Amount to refund
+            idempotency_key: As for process_payment()
             
         Returns:
             tuple: (success: bool, message: str)
         """
+        return self._once(idempotency_key, lambda: self._refund(transaction_id, amount))
+
+    def _refund(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
         time.sleep(0.5)
         
         if not transaction_id or not transaction_id.startswith("txn_"):
@@ -131,4 +205,261 @@ class PaymentGateway:
             "status": "completed",
             "amount": 10.50,
             "timestamp": time.time()
-        }
\ No newline at end of file
+        }
+
+
+class PaymentGatewayError(Exception):
+    """
+    The gateway could not be reached, did not answer in time, or failed (5xx).
+    retryable: repeating the request may succeed. sent: the request may have
+    reached the gateway, so whether it took effect is unknown; False when it
+    certainly did not (no connection, too busy, circuit open).
+    """
+
+    def __init__(self, message: str, retryable: bool = True, sent: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+        self.sent = sent
+
+
+class CircuitBreaker:
+    """
+    Fails gateway calls fast while the gateway is failing, instead of letting
+    every request wait out its timeouts. Keeps the outcomes of the last window
+    calls; once at least min_calls are recorded and the share of failures
+    reaches threshold the circuit opens and allow() refuses calls for
+    cooldown seconds. After that one trial call is let through (half-open):
+    success closes the circuit again, failure reopens it.
+    """
+
+    def __init__(self, threshold: float = PAYMENT_BREAKER_THRESHOLD, window: int = PAYMENT_BREAKER_WINDOW,
+                 min_calls: int = PAYMENT_BREAKER_MIN_CALLS, cooldown: float = PAYMENT_BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._clock = clock
+        self._outcomes = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'open' if self._clock() - self._opened_at < self.cooldown else 'half_open'
+
+    def allow(self) -> bool:
+        """Whether a call may go to the gateway now; every allowed call must be record()ed."""
+        with self._lock:
+            state = self._state()
+            if state == 'closed' or (state == 'half_open' and not self._trial):
+                self._trial = state == 'half_open'
+                return True
+            self._rejected += 1
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self._trial:
+                self._trial = False
+                self._outcomes.clear()
+                self._opened_at = None if ok else self._clock()
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures >= self.threshold * len(self._outcomes):
+                self._opened_at = self._clock()
+                self._outcomes.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._state(),
+                'recent_calls': len(self._outcomes),
+                'recent_failures': self._outcomes.count(False),
+                'rejected': self._rejected,
+            }
+
+
+class HTTPPaymentGateway(PaymentGateway):
+    """
+    PaymentGateway client for a real HTTP gateway API.
+
+    All calls go through one requests.Session whose connection pool keeps
+    up to max_concurrency keep-alive connections open, so a payment costs
+    one round trip instead of a TCP (and TLS) handshake plus a round trip.
+    A semaphore caps the calls in flight from this process at
+    max_concurrency; with acquire_timeout set, a caller that cannot get a
+    slot in time fails fast instead of queueing. Every request has
+    (connect, read) timeouts; one that times out, cannot connect or gets a
+    5xx is retried up to retries times with jittered exponential backoff,
+    and a CircuitBreaker stops calls altogether while most of them fail.
+    Charges and refunds carry an Idempotency-Key header (the caller's, or a
+    fresh one per call) so a retried request is never applied twice.
+    Instances are thread-safe and meant to be shared (see
+    get_payment_gateway()); the methods keep the blocking signatures of
+    PaymentGateway, so pay_late_fees() and refund_late_fee_payment() use
+    either interchangeably.
+
+    Declines and validation errors (4xx) come back as failed results like
+    the simulated gateway's; unreachable gateways, timeouts and 5xx
+    responses raise PaymentGatewayError.
+    """
+
+    def __init__(self, base_url: str, api_key: str = PAYMENT_API_KEY, max_concurrency: int = PAYMENT_MAX_CONCURRENCY,
+                 timeout: Union[float, Tuple[float, float]] = PAYMENT_TIMEOUT, acquire_timeout: Optional[float] = None,
+                 retries: int = PAYMENT_RETRIES, backoff: float = PAYMENT_RETRY_BACKOFF,
+                 breaker: Optional[CircuitBreaker] = None):
+        super().__init__(api_key)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _request(self, method: str, path: str, **kwargs) -> Tuple[int, Dict]:
+        retry = 0
+        while True:
+            try:
+                return self._attempt(method, path, **kwargs)
+            except PaymentGatewayError as e:
+                if not e.retryable or retry >= self.retries:
+                    raise
+            retry += 1
+            time.sleep(random.uniform(0, min(PAYMENT_RETRY_BACKOFF_MAX, self.backoff * 2 ** (retry - 1))))
+
+    def _attempt(self, method: str, path: str, **kwargs) -> Tuple[int, Dict]:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise PaymentGatewayError('Payment gateway busy: too many payments in progress', retryable=False, sent=False)
+        try:
+            if not self.breaker.allow():
+                raise PaymentGatewayError('Payment gateway unavailable: too many recent failures',
+                                          retryable=False, sent=False)
+            try:
+                response = self.session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+            except requests.ConnectTimeout:
+                error = PaymentGatewayError('Payment gateway timed out connecting', sent=False)
+            except requests.Timeout:
+                error = PaymentGatewayError('Payment gateway timed out')
+            except requests.ConnectionError as e:
+                reason = getattr(e.args[0], 'reason', None) if e.args else None
+                error = PaymentGatewayError(f'Payment gateway unreachable: {e}',
+                                            sent=not isinstance(reason, ConnectTimeoutError))
+            except requests.RequestException as e:
+                # e.g. a bad URL, a redirect loop or a body cut off mid-response
+                error = PaymentGatewayError(f'Payment gateway request failed: {e}', retryable=False)
+            except BaseException:
+                # Every allowed call must be recorded, or a half-open
+                # breaker would wait for its trial call forever
+                self.breaker.record(False)
+                raise
+            else:
+                error = None
+                if response.status_code >= 500:
+                    error = PaymentGatewayError(f'Payment gateway error (HTTP {response.status_code})')
+            self.breaker.record(error is None)
+            if error is not None:
+                raise error
+        finally:
+            self._slots.release()
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        line_items: Optional[List[Dict]] = None,
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        status, body = self._request('POST', '/charges', headers=_idempotency_header(idempotency_key), json={
+            'customer_id': patron_id,
+            'amount': amount,
+            'currency': 'usd',
+            'description': description,
+            'line_items': line_items or [],
+        })
+        if status == 200:
+            return True, body['id'], body.get('message', '')
+        return False, "", body.get('error', f'HTTP {status}')
+
+    def refund_payment(self, transaction_id: str, amount: float,
+                       idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
+        status, body = self._request('POST', '/refunds', headers=_idempotency_header(idempotency_key),
+                                     json={'transaction_id': transaction_id, 'amount': amount})
+        if status == 200:
+            return True, body.get('message', '')
+        return False, body.get('error', f'HTTP {status}')
+
+    def verify_payment_status(self, transaction_id: str) -> Dict:
+        status, body = self._request('GET', f'/charges/{transaction_id}')
+        if status == 200:
+            return body
+        return {"status": "not_found", "message": body.get('message', 'Transaction not found')}
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _idempotency_header(key: Optional[str]) -> Dict[str, str]:
+    return {'Idempotency-Key': key or uuid.uuid4().hex}
+
+
+_gateway: Optional[PaymentGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def configure_payment_gateway(base_url: Optional[str] = None, api_key: Optional[str] = None,
+                              max_concurrency: Optional[int] = None,
+                              timeout: Optional[Union[float, Tuple[float, float]]] = None) -> None:
+    """
+    Point get_payment_gateway() at a real gateway (base_url) or, with no
+    URL, back at the simulated one. Closes the previous shared client.
+    """
+    global _gateway, PAYMENT_GATEWAY_URL, PAYMENT_API_KEY, PAYMENT_MAX_CONCURRENCY, PAYMENT_TIMEOUT
+    with _gateway_lock:
+        PAYMENT_GATEWAY_URL = base_url
+        if api_key is not None:
+            PAYMENT_API_KEY = api_key
+        if max_concurrency is not None:
+            PAYMENT_MAX_CONCURRENCY = max_concurrency
+        if timeout is not None:
+            PAYMENT_TIMEOUT = timeout
+        if isinstance(_gateway, HTTPPaymentGateway):
+            _gateway.close()
+        _gateway = None
+
+
+def get_payment_gateway() -> PaymentGateway:
+    """The process-wide gateway client: pooled HTTP when PAYMENT_GATEWAY_URL is set, else simulated."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            if PAYMENT_GATEWAY_URL:
+                _gateway = HTTPPaymentGateway(PAYMENT_GATEWAY_URL, PAYMENT_API_KEY, PAYMENT_MAX_CONCURRENCY,
+                                              PAYMENT_TIMEOUT)
+            else:
+                _gateway = PaymentGateway(PAYMENT_API_KEY)
+        return _gateway
+
+
+def get_payment_stats() -> Dict:
+    """Which gateway the shared client talks to and, for a real one, its circuit breaker state."""
+    gateway = get_payment_gateway()
+    if isinstance(gateway, HTTPPaymentGateway):
+        return {'gateway': gateway.base_url, 'circuit': gateway.breaker.stats()}
+    return {'gateway': 'simulated', 'circuit': None}
@@ -34,12 +34,15 @@ def fresh_db(tmp_db_path, monkeypatch):
     monkeypatch.setattr(db, "DATABASE", str(tmp_db_path), raising=False)
     db.init_database()
     yield
-    # Clean up file between tests for isolation
-    if os.path.exists(tmp_db_path):
-        try:
-            os.remove(tmp_db_path)
-        except PermissionError:
-            pass  # Windows can occasionally hold the file briefly
+    # Drop pooled connections so the next test starts on a fresh file
+    db.close_all_connections()
+    # Clean up file (and any WAL/shared-memory sidecars) between tests for isolation
+    for path in (str(tmp_db_path), f"{tmp_db_path}-wal", f"{tmp_db_path}-shm"):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except PermissionError:
+                pass  # Windows can occasionally hold the file briefly
 
 @pytest.fixture
 def seed_books():
@@ -95,3 +98,14 @@ def set_due_date():
         conn.commit()
         conn.close()
     return _set
+
+@pytest.fixture
+def app():
+    """Flask app bound to the per-test database (no sample data, no job worker threads)."""
+    from app import create_app
+    return create_app({"DATABASE": db.DATABASE, "SAMPLE_DATA": False, "TESTING": True, "JOB_WORKERS": 0})
+
+@pytest.fixture
+def client(app):
+    """Flask test client for the per-test app."""
+    return app.test_client()
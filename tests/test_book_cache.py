@@ -0,0 +1,195 @@
+import io
+import threading
+
+import pytest
+import database as db
+import library_service as svc
+from cache import LRUCache
+from services.import_service import import_books
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def cache_mode():
+    """Switch the book cache mode for one test, restoring the defaults afterwards."""
+    saved = (db.BOOK_CACHE_MODE, db.BOOK_CACHE_SIZE, db.BOOK_CACHE_TTL)
+    yield lambda mode, **kwargs: db.configure_book_cache(mode, **kwargs)
+    db.configure_book_cache(*saved)
+
+
+def _raw(sql, params=()):
+    conn = db.get_db_connection()
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+def test_lru_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(max_size=4, ttl=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 1, 1)
+
+
+def test_put_after_invalidation_is_dropped():
+    cache = LRUCache()
+    token = cache.load_token()
+    cache.invalidate("a")  # a writer got in between the load and the put
+    assert cache.put("a", "stale", token) is False
+    assert cache.get("a") is None
+    assert cache.stats()["stale_puts"] == 1
+
+
+def test_repeat_lookups_are_served_from_cache(seed_books):
+    book = seed_books[0]
+    assert db.get_book_by_id(book["id"]) == book
+    checkouts = db.get_pool_stats()["checkouts"]
+    for _ in range(5):
+        assert db.get_book_by_id(book["id"]) == book
+        assert db.get_book_by_isbn(book["isbn"]) == book
+    assert db.get_pool_stats()["checkouts"] == checkouts
+    assert db.get_book_cache_stats()["books"]["hits"] >= 10
+
+
+def test_returned_rows_are_copies(seed_books):
+    book = db.get_book_by_id(seed_books[0]["id"])
+    book["title"] = "Scribbled"
+    assert db.get_book_by_id(seed_books[0]["id"])["title"] == seed_books[0]["title"]
+
+
+def test_availability_writes_invalidate(seed_books):
+    book = seed_books[0]
+    db.get_book_by_id(book["id"])
+    db.update_book_availability(book["id"], -1)
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"] - 1
+
+    ok, _ = svc.borrow_book_by_patron("123456", book["id"])
+    assert ok
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"] - 2
+    ok, _ = svc.return_book_by_patron("123456", book["id"])
+    assert ok
+    assert db.get_book_by_isbn(book["isbn"])["available_copies"] == book["available_copies"] - 1
+
+
+def test_insert_book_invalidates_isbn(seed_books):
+    assert db.get_book_by_isbn("9999999999999") is None
+    assert db.insert_book("New", "Author", "9999999999999", 1, 1)
+    assert db.get_book_by_isbn("9999999999999")["title"] == "New"
+
+
+def test_bulk_upsert_invalidates(seed_books):
+    book = seed_books[1]
+    db.get_book_by_isbn(book["isbn"])
+    feed = f"title,author,isbn,total_copies\nRenamed,Someone,{book['isbn']},5\n"
+    import_books(io.StringIO(feed), on_duplicate="upsert")
+    assert db.get_book_by_isbn(book["isbn"])["title"] == "Renamed"
+    assert db.get_book_by_id(book["id"])["total_copies"] == 5
+
+
+def test_full_mode_misses_external_writes_until_ttl(seed_books, cache_mode):
+    clock = FakeClock()
+    cache_mode("full")
+    db._book_cache = LRUCache(16, ttl=60, clock=clock)
+    book = seed_books[0]
+    db.get_book_by_id(book["id"])
+    _raw("UPDATE books SET available_copies = 0 WHERE id = ?", (book["id"],))
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"]
+    clock.now = 60
+    assert db.get_book_by_id(book["id"])["available_copies"] == 0
+
+
+def test_metadata_mode_reads_availability_fresh(seed_books, cache_mode):
+    cache_mode("metadata")
+    book = seed_books[0]
+    db.get_book_by_id(book["id"])
+    _raw("UPDATE books SET available_copies = 0, title = 'Changed' WHERE id = ?", (book["id"],))
+    cached = db.get_book_by_id(book["id"])
+    assert cached["available_copies"] == 0
+    assert cached["title"] == book["title"]  # metadata still comes from the cache
+
+    _raw("DELETE FROM books WHERE id = ?", (book["id"],))
+    assert db.get_book_by_id(book["id"]) is None
+
+
+def test_off_mode_always_reads_database(seed_books, cache_mode):
+    cache_mode("off")
+    book = seed_books[0]
+    db.get_book_by_id(book["id"])
+    _raw("UPDATE books SET title = 'Changed' WHERE id = ?", (book["id"],))
+    assert db.get_book_by_id(book["id"])["title"] == "Changed"
+    assert db.get_book_cache_stats()["books"]["hits"] == 0
+
+
+def test_uncommitted_reads_are_not_cached(seed_books):
+    book = seed_books[0]
+    with pytest.raises(RuntimeError):
+        with db.transaction() as conn:
+            conn.execute("UPDATE books SET available_copies = 0 WHERE id = ?", (book["id"],))
+            assert db.get_book_by_id(book["id"])["available_copies"] == 0
+            raise RuntimeError("rolled back")
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"]
+
+
+def test_session_writes_invalidate_again_after_commit(seed_books):
+    book = seed_books[0]
+    started, cached = threading.Event(), threading.Event()
+
+    def reader():
+        started.wait()
+        db.get_book_by_id(book["id"])  # sees the pre-commit row and caches it
+        cached.set()
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    with db.transaction():
+        db.update_book_availability(book["id"], -1)
+        started.set()
+        cached.wait(5)
+    thread.join()
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"] - 1
+
+
+def test_unknown_mode_rejected(cache_mode):
+    with pytest.raises(ValueError):
+        cache_mode("sometimes")
+
+
+def test_lru_bound_applies(add_book, cache_mode):
+    cache_mode("full", max_size=3)
+    books = [add_book(f"Bound {i}", "Author", f"{6000000000000 + i}", 1) for i in range(5)]
+    for book in books:
+        db.get_book_by_id(book["id"])
+    stats = db.get_book_cache_stats()["books"]
+    assert stats["size"] == 3
+    assert stats["evictions"] >= 2
+
+
+def test_stats_endpoint_reports_cache(client, seed_books):
+    db.get_book_by_id(seed_books[0]["id"])
+    db.get_book_by_id(seed_books[0]["id"])
+    stats = client.get("/api/stats").get_json()["book_cache"]
+    assert stats["mode"] == db.BOOK_CACHE_MODE
+    assert stats["books"]["hits"] >= 1
@@ -0,0 +1,137 @@
+import io
+import json
+
+import pytest
+import database as db
+from services import import_service
+
+
+CSV_FEED = """title,author,isbn,total_copies
+Dune,Frank Herbert,9780441172719,3
+,No Title,9780000000001,1
+Emma,Jane Austen,978014143958,2
+Foundation,Isaac Asimov,9780553293357,two
+Dune Messiah,Frank Herbert,9780441172719,1
+Neuromancer,William Gibson,9780441569595,4
+"""
+
+
+def _import(text, fmt="csv", **kw):
+    return import_service.import_books(io.StringIO(text), fmt, **kw)
+
+
+def test_csv_import_reports_per_row_errors_without_aborting():
+    report = _import(CSV_FEED, batch_size=2)
+
+    assert report["processed"] == 6
+    assert report["inserted"] == 2
+    assert report["skipped"] == 1
+    assert report["error_count"] == 3
+    assert {e["row"]: e["error"] for e in report["errors"]} == {
+        3: "Title is required.",
+        4: "ISBN must be exactly 13 digits.",
+        5: "Total copies must be a positive integer.",
+    }
+    assert report["skipped_rows"] == [{"row": 6, "isbn": "9780441172719", "reason": "Duplicate ISBN."}]
+    assert db.get_book_by_isbn("9780441172719")["title"] == "Dune"
+    assert db.get_book_by_isbn("9780441569595")["total_copies"] == 4
+
+
+def test_upsert_updates_existing_books_and_keeps_loans_consistent(add_book, borrow_helper):
+    book = add_book("Old Title", "Old Author", "9780441172719", 3)
+    borrow_helper("123456", book["id"])
+
+    report = _import("title,author,isbn,total_copies\nDune,Frank Herbert,9780441172719,5\n",
+                     on_duplicate="upsert")
+
+    assert report["updated"] == 1
+    after = db.get_book_by_isbn("9780441172719")
+    assert (after["title"], after["total_copies"], after["available_copies"]) == ("Dune", 5, 4)
+
+
+def test_upsert_counts_a_repeated_new_isbn_once(add_book):
+    add_book("Old Title", "Old Author", "9780441172719", 3)
+    feed = ("title,author,isbn,total_copies\nDune,Frank Herbert,9780441172719,5\n"
+            "Emma,Jane Austen,9780141439587,1\nEmma (2nd ed.),Jane Austen,9780141439587,2\n")
+    report = _import(feed, on_duplicate="upsert")
+    assert (report["inserted"], report["updated"], report["skipped"]) == (1, 1, 1)
+    assert report["skipped_rows"] == [
+        {"row": 3, "isbn": "9780141439587", "reason": "Superseded by a later row with the same ISBN."}]
+    assert db.get_book_by_isbn("9780141439587")["title"] == "Emma (2nd ed.)"
+
+
+def test_skip_leaves_existing_books_untouched(add_book):
+    add_book("Original", "Author", "9780441172719", 1)
+    report = _import("title,author,isbn,total_copies\nChanged,Author,9780441172719,9\n")
+    assert report["skipped"] == 1
+    assert db.get_book_by_isbn("9780441172719")["title"] == "Original"
+
+
+def test_ndjson_import():
+    lines = [
+        json.dumps({"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "total_copies": 2}),
+        "not json",
+        json.dumps(["a", "list"]),
+        "",
+        json.dumps({"title": "Emma", "author": "Jane Austen", "isbn": "9780141439587", "copies": "1"}),
+    ]
+    report = _import("\n".join(lines), "ndjson")
+    assert report["inserted"] == 2
+    assert [e["row"] for e in report["errors"]] == [2, 3]
+
+
+@pytest.mark.parametrize("copies, expected", [(True, None), (3.5, None), ("3.0", None), (3.0, 3), ("2", 2)])
+def test_copy_counts_must_be_integers(copies, expected):
+    report = _import(json.dumps({"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719",
+                                 "total_copies": copies}), "ndjson")
+    if expected is None:
+        assert report["errors"][0]["error"] == "Total copies must be a positive integer."
+    else:
+        assert report["inserted"] == 1 and db.get_book_by_isbn("9780441172719")["total_copies"] == expected
+
+
+def test_marc_lite_import():
+    feed = (
+        "245 $a The Left Hand of Darkness\n100 $a Ursula K. Le Guin\n020 9780441478125\n949 2\n"
+        "\n"
+        "245 Missing Copies\n100 Someone\n020 9780000000000\n"
+    )
+    report = _import(feed, "marc")
+    assert report["inserted"] == 1
+    assert report["errors"] == [{"row": 6, "isbn": "9780000000000",
+                                 "error": "Total copies must be a positive integer."}]
+    assert db.get_book_by_isbn("9780441478125")["author"] == "Ursula K. Le Guin"
+
+
+def test_imported_books_are_searchable():
+    _import(CSV_FEED)
+    assert [b["title"] for b in db.search_books_fulltext("neuromancer")] == ["Neuromancer"]
+
+
+def test_bad_format_rejected():
+    with pytest.raises(ValueError):
+        _import("", "xml")
+    with pytest.raises(ValueError):
+        _import("", "csv", on_duplicate="merge")
+
+
+def test_bulk_endpoint_accepts_body_and_upload(client):
+    res = client.post("/api/books/bulk?format=csv", data=CSV_FEED.encode(), content_type="text/csv")
+    assert res.status_code == 200
+    assert res.get_json()["inserted"] == 2
+
+    feed = "title,author,isbn,total_copies\nEmma,Jane Austen,9780141439587,1\n"
+    res = client.post("/api/books/bulk", data={"file": (io.BytesIO(feed.encode()), "feed.csv")},
+                      content_type="multipart/form-data")
+    assert res.get_json()["inserted"] == 1
+
+    assert client.post("/api/books/bulk?format=xml", data=b"").status_code == 400
+
+
+def test_import_cli(app, tmp_path):
+    path = tmp_path / "feed.csv"
+    path.write_text(CSV_FEED)
+    result = app.test_cli_runner().invoke(args=["import-books", str(path), "--batch-size", "2"])
+    assert result.exit_code == 0, result.output
+    assert "2 inserted" in result.output
+    assert "row 3: Title is required." in result.output
@@ -0,0 +1,98 @@
+import pytest
+import database as db
+import library_service as svc
+
+
+@pytest.fixture
+def many_books(add_book):
+    # duplicate titles make sure the id tie-breaker is honoured
+    titles = [f"Title {i % 7:02d}" for i in range(23)]
+    return [add_book(t, "Author", f"{3000000000000 + i}", 1) for i, t in enumerate(titles)]
+
+
+def _key(book):
+    return (book["title"], book["id"])
+
+
+def test_forward_pages_cover_catalog_once_in_order(many_books):
+    seen, cursor = [], None
+    while True:
+        page = svc.get_catalog_page(cursor, limit=5)
+        assert page["status"] == "ok"
+        seen.extend(page["books"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert [_key(b) for b in seen] == sorted(_key(b) for b in many_books)
+
+
+def test_backward_pages_mirror_forward_pages(many_books):
+    forward, cursor = [], None
+    while True:
+        page = svc.get_catalog_page(cursor, limit=6)
+        forward.append([b["id"] for b in page["books"]])
+        if page["next_cursor"] is None:
+            break
+        cursor = page["next_cursor"]
+
+    backward, cursor = [], page["prev_cursor"]
+    while cursor:
+        page = svc.get_catalog_page(cursor, limit=6)
+        backward.insert(0, [b["id"] for b in page["books"]])
+        cursor = page["prev_cursor"]
+
+    assert backward == forward[:-1]
+
+
+def test_first_page_has_no_prev_and_last_has_no_next(many_books):
+    first = svc.get_catalog_page(limit=10)
+    assert first["prev_cursor"] is None
+    assert first["next_cursor"] is not None
+
+    everything = svc.get_catalog_page(limit=100)
+    assert everything["next_cursor"] is None
+    assert len(everything["books"]) == len(many_books)
+
+
+@pytest.mark.parametrize("cursor", ["garbage!", db.encode_cursor(["sideways", "x", 1]), db.encode_cursor({"a": 1})])
+def test_invalid_cursor_rejected(cursor):
+    page = svc.get_catalog_page(cursor)
+    assert page["status"] == "error"
+    assert "cursor" in page["message"].lower()
+
+
+@pytest.mark.parametrize("limit", [0, -1, svc.MAX_PAGE_SIZE + 1, True])
+def test_invalid_page_size_rejected(limit):
+    assert svc.get_catalog_page(limit=limit)["status"] == "error"
+
+
+def test_pages_seek_through_title_index(many_books):
+    statements = []
+    cursor = svc.get_catalog_page(limit=5)["next_cursor"]
+    with db.db_session() as conn:
+        conn.set_trace_callback(statements.append)
+        svc.get_catalog_page(cursor, limit=5)
+        conn.set_trace_callback(None)
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + statements[-1]).fetchall()]
+    assert plan == ["SEARCH books USING INDEX idx_books_title_id (title>?)"]
+
+
+def test_api_books_endpoint_pages(client, many_books):
+    first = client.get("/api/books?limit=20").get_json()
+    assert first["count"] == 20
+    second = client.get(f"/api/books?limit=20&cursor={first['next_cursor']}").get_json()
+    assert second["count"] == 3
+    assert second["next_cursor"] is None
+    assert second["prev_cursor"] is not None
+
+
+def test_api_books_rejects_bad_input(client):
+    assert client.get("/api/books?limit=abc").status_code == 400
+    assert client.get("/api/books?cursor=nope").status_code == 400
+
+
+def test_catalog_page_links_to_next_page(client, many_books):
+    html = client.get("/catalog?limit=5").get_data(as_text=True)
+    assert "Next &rarr;" in html
+    assert "Previous" not in html
+    assert html.count("<tr>") == 1 + 5  # header row + one page
@@ -0,0 +1,119 @@
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+import database as db
+import library_service as svc
+
+POLL_INTERVAL = 0.1
+
+
+@pytest.fixture
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(db, "CHANGE_POLL_INTERVAL", 0.0)
+
+
+def _external_write(sql, params=()):
+    """Write through a connection this process's pool and caches know nothing about."""
+    conn = sqlite3.connect(db.DATABASE)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_write_paths_bump_counters(seed_books):
+    book = seed_books[0]
+    before = db.get_change_versions()
+
+    db.insert_book("Counted", "Author", "7777777777777", 1, 1)
+    ok, _ = svc.borrow_book_by_patron("123456", book["id"])
+    assert ok
+    after = db.get_change_versions()
+
+    assert after["catalog"] == before["catalog"] + 1
+    assert after["availability"] == before["availability"] + 1
+    assert after["loans"] > before["loans"]
+
+
+def test_unchanged_availability_does_not_bump(seed_books):
+    before = db.get_change_versions()
+    _external_write("UPDATE books SET available_copies = available_copies WHERE id = ?", (seed_books[0]["id"],))
+    assert db.get_change_versions() == before
+
+
+def test_poll_reports_each_change_once(seed_books, fast_polling):
+    db.poll_changes()  # baseline
+    _external_write("UPDATE books SET title = 'Renamed' WHERE id = ?", (seed_books[0]["id"],))
+    assert db.poll_changes() == ["catalog"]
+    assert db.poll_changes() == []
+
+
+def test_poll_is_rate_limited(seed_books, monkeypatch):
+    monkeypatch.setattr(db, "CHANGE_POLL_INTERVAL", 60)
+    db.poll_changes(force=True)
+    _external_write("UPDATE books SET title = 'Renamed' WHERE id = ?", (seed_books[0]["id"],))
+    assert db.poll_changes() == []
+    assert db.poll_changes(force=True) == ["catalog"]
+
+
+def test_external_write_invalidates_book_cache(seed_books, fast_polling):
+    book = seed_books[0]
+    db.get_book_by_id(book["id"])
+    _external_write("UPDATE books SET title = 'Renamed', available_copies = 0 WHERE id = ?", (book["id"],))
+    cached = db.get_book_by_id(book["id"])
+    assert cached["title"] == "Renamed"
+    assert cached["available_copies"] == 0
+    assert db.get_book_by_isbn(book["isbn"])["title"] == "Renamed"
+
+
+def test_listeners_are_notified(seed_books, fast_polling, monkeypatch):
+    seen = []
+    monkeypatch.setitem(db._change_listeners, "loans", [seen.append])
+    db.poll_changes()
+    db.insert_borrow_record("123456", seed_books[0]["id"], db.datetime.now(), db.datetime.now())
+    db.poll_changes()
+    assert seen == ["loans"]
+
+
+def _reader(path, book_id, interval, ready, results):
+    """Worker process: keep serving a book from its own cache until the title changes."""
+    db.configure_storage(database=path)
+    db.CHANGE_POLL_INTERVAL = interval
+    title = db.get_book_by_id(book_id)["title"]
+    ready.set()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        if db.get_book_by_id(book_id)["title"] != title:
+            results.put((time.time(), db.get_book_cache_stats()["books"]["hits"]))
+            return
+        time.sleep(0.002)
+    results.put((None, None))
+
+
+def test_other_process_sees_write_within_poll_interval(seed_books):
+    book = seed_books[0]
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Event(), ctx.Queue()
+    worker = ctx.Process(target=_reader, args=(db.DATABASE, book["id"], POLL_INTERVAL, ready, results))
+    worker.start()
+    try:
+        assert ready.wait(30), "reader process did not start"
+        time.sleep(3 * POLL_INTERVAL)  # let the reader serve from its cache for a while
+        db.insert_books_bulk([("Retitled", book["author"], book["isbn"], book["total_copies"])], "upsert")
+        written = time.time()
+        seen_at, hits = results.get(timeout=15)
+    finally:
+        worker.join(15)
+
+    assert seen_at is not None, "reader never saw the write"
+    assert hits > 0, "reader was not serving from its cache"
+    # Bounded staleness: one poll interval plus scheduling slack
+    assert seen_at - written < POLL_INTERVAL + 0.5
+
+
+def test_stats_endpoint_reports_counters(client, seed_books):
+    db.poll_changes(force=True)
+    stats = client.get("/api/stats").get_json()["changes"]
+    assert set(stats["versions"]) == set(db.CHANGE_COUNTERS)
+    assert stats["poll_interval"] == db.CHANGE_POLL_INTERVAL
@@ -0,0 +1,64 @@
+import threading
+
+import database as db
+import library_service as svc
+
+
+def _run_concurrently(fn, args_list):
+    """Start every call at once (behind a barrier) and collect the results."""
+    barrier = threading.Barrier(len(args_list))
+    results = [None] * len(args_list)
+
+    def worker(i, args):
+        barrier.wait()
+        results[i] = fn(*args)
+
+    threads = [threading.Thread(target=worker, args=(i, a)) for i, a in enumerate(args_list)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_parallel_borrows_never_oversell(add_book):
+    book = add_book("Contended", "Some Author", "5555555555555", 3)
+    patrons = [f"{100000 + i}" for i in range(20)]
+
+    results = _run_concurrently(svc.borrow_book_by_patron, [(p, book["id"]) for p in patrons])
+
+    successes = [ok for ok, _ in results if ok]
+    assert len(successes) == 3
+    assert all("not available" in msg for ok, msg in results if not ok)
+    after = db.get_book_by_id(book["id"])
+    assert after["available_copies"] == 0
+
+    conn = db.get_db_connection()
+    loans = conn.execute("SELECT COUNT(*) FROM borrow_records WHERE book_id = ?", (book["id"],)).fetchone()[0]
+    conn.close()
+    assert loans == 3
+
+
+def test_parallel_borrows_respect_patron_limit(add_book):
+    books = [add_book(f"Book {i}", "Author", f"{6000000000000 + i}", 2) for i in range(10)]
+
+    results = _run_concurrently(svc.borrow_book_by_patron, [("777777", b["id"]) for b in books])
+
+    assert sum(1 for ok, _ in results if ok) == 5
+    assert db.get_patron_borrow_count("777777") == 5
+    assert all("maximum borrowing limit" in msg for ok, msg in results if not ok)
+
+
+def test_parallel_returns_restore_each_copy_once(add_book):
+    book = add_book("Returned", "Some Author", "7777777777777", 4)
+    patrons = [f"{200000 + i}" for i in range(4)]
+    for p in patrons:
+        ok, _ = svc.borrow_book_by_patron(p, book["id"])
+        assert ok
+
+    # every patron returns twice at the same time; only one return each may count
+    results = _run_concurrently(svc.return_book_by_patron, [(p, book["id"]) for p in patrons * 2])
+
+    assert sum(1 for ok, _ in results if ok) == 4
+    assert db.get_book_by_id(book["id"])["available_copies"] == 4
+    assert all(db.get_patron_borrow_count(p) == 0 for p in patrons)
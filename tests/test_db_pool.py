@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+import database as db
+
+
+def test_connections_are_reused_across_helpers(seed_books):
+    db.get_book_by_id(seed_books[0]["id"])
+    db.get_book_by_isbn(seed_books[1]["isbn"])
+    db.get_all_books()
+
+    stats = db.get_pool_stats()
+    assert stats["size"] == 1
+    assert stats["created"] == 1
+    assert stats["in_use"] == 0
+    assert stats["checkouts"] >= 3
+
+
+def test_pragmas_applied_on_new_connection():
+    conn = db.get_db_connection()
+    timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.close()
+    assert timeout == db.get_connection_pragmas()["busy_timeout"]
+
+
+def test_closed_proxy_rejects_use():
+    conn = db.get_db_connection()
+    conn.close()
+    conn.close()  # double close is harmless
+    with pytest.raises(db.sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_session_shares_one_connection(seed_books):
+    before = db.get_pool_stats()["checkouts"]
+    with db.db_session():
+        a = db.get_db_connection()
+        b = db.get_db_connection()
+        assert a._conn is b._conn
+        db.get_book_by_id(seed_books[0]["id"])
+        db.get_patron_borrow_count("123456")
+    assert db.get_pool_stats()["checkouts"] == before + 1
+
+
+def test_session_rolls_back_on_error(seed_books):
+    book = seed_books[0]
+    with pytest.raises(RuntimeError):
+        with db.db_session() as conn:
+            conn.execute("UPDATE books SET available_copies = 0 WHERE id = ?", (book["id"],))
+            raise RuntimeError("boom")
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"]
+
+
+def test_pool_is_bounded_under_threads(seed_books, monkeypatch):
+    monkeypatch.setattr(db, "POOL_MAX_SIZE", 2)
+    db.close_all_connections()
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                assert len(db.get_all_books()) == len(seed_books)
+        except Exception as e:  # pragma: no cover - surfaced by the assert below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = db.get_pool_stats()
+    assert errors == []
+    assert stats["size"] <= 2
+    assert stats["checkouts"] == 6 * 20
+
+
+def test_failed_queries_return_their_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "POOL_TIMEOUT", 0.5)
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "unmigrated.db"))
+    for _ in range(db.POOL_MAX_SIZE + 2):
+        with pytest.raises(db.sqlite3.OperationalError, match="no such table"):
+            db.get_all_books()
+    assert db.get_pool_stats()["in_use"] == 0
+    db.close_all_connections()
+
+
+def test_exhausted_pool_counts_waits():
+    pool = db.ConnectionPool(db.DATABASE, max_size=1, timeout=5)
+    held = pool.acquire()
+    threading.Timer(0.05, pool.release, (held,)).start()
+    pool.release(pool.acquire())
+    stats = pool.stats()
+    assert stats["waits"] == 1 and stats["checkouts"] == 2
+    pool.close()
@@ -38,9 +38,12 @@ def _wait_for_server(url: str, timeout: float = 15) -> None:
 @pytest.fixture(scope="session", autouse=True)
 def start_app_server():
     """Start the Flask development server for the duration of the test session."""
-    db_path = Path("library.db")
-    if db_path.exists():
-        db_path.unlink()
+    # Remove the database along with its WAL sidecars, which would otherwise
+    # be replayed into the fresh file
+    for name in ("library.db", "library.db-wal", "library.db-shm"):
+        db_path = Path(name)
+        if db_path.exists():
+            db_path.unlink()
 
     env = os.environ.copy()
     env["FLASK_ENV"] = "testing"
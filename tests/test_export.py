@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+from services import export_service
+
+
+@pytest.fixture
+def loans(seed_books):
+    now = datetime(2024, 3, 10, 12, 0, 0)
+    rows = [
+        ("111111", seed_books[0]["id"], now - timedelta(days=40)),
+        ("111111", seed_books[1]["id"], now - timedelta(days=5)),
+        ("222222", seed_books[2]["id"], now - timedelta(days=2)),
+    ]
+    for patron, book_id, borrowed in rows:
+        db.insert_borrow_record(patron, book_id, borrowed, borrowed + timedelta(days=14))
+    return rows
+
+
+def test_books_ndjson_has_every_book(seed_books):
+    text = "".join(export_service.export_books("ndjson"))
+    rows = [json.loads(line) for line in text.splitlines()]
+    assert sorted(r["isbn"] for r in rows) == sorted(b["isbn"] for b in seed_books)
+
+
+def test_books_csv_round_trips(seed_books):
+    text = "".join(export_service.export_books("csv"))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert list(rows[0].keys()) == export_service.BOOK_FIELDS
+    assert {r["title"] for r in rows} == {b["title"] for b in seed_books}
+
+
+def test_export_streams_in_bounded_chunks(add_book, monkeypatch):
+    monkeypatch.setattr(export_service, "CHUNK_ROWS", 4)
+    for i in range(10):
+        add_book(f"Book {i}", "Author", f"{4000000000000 + i}", 1)
+
+    chunks = export_service.export_books("ndjson")
+    first = next(chunks)
+    assert first.count("\n") == 4
+    assert db.get_pool_stats()["in_use"] == 1  # reading holds one connection
+
+    chunks.close()
+    assert db.get_pool_stats()["in_use"] == 0  # released when the stream stops early
+
+
+def test_iter_rows_uses_fetchmany_batches(add_book):
+    for i in range(7):
+        add_book(f"Book {i}", "Author", f"{4100000000000 + i}", 1)
+    assert [b["title"] for b in db.iter_books(batch_size=3)] == [f"Book {i}" for i in range(7)]
+
+
+def test_loans_filters(loans):
+    def export(**kw):
+        return [json.loads(line) for line in "".join(export_service.export_loans("ndjson", **kw)).splitlines()]
+
+    assert len(export()) == 3
+    assert {r["patron_id"] for r in export(patron_id="111111")} == {"111111"}
+    recent = export(start="2024-03-01")
+    assert len(recent) == 2
+    assert len(export(patron_id="111111", start="2024-03-01", end="2024-03-06")) == 1
+    assert recent[0]["title"]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"fmt": "xml"},
+    {"patron_id": "12"},
+    {"start": "last tuesday"},
+])
+def test_loans_bad_arguments_fail_before_streaming(kwargs):
+    with pytest.raises(ValueError):
+        export_service.export_loans(**kwargs)
+
+
+def test_export_endpoints_stream(client, loans):
+    res = client.get("/api/export/loans?format=csv&patron_id=111111")
+    assert res.status_code == 200
+    assert res.is_streamed
+    assert res.mimetype == "text/csv"
+    assert "attachment" in res.headers["Content-Disposition"]
+    assert len(res.get_data(as_text=True).strip().splitlines()) == 1 + 2
+
+    books = client.get("/api/export/books")
+    assert books.mimetype == "application/x-ndjson"
+    assert len(books.get_data(as_text=True).splitlines()) == 3
+
+
+def test_export_endpoint_rejects_bad_format(client):
+    res = client.get("/api/export/books?format=xml")
+    assert res.status_code == 400
+    assert "format" in res.get_json()["error"]
+
+
+def test_export_cli_writes_backup(app, loans, tmp_path):
+    out = tmp_path / "loans.csv"
+    result = app.test_cli_runner().invoke(args=["export", "loans", "--format", "csv", "-o", str(out)])
+    assert result.exit_code == 0, result.output
+    assert len(out.read_text().strip().splitlines()) == 1 + 3
+
+    result = app.test_cli_runner().invoke(args=["export", "books"])
+    assert result.exit_code == 0
+    assert len(result.output.splitlines()) == 3
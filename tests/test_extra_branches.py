@@ -1,4 +1,5 @@
 # tests/test_library_extra_branches_gpt5.py
+import database as db
 import services.library_service as svc
 
 
@@ -15,52 +16,44 @@ def test_add_book_rejects_author_over_100_chars():
     assert "less than 100" in msg
 
 
-def test_borrow_book_insert_borrow_record_fails(mocker):
-    # valid patron and existing book
-    mocker.patch("library_service.get_book_by_id", return_value={
-        "id": 1,
-        "title": "X",
-        "available_copies": 1,
-        "total_copies": 1,
-    })
-    mocker.patch("library_service.get_patron_borrow_count", return_value=0)
-    # force failure
-    mocker.patch("library_service.insert_borrow_record", return_value=False)
+def test_borrow_book_transaction_error(mocker):
+    # the single borrow transaction failed (e.g. database locked)
+    mocker.patch("library_service.borrow_book_atomic", return_value=("error", None))
 
     ok, msg = svc.borrow_book_by_patron("123456", 1)
     assert ok is False
     assert "Database error occurred while creating borrow record" in msg
 
 
-def test_borrow_book_update_availability_fails(mocker):
-    mocker.patch("library_service.get_book_by_id", return_value={
-        "id": 1,
-        "title": "X",
-        "available_copies": 1,
-        "total_copies": 1,
-    })
-    mocker.patch("library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("library_service.insert_borrow_record", return_value=True)
-    mocker.patch("library_service.update_book_availability", return_value=False)
+def test_borrow_book_atomic_rolls_back_when_insert_fails(seed_books, mocker):
+    book = seed_books[0]
+    real_transaction = db.transaction
 
-    ok, msg = svc.borrow_book_by_patron("123456", 1)
+    class FailingInsert:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, params=()):
+            if sql.strip().startswith("INSERT INTO borrow_records"):
+                raise db.sqlite3.OperationalError("disk I/O error")
+            return self.conn.execute(sql, params)
+
+    @db.contextmanager
+    def failing_transaction(*args, **kwargs):
+        with real_transaction(*args, **kwargs) as conn:
+            yield FailingInsert(conn)
+
+    mocker.patch("database.transaction", failing_transaction)
+
+    ok, msg = svc.borrow_book_by_patron("123456", book["id"])
     assert ok is False
-    assert "Database error occurred while updating book availability" in msg
-
-
-def test_return_book_update_return_record_fails(mocker):
-    mocker.patch("library_service.get_book_by_id", return_value={
-        "id": 1,
-        "title": "X",
-        "available_copies": 0,
-        "total_copies": 1,
-    })
-    # active borrow list will contain the book
-    mocker.patch("library_service.get_patron_borrowed_books", return_value=[{
-        "book_id": 1,
-        "due_date": svc.datetime.now(),
-    }])
-    mocker.patch("library_service.update_borrow_record_return_date", return_value=False)
+    assert "Database error occurred while creating borrow record" in msg
+    # the decrement was rolled back together with the failed insert
+    assert db.get_book_by_id(book["id"])["available_copies"] == book["available_copies"]
+
+
+def test_return_book_transaction_error(mocker):
+    mocker.patch("library_service.return_book_atomic", return_value=("error", None))
 
     ok, msg = svc.return_book_by_patron("123456", 1)
     assert ok is False
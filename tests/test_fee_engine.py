@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+from services import fee_engine
+
+BACKENDS = [False] + ([True] if fee_engine.has_numpy() else [])
+
+
+def _scalar(due: datetime, basis: datetime):
+    days = max(0, (basis - due).days)
+    return days, svc._fee_for_days(days)
+
+
+def _random_pairs(seed, n=2000):
+    """Random (due, basis) pairs, biased towards day and tier boundaries."""
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    pairs = []
+    for _ in range(n):
+        due = base + timedelta(microseconds=rng.randrange(0, 400 * fee_engine.US_PER_DAY))
+        whole_days = rng.choice([rng.randint(-30, 60), 0, 1, 6, 7, 8, 14, 15, 16])
+        jitter = rng.choice([0, 1, -1, rng.randint(-10**6, 10**6), rng.randint(0, fee_engine.US_PER_DAY - 1)])
+        pairs.append((due, due + timedelta(days=whole_days, microseconds=jitter)))
+    return pairs
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_scalar_fee_policy(seed, use_numpy):
+    pairs = _random_pairs(seed)
+    due_us = [fee_engine.to_epoch_us(d) for d, _ in pairs]
+    basis_us = [fee_engine.to_epoch_us(b) for _, b in pairs]
+
+    days, fees = fee_engine.compute_fees(due_us, basis_us, use_numpy=use_numpy)
+
+    expected = [_scalar(d, b) for d, b in pairs]
+    assert days == [e[0] for e in expected]
+    assert fees == [e[1] for e in expected]
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_iso_parsing_matches_fromisoformat(use_numpy):
+    dates = ["2024-03-10T12:00:00.123456", "2024-03-10T12:00:00", "1999-12-31T23:59:59.999999"]
+    parsed = fee_engine.parse_epoch_us(dates, use_numpy=use_numpy)
+    assert list(parsed) == [fee_engine.to_epoch_us(datetime.fromisoformat(d)) for d in dates]
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_scalar_basis_and_empty_input(use_numpy):
+    as_of = datetime(2024, 2, 1)
+    due = [(as_of - timedelta(days=d)).isoformat() for d in (0, 3, 10, 40)]
+    days, fees = fee_engine.fees_for_due_dates(due, as_of, use_numpy=use_numpy)
+    assert days == [0, 3, 10, 40]
+    assert fees == [0.0, 1.5, 6.5, 15.0]
+    assert fee_engine.fees_for_due_dates([], as_of, use_numpy=use_numpy) == ([], [])
+
+
+def test_forcing_missing_numpy_raises(monkeypatch):
+    monkeypatch.setattr(fee_engine, "np", None)
+    with pytest.raises(RuntimeError):
+        fee_engine.compute_fees([0], 0, use_numpy=True)
+    # auto mode quietly falls back
+    assert fee_engine.compute_fees([0], fee_engine.US_PER_DAY * 3) == ([3], [1.5])
+
+
+def test_outstanding_fees_across_patrons(seed_books):
+    now = datetime(2024, 5, 1, 9, 30)
+    loans = [("111111", 0, 3), ("111111", 1, 10), ("222222", 2, 0)]
+    for patron, idx, days_late in loans:
+        due = now - timedelta(days=days_late)
+        db.insert_borrow_record(patron, seed_books[idx]["id"], due - timedelta(days=14), due)
+    # returned loans are not outstanding
+    db.insert_borrow_record("333333", seed_books[0]["id"], now - timedelta(days=60), now - timedelta(days=46))
+    db.update_borrow_record_return_date("333333", seed_books[0]["id"], now)
+
+    report = svc.calculate_outstanding_fees(now)
+
+    assert report["overdue_loans"] == 2
+    assert report["by_patron"] == {"111111": 1.5 + 6.5}
+    assert report["total_outstanding"] == 8.0
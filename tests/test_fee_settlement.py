@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+import database as db
+import library_service as svc
+from services import payment_service
+from services.payment_service import PaymentGateway, PaymentGatewayError
+from services.job_service import JobWorker
+from benchmarks.payment_stub import PaymentStubServer
+
+
+@pytest.fixture
+def stub():
+    """A stub gateway serving as the shared payment client."""
+    server = PaymentStubServer().start()
+    payment_service.configure_payment_gateway(server.url)
+    yield server
+    payment_service.configure_payment_gateway(None)
+    server.stop()
+
+
+@pytest.fixture
+def overdue(add_book, borrow_helper, set_due_date):
+    """Patron 123456 with three open loans: 3 and 10 days overdue and one not yet due."""
+    books = [add_book(f"Fee Book {i}", "Author", f"555000000000{i}", 1) for i in range(3)]
+    for book in books:
+        borrow_helper("123456", book["id"])
+    set_due_date("123456", books[0]["id"], datetime.now() - timedelta(days=3, hours=1))
+    set_due_date("123456", books[1]["id"], datetime.now() - timedelta(days=10, hours=1))
+    return books
+
+
+def test_fees_due_lists_each_overdue_loan(overdue):
+    due = svc.get_patron_fees_due("123456")
+    assert [item["book_id"] for item in due["items"]] == [overdue[0]["id"], overdue[1]["id"]]
+    assert [item["amount"] for item in due["items"]] == [1.5, 6.5]
+    assert due["total"] == 8.0
+    assert svc.get_patron_fees_due("654321")["items"] == []
+
+
+def test_one_charge_with_line_items(stub, overdue):
+    result = svc.pay_all_late_fees("123456")
+    assert result["status"] == "paid" and result["amount"] == 8.0
+    charge = stub.charges[result["transaction_id"]]
+    assert stub.counters["requests"] == 1
+    assert charge["amount"] == 8.0 and charge["description"] == "Late fees for 2 books"
+    assert [line["amount"] for line in charge["line_items"]] == [1.5, 6.5]
+
+    settlement = db.get_fee_settlement(result["settlement_id"])
+    assert settlement["status"] == "paid" and settlement["transaction_id"] == result["transaction_id"]
+    assert len(settlement["items"]) == 2
+
+
+def test_settled_fees_are_not_charged_again(stub, overdue):
+    assert svc.pay_all_late_fees("123456")["status"] == "paid"
+    assert svc.pay_all_late_fees("123456")["status"] == "nothing_due"
+    ok, msg, txn = svc.pay_late_fees("123456", overdue[0]["id"])
+    assert not ok and msg == "No late fees to pay for this book."
+    assert stub.counters["requests"] == 1
+
+
+def test_per_book_payment_is_counted_by_the_batch(stub, overdue):
+    ok, _, _ = svc.pay_late_fees("123456", overdue[1]["id"])
+    assert ok
+    result = svc.pay_all_late_fees("123456")
+    assert result["amount"] == 1.5
+    assert [item["book_id"] for item in result["items"]] == [overdue[0]["id"]]
+
+
+def test_fees_accrued_after_settling_are_still_due(stub, overdue, set_due_date):
+    svc.pay_all_late_fees("123456")
+    set_due_date("123456", overdue[0]["id"], datetime.now() - timedelta(days=5, hours=1))
+    due = svc.get_patron_fees_due("123456")
+    assert [(item["fee"], item["settled"], item["amount"]) for item in due["items"]] == [(2.5, 1.5, 1.0)]
+
+
+def test_declined_or_failed_charges_leave_fees_payable(overdue):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (False, "", "Card declined")
+    result = svc.pay_all_late_fees("123456", gateway)
+    assert result["status"] == "declined" and result["message"] == "Payment failed: Card declined"
+    assert db.get_fee_settlement(result["settlement_id"])["status"] == "failed"
+
+    gateway.process_payment.side_effect = PaymentGatewayError("Payment gateway busy", retryable=False, sent=False)
+    result = svc.pay_all_late_fees("123456", gateway)
+    assert result["status"] == "error" and "busy" in result["message"]
+    assert svc.get_patron_fees_due("123456")["total"] == 8.0
+
+
+def test_fees_stay_held_while_a_charge_outcome_is_unknown(overdue):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = PaymentGatewayError("Payment gateway timed out")
+    result = svc.pay_all_late_fees("123456", gateway)
+    assert result["status"] == "error" and "timed out" in result["message"]
+    assert db.get_payment(result["idempotency_key"])["status"] == "unknown"
+    assert svc.get_patron_fees_due("123456")["total"] == 0
+
+    # the next request sends the same charge again (same key) before anything else
+    gateway.process_payment.side_effect = None
+    gateway.process_payment.return_value = (True, "txn_123456_1", "ok")
+    retry = svc.pay_all_late_fees("123456", gateway)
+    assert retry["status"] == "paid" and retry["settlement_id"] == result["settlement_id"]
+    keys = {call.kwargs["idempotency_key"] for call in gateway.process_payment.call_args_list}
+    assert len(keys) == 1
+    assert db.get_fee_settlement(result["settlement_id"])["status"] == "paid"
+
+
+def test_fees_are_held_while_a_charge_is_in_flight(overdue):
+    inner = {}
+
+    def charge(**kwargs):
+        inner["result"] = svc.pay_all_late_fees("123456", gateway)
+        return True, "txn_123456_1", "ok"
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = charge
+    assert svc.pay_all_late_fees("123456", gateway)["status"] == "paid"
+    assert inner["result"]["status"] == "nothing_due"
+    assert gateway.process_payment.call_count == 1
+
+
+def test_invalid_patron():
+    result = svc.pay_all_late_fees("12")
+    assert result["status"] == "error" and result["settlement_id"] is None
+
+
+def test_fees_api(client, stub, overdue):
+    assert client.get("/api/patron/123456/fees").get_json()["total"] == 8.0
+    assert client.get("/api/patron/12/fees").status_code == 400
+
+    response = client.post("/api/patron/123456/fees/pay")
+    assert response.status_code == 202
+    job = response.get_json()["job"]
+    assert job["kind"] == "pay_all_late_fees" and job["status"] == "queued"
+
+    assert JobWorker().run_once()
+    result = client.get(response.get_json()["status_url"]).get_json()["result"]
+    assert result["status"] == "paid" and result["amount"] == 8.0
+    assert client.get("/api/patron/123456/fees").get_json()["total"] == 0
+    assert client.post("/api/patron/12/fees/pay").status_code == 400
@@ -0,0 +1,86 @@
+import pytest
+import database as db
+import library_service as svc
+
+
+@pytest.fixture
+def catalog(add_book):
+    add_book("The Great Gatsby", "F. Scott Fitzgerald", "1000000000001", 1)
+    add_book("Great Expectations", "Charles Dickens", "1000000000002", 1)
+    add_book("Gatsby Revisited", "Great Scholar", "1000000000003", 1)
+    add_book("100% Pure_Data", "Ann Analyst", "1000000000004", 1)
+    add_book("Les Misérables", "Victor Hugo", "1000000000005", 1)
+
+
+def _titles(books):
+    return [b["title"] for b in books]
+
+
+def test_token_mode_requires_every_word(catalog):
+    res = svc.search_books_in_catalog("gatsby great", "title", mode="token")
+    assert _titles(res) == ["The Great Gatsby"]
+
+
+def test_prefix_mode_matches_word_starts(catalog):
+    res = svc.search_books_in_catalog("expect", "title", mode="prefix")
+    assert _titles(res) == ["Great Expectations"]
+
+
+def test_phrase_mode_respects_word_order(catalog):
+    assert _titles(svc.search_books_in_catalog("great gatsby", "title", mode="phrase")) == ["The Great Gatsby"]
+    assert svc.search_books_in_catalog("gatsby great", "title", mode="phrase") == []
+
+
+def test_bm25_ranks_title_matches_above_author_matches(catalog):
+    res = db.search_books_fulltext("great", mode="token")
+    # "Gatsby Revisited" only matches through its author
+    assert _titles(res)[-1] == "Gatsby Revisited"
+    assert set(_titles(res)) == {"The Great Gatsby", "Great Expectations", "Gatsby Revisited"}
+
+
+def test_fts_operators_in_user_text_are_literal(catalog):
+    assert svc.search_books_in_catalog('great AND "NEAR(', "title", mode="token") == []
+    assert svc.search_books_in_catalog("*", "title", mode="prefix") == []
+
+
+def test_fts_index_follows_title_updates(catalog):
+    book = db.get_book_by_isbn("1000000000002")
+    conn = db.get_db_connection()
+    conn.execute("UPDATE books SET title = 'Bleak House' WHERE id = ?", (book["id"],))
+    conn.commit()
+    conn.close()
+    assert svc.search_books_in_catalog("expectations", "title", mode="token") == []
+    assert _titles(svc.search_books_in_catalog("bleak", "title", mode="token")) == ["Bleak House"]
+
+
+def test_diacritics_are_folded(catalog):
+    assert _titles(svc.search_books_in_catalog("miserables", "title", mode="token")) == ["Les Misérables"]
+
+
+def test_substring_mode_keeps_infix_matching(catalog):
+    assert _titles(svc.search_books_in_catalog("tsby", "title")) == ["Gatsby Revisited", "The Great Gatsby"]
+
+
+def test_substring_mode_treats_like_wildcards_literally(catalog):
+    assert _titles(svc.search_books_in_catalog("0% pure_", "title")) == ["100% Pure_Data"]
+    assert svc.search_books_in_catalog("_", "author") == []
+
+
+def test_substring_mode_non_ascii_is_case_insensitive(catalog):
+    assert _titles(svc.search_books_in_catalog("MISÉR", "title")) == ["Les Misérables"]
+
+
+def test_unknown_mode_returns_empty(catalog):
+    assert svc.search_books_in_catalog("great", "title", mode="regex") == []
+
+
+def test_isbn_search_is_an_index_lookup(catalog):
+    statements = []
+    with db.db_session() as conn:
+        conn.set_trace_callback(statements.append)
+        res = svc.search_books_in_catalog("1000000000003", "isbn")
+        conn.set_trace_callback(None)
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + statements[-1]).fetchall()]
+    assert _titles(res) == ["Gatsby Revisited"]
+    assert "books" in statements[-1]
+    assert plan == ["SEARCH books USING INDEX sqlite_autoindex_books_1 (isbn=?)"]
@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+import database as db
+import routes.api_routes as api_routes
+import routes.catalog_routes as catalog_routes
+
+
+def _raw(sql, params=()):
+    conn = sqlite3.connect(db.DATABASE)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def book(add_book):
+    return add_book("Dune", "Frank Herbert", "5000000000001", 2)
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError("a 304 must not compute the response")
+
+
+def test_unchanged_catalog_answers_304_without_querying(client, book, monkeypatch):
+    first = client.get("/api/books")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag.startswith('W/"')
+    monkeypatch.setattr(api_routes, "get_catalog_page", _fail)
+    monkeypatch.setattr(api_routes, "search_books_page", _fail)
+    again = client.get("/api/books", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b"" and again.headers["ETag"] == etag
+    assert client.get("/api/search?q=dune", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_catalog_page_skips_rendering(client, book, monkeypatch):
+    etag = client.get("/catalog").headers["ETag"]
+    monkeypatch.setattr(catalog_routes, "get_catalog_page", _fail)
+    monkeypatch.setattr(catalog_routes, "render_template", _fail)
+    response = client.get("/catalog", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["Cache-Control"] == "no-cache"
+
+
+def test_writes_change_the_etag(client, book, add_book, borrow_helper):
+    etag = client.get("/api/search?q=dune").headers["ETag"]
+    borrow_helper("123456", book.id)
+    response = client.get("/api/search?q=dune", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.get_json()["results"][0]["available_copies"] == 1
+    etag = response.headers["ETag"]
+    add_book("Dune Messiah", "Frank Herbert", "5000000000002", 1)
+    assert client.get("/api/search?q=dune", headers={"If-None-Match": etag}).get_json()["total"] == 2
+    # suggestions only depend on the catalog, not on availability
+    etag = client.get("/api/suggest?q=du").headers["ETag"]
+    borrow_helper("123456", book.id + 1)
+    assert client.get("/api/suggest?q=du", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_last_modified(client, book):
+    _raw("UPDATE change_counters SET changed_at = 1700000000.5")
+    response = client.get("/api/books")
+    assert response.headers["Last-Modified"] == "Tue, 14 Nov 2023 22:13:20 GMT"
+    since = {"If-Modified-Since": response.headers["Last-Modified"]}
+    assert client.get("/api/books", headers=since).status_code == 304
+    _raw("UPDATE books SET title = 'Dune (Deluxe)'")
+    assert client.get("/api/books", headers=since).status_code == 200
+    # If-None-Match wins over If-Modified-Since
+    assert client.get("/api/books", headers=dict(since, **{"If-None-Match": '"other"'})).status_code == 200
+
+
+def test_changes_stamp_their_counter(book, borrow_helper):
+    _raw("UPDATE change_counters SET changed_at = 0")
+    borrow_helper("123456", book.id)
+    _, (availability, catalog), changed_at = db.get_change_stamps(["availability", "catalog"])
+    assert availability == 1 and catalog >= 1 and changed_at > 1700000000
+
+
+def test_cache_control_per_endpoint(app, client, book):
+    assert client.get("/api/suggest?q=du").headers["Cache-Control"] == "public, max-age=60"
+    assert client.get("/api/patron/123456/status").headers["Cache-Control"] == "no-store"
+    assert client.get("/api/stats").headers["Cache-Control"] == "no-store"
+    assert "ETag" not in client.get("/api/books?limit=x").headers
+    app.config["CACHE_CONTROL"] = {"api.list_books_api": "public, max-age=30"}
+    assert client.get("/api/books").headers["Cache-Control"] == "public, max-age=30"
+
+
+def test_recreated_database_gets_new_etags(client, book):
+    etag = client.get("/api/books").headers["ETag"]
+    _raw("UPDATE database_id SET token = 'another'")  # as a fresh database would have
+    response = client.get("/api/books", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"].startswith('W/"another-catalog')
+
+
+def test_pending_flash_messages_are_not_cached(client, book):
+    etag = client.get("/catalog").headers["ETag"]
+    client.post("/borrow", data={"patron_id": "bad", "book_id": book.id})
+    response = client.get("/catalog", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and "ETag" not in response.headers
+    assert response.headers["Cache-Control"] == "private, no-store"
+    assert client.get("/catalog", headers={"If-None-Match": etag}).status_code == 304
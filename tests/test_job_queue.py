@@ -0,0 +1,208 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+from services import job_service, payment_service
+from services.job_service import JobWorker, RetryJob, enqueue_late_fee_payment, job_handler, wait_for_job
+from benchmarks.payment_stub import PaymentStubServer
+
+
+@pytest.fixture
+def stub():
+    server = PaymentStubServer().start()
+    payment_service.configure_payment_gateway(server.url)
+    yield server
+    payment_service.configure_payment_gateway(None)
+    server.stop()
+
+
+@pytest.fixture
+def late_book(add_book, borrow_helper, set_due_date):
+    """Patron 123456 has one book 3 days overdue ($1.50)."""
+    book = add_book("Queued Book", "Author", "5550000000001", 1)
+    borrow_helper("123456", book["id"])
+    set_due_date("123456", book["id"], datetime.now() - timedelta(days=3, hours=1))
+    return book
+
+
+@pytest.fixture
+def flaky(monkeypatch):
+    """A 'flaky' job kind that asks for a retry until its payload says otherwise, with no backoff."""
+    monkeypatch.setattr(job_service, "_retry_delay", lambda attempt: 0)
+    calls = []
+
+    @job_handler("flaky")
+    def run(payload):
+        calls.append(payload)
+        if not payload.get("ok"):
+            raise RetryJob("not yet", payload | {"tries": payload.get("tries", 0) + 1})
+        return {"done": True}
+
+    yield calls
+    job_service.JOB_HANDLERS.pop("flaky")
+
+
+def test_enqueue_dedupes_by_idempotency_key():
+    job, created = enqueue_late_fee_payment("123456", idempotency_key="k1")
+    again, created_again = enqueue_late_fee_payment("123456", idempotency_key="k1")
+    assert created and not created_again and again["id"] == job["id"]
+    assert job["status"] == "queued" and job["payload"]["idempotency_key"] == "k1"
+
+    other, _ = enqueue_late_fee_payment("123456", 7)
+    assert other["kind"] == "pay_late_fees" and other["payload"]["idempotency_key"].startswith("job-")
+
+
+def test_worker_runs_a_payment(stub, late_book):
+    job, _ = enqueue_late_fee_payment("123456", late_book["id"])
+    worker = JobWorker()
+    assert worker.run_once() and not worker.run_once()
+    done = db.get_job(job["id"])
+    assert done["status"] == "succeeded" and done["attempts"] == 1
+    assert done["result"]["success"] and done["result"]["transaction_id"] in stub.charges
+    assert db.get_payment(job["payload"]["idempotency_key"])["status"] == "succeeded"
+
+
+def test_unreached_gateway_retries_under_a_new_key(stub, late_book, monkeypatch):
+    monkeypatch.setattr(job_service, "_retry_delay", lambda attempt: 0)
+    payment_service.configure_payment_gateway("http://127.0.0.1:9")  # nothing listens there
+    job, _ = enqueue_late_fee_payment("123456")
+    first_key = job["payload"]["idempotency_key"]
+    worker = JobWorker()
+    assert worker.run_once()
+    retried = db.get_job(job["id"])
+    assert retried["status"] == "queued" and "unreachable" in retried["error"]
+    assert retried["payload"]["idempotency_key"] != first_key
+    assert db.get_payment(first_key)["status"] == "error"
+
+    payment_service.configure_payment_gateway(stub.url)
+    assert worker.run_once()
+    done = db.get_job(job["id"])
+    assert done["status"] == "succeeded" and done["result"]["status"] == "paid"
+    assert len(stub.charges) == 1
+
+
+def test_retries_end_in_the_dead_letter_table(flaky):
+    job, _ = db.enqueue_job("flaky", {"n": 1}, max_attempts=3)
+    worker = JobWorker()
+    while worker.run_once():
+        pass
+    assert len(flaky) == 3 and flaky[-1]["tries"] == 2
+    dead = db.get_job(job["id"])
+    assert dead["status"] == "dead" and dead["error"] == "not yet"
+    letters = db.get_dead_letters()
+    assert [(d["job_id"], d["attempts"], d["payload"]["tries"]) for d in letters] == [(job["id"], 3, 3)]
+
+    assert db.requeue_dead_job(job["id"]) and not db.requeue_dead_job(job["id"])
+    assert db.get_dead_letters() == [] and db.get_job(job["id"])["status"] == "queued"
+
+
+def test_retry_waits_for_backoff(monkeypatch):
+    monkeypatch.setattr(job_service, "_retry_delay", lambda attempt: 60)
+    job, _ = db.enqueue_job("no-such-kind", {})
+    worker = JobWorker()
+    assert worker.run_once() and not worker.run_once()
+    failed = db.get_job(job["id"])
+    assert failed["status"] == "queued" and failed["error"].startswith("LookupError")
+    assert failed["visible_at"] > time.time() + 50
+
+
+def test_visibility_timeout_hands_the_job_to_another_worker(flaky):
+    job, _ = db.enqueue_job("flaky", {"ok": True}, max_attempts=2)
+    assert db.claim_job("crashed-worker", visibility=-1)["id"] == job["id"]
+    assert JobWorker().run_once()
+    assert db.get_job(job["id"])["status"] == "succeeded"
+    # the first worker's late result is ignored
+    assert not db.complete_job(job["id"], "crashed-worker", {"late": True})
+    assert db.fail_job(job["id"], "crashed-worker", "late", 0) is None
+
+    dying, _ = db.enqueue_job("flaky", {"ok": True}, max_attempts=1)
+    db.claim_job("crashed-worker", visibility=-1)
+    assert db.claim_job("other-worker") is None
+    assert db.get_job(dying["id"])["status"] == "dead"
+
+
+def test_wait_for_job_returns_when_the_job_finishes(flaky):
+    job, _ = db.enqueue_job("flaky", {"ok": True})
+    assert wait_for_job(job["id"], 0)["status"] == "queued"
+    assert wait_for_job(10_000, 0) is None
+
+    worker = JobWorker(threads=1, poll_interval=5).start()
+    try:
+        start = time.monotonic()
+        assert wait_for_job(job["id"], 5)["status"] == "succeeded"
+        assert time.monotonic() - start < 2
+    finally:
+        worker.stop(timeout=5)
+    assert not any(thread.is_alive() for thread in worker._threads)
+
+
+def test_pay_api_queues_and_reports_the_job(client, stub, late_book):
+    response = client.post(f"/api/patron/123456/fees/pay/{late_book['id']}")
+    assert response.status_code == 202
+    body = response.get_json()
+    assert response.headers["Location"] == body["status_url"] == f"/api/jobs/{body['job']['id']}"
+    assert client.get(body["status_url"]).get_json()["status"] == "queued"
+
+    JobWorker().run_once()
+    job = client.get(body["status_url"] + "?wait=1").get_json()
+    assert job["status"] == "succeeded" and job["result"]["success"]
+    assert client.get("/api/stats").get_json()["jobs"]["by_status"] == {"succeeded": 1}
+    assert client.get("/api/jobs/999").status_code == 404
+    assert client.get(body["status_url"] + "?wait=x").status_code == 400
+    assert client.get(body["status_url"] + "?wait=nan").status_code == 400
+
+
+def test_refund_api(client, stub, late_book):
+    job, _ = enqueue_late_fee_payment("123456")
+    JobWorker().run_once()
+    txn = db.get_job(job["id"])["result"]["transaction_id"]
+    assert client.post(f"/api/payments/{txn}/refund", json={"amount": 0}).status_code == 400
+    assert client.post("/api/payments/bad/refund", json={"amount": 1.0}).status_code == 400
+
+    response = client.post(f"/api/payments/{txn}/refund", json={"amount": 1.0})
+    assert response.status_code == 202
+    JobWorker().run_once()
+    result = client.get(response.get_json()["status_url"]).get_json()["result"]
+    assert result["success"] and "Refund of $1.00" in result["message"]
+
+
+def test_cli_dead_and_requeue(app, flaky):
+    job, _ = db.enqueue_job("flaky", {}, max_attempts=1)
+    JobWorker().run_once()
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["jobs", "dead"])
+    assert result.exit_code == 0 and f"job {job['id']} flaky" in result.output
+    result = runner.invoke(args=["jobs", "requeue", str(job["id"])])
+    assert result.exit_code == 0 and db.get_job(job["id"])["status"] == "queued"
+    assert runner.invoke(args=["jobs", "requeue", str(job["id"])]).exit_code != 0
+
+
+def test_concurrent_workers_run_each_job_once(flaky):
+    jobs = [db.enqueue_job("flaky", {"ok": True, "n": i})[0]["id"] for i in range(20)]
+    workers = [JobWorker(threads=2, poll_interval=0.01).start() for _ in range(2)]
+    try:
+        deadline = time.monotonic() + 10
+        while db.get_job_stats()["by_status"] != {"succeeded": 20} and time.monotonic() < deadline:
+            threading.Event().wait(0.02)
+    finally:
+        for worker in workers:
+            worker.stop(timeout=5)
+    assert sorted(payload["n"] for payload in flaky) == list(range(20))
+    assert all(db.get_job(job_id)["attempts"] == 1 for job_id in jobs)
+
+
+def test_cli_commands_start_no_job_workers():
+    from flask.cli import FlaskGroup
+    from app import create_app
+    apps = []
+
+    def factory():
+        apps.append(create_app({"DATABASE": db.DATABASE, "SAMPLE_DATA": False}))
+        return apps[-1]
+
+    before = {t for t in threading.enumerate() if t.name.startswith("job-worker-")}
+    result = FlaskGroup(create_app=factory).main(["jobs", "dead"], standalone_mode=False)
+    assert result is None and apps and "job_worker" not in apps[0].extensions
+    assert {t for t in threading.enumerate() if t.name.startswith("job-worker-")} <= before
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+
+
+def _epochs(loan_id):
+    conn = db.get_db_connection()
+    row = conn.execute("SELECT borrow_date, due_date, return_date, borrow_ts, due_ts, return_ts "
+                       "FROM borrow_records WHERE id = ?", (loan_id,)).fetchone()
+    conn.close()
+    return dict(row)
+
+
+def _assert_epochs_match(row):
+    for column in ("borrow", "due", "return"):
+        text = row[f"{column}_date"]
+        expected = db._epoch_seconds(datetime.fromisoformat(text)) if text else None
+        assert row[f"{column}_ts"] == expected
+
+
+def _last_loan_id():
+    conn = db.get_db_connection()
+    loan_id = conn.execute("SELECT MAX(id) FROM borrow_records").fetchone()[0]
+    conn.close()
+    return loan_id
+
+
+@pytest.fixture
+def pre_epoch_db(tmp_path, monkeypatch):
+    """A database at schema version 6 holding loans written before the epoch columns existed."""
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "pre_epoch.db"))
+    db.migrate(target=6)
+    db.insert_book("Old Loans", "Author", "4440000000001", 50, 50)
+    now = datetime.now()
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date) "
+            "VALUES (?, 1, ?, ?, ?)",
+            [("123456", (now - timedelta(days=i)).isoformat(), (now - timedelta(days=i - 14)).isoformat(),
+              (now - timedelta(days=i - 3)).isoformat() if i % 3 == 0 else None) for i in range(1, 26)])
+    db.migrate()
+    yield now
+    db.close_all_connections()
+
+
+def test_fresh_database_needs_no_backfill():
+    status = db.get_loan_epoch_status()
+    assert status["ready"] and status["end_id"] == 0
+
+
+def test_triggers_keep_epochs_current(seed_books, set_due_date):
+    book_id = seed_books[0]["id"]
+    ok, _ = svc.borrow_book_by_patron("123456", book_id)
+    assert ok
+    loan_id = _last_loan_id()
+    _assert_epochs_match(_epochs(loan_id))
+
+    set_due_date("123456", book_id, datetime(2020, 2, 29, 23, 59, 59, 999999))
+    row = _epochs(loan_id)
+    assert row["due_ts"] == db._epoch_seconds(datetime(2020, 2, 29, 23, 59, 59))
+    _assert_epochs_match(row)
+
+    ok, _ = svc.return_book_by_patron("123456", book_id)
+    assert ok
+    _assert_epochs_match(_epochs(loan_id))
+
+
+def test_epoch_trigger_does_not_bump_loans_twice(seed_books):
+    before = db.get_change_versions()["loans"]
+    db.insert_borrow_record("123456", seed_books[0]["id"], datetime.now(), datetime.now())
+    assert db.get_change_versions()["loans"] == before + 1
+
+
+def test_backfill_resumes_in_batches(pre_epoch_db):
+    status = db.get_loan_epoch_status()
+    assert not status["ready"] and status["end_id"] == 25
+
+    report = db.backfill_loan_epochs(batch_size=10, max_batches=1)
+    assert report["updated"] == 10 and not report["ready"] and report["next_id"] == 11
+    # a loan written mid-backfill gets its epochs from the trigger
+    db.insert_borrow_record("654321", 1, pre_epoch_db, pre_epoch_db + timedelta(days=14))
+
+    report = db.backfill_loan_epochs(batch_size=10)
+    assert report["updated"] == 15 and report["unparsed"] == 0 and report["ready"]
+    for loan_id in range(1, 27):
+        _assert_epochs_match(_epochs(loan_id))
+    assert db.backfill_loan_epochs()["updated"] == 0
+
+
+def test_overdue_scan_is_the_same_before_and_after_backfill(pre_epoch_db):
+    as_of = pre_epoch_db + timedelta(days=3)
+    before = sorted(loan["id"] for loan in db.iter_overdue_loans(as_of))
+    fees_before = svc.calculate_outstanding_fees(as_of)
+    db.backfill_loan_epochs()
+    assert sorted(loan["id"] for loan in db.iter_overdue_loans(as_of)) == before
+    assert svc.calculate_outstanding_fees(as_of) == fees_before
+    assert before  # the fixture has loans due before as_of
+
+
+def test_overdue_scan_settles_the_boundary_second(seed_books):
+    book_id = seed_books[0]["id"]
+    due = datetime(2024, 3, 1, 12, 0, 0, 500000)
+    db.insert_borrow_record("123456", book_id, due - timedelta(days=14), due)
+    assert list(db.iter_overdue_loans(datetime(2024, 3, 1, 12, 0, 0, 499999))) == []
+    assert [loan["due_date"] for loan in db.iter_overdue_loans(due)] == [due.isoformat()]
+
+
+def test_overdue_scan_is_an_index_range(seed_books):
+    statements = []
+    with db.db_session() as conn:
+        conn.set_trace_callback(statements.append)
+        list(db.iter_overdue_loans(datetime.now()))
+        conn.set_trace_callback(None)
+        sql = next(s for s in statements if "borrow_records" in s)
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    assert plan == ["SEARCH borrow_records USING INDEX idx_borrow_records_open_due (due_ts<?)"]
+
+
+def test_stats_report_backfill(client):
+    assert client.get("/api/stats").get_json()["loan_epochs"]["ready"] is True
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+
+
+def _index_names():
+    conn = db.get_db_connection()
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    conn.close()
+    return {r["name"] for r in rows}
+
+
+def test_fresh_database_is_at_latest_version():
+    assert db.get_schema_version() == db.MIGRATIONS[-1][0]
+    assert {"idx_borrow_records_open_patron",
+            "idx_borrow_records_patron_book_date",
+            "idx_borrow_records_patron_date"} <= _index_names()
+
+
+def test_migrate_is_idempotent():
+    version = db.get_schema_version()
+    assert db.migrate() == version
+    conn = db.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0]
+    conn.close()
+    assert count == len(db.MIGRATIONS)
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path, monkeypatch):
+    # a database created by the old bare CREATE TABLE IF NOT EXISTS code
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "legacy.db"))
+    conn = db.get_db_connection()
+    db._migration_initial_schema(conn)
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('Old', 'Author', '1231231231231', 1, 1)")
+    conn.commit()
+    conn.close()
+
+    assert db.get_schema_version() == 0
+    db.init_database()
+    assert db.get_schema_version() == db.MIGRATIONS[-1][0]
+    assert db.get_book_by_isbn("1231231231231")["title"] == "Old"
+    db.close_all_connections()
+
+
+def test_migrate_to_target_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "partial.db"))
+    assert db.migrate(target=1) == 1
+    assert "idx_borrow_records_open_patron" not in _index_names()
+    # loan queries do not depend on the later indexes existing
+    assert db.get_patron_borrow_count("123456") == 0 and db.get_patron_borrowed_books("123456") == []
+    assert db.migrate() == db.MIGRATIONS[-1][0]
+    db.close_all_connections()
+
+
+def test_analyze_lets_open_loan_lookups_pick_the_partial_index(app, seed_books):
+    book_id = seed_books[0]["id"]
+    now = datetime.now()
+    for patron_id in ("123456", "234567", "345678", "456789"):
+        for days in range(10, 0, -1):
+            db.insert_borrow_record(patron_id, book_id, now - timedelta(days=days), now)
+            db.update_borrow_record_return_date(patron_id, book_id, now)
+        db.insert_borrow_record(patron_id, book_id, now, now + timedelta(days=14))
+    idle = db.get_db_connection()  # opened before the statistics exist
+
+    result = app.test_cli_runner().invoke(args=["analyze"])
+    assert result.exit_code == 0
+    idle.close()  # retired instead of going back to the pool
+    conn = db.get_db_connection()
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT COUNT(*) FROM borrow_records "
+                        "WHERE patron_id = ? AND return_date IS NULL", ("123456",)).fetchall()
+    conn.close()
+    assert [row[3] for row in plan] == ["SEARCH borrow_records USING INDEX idx_borrow_records_open_patron (patron_id=?)"]
+
+
+def _query_plans(fn, *args):
+    """Run fn inside one session and EXPLAIN every statement it issued against borrow_records."""
+    statements = []
+    with db.db_session() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            fn(*args)
+        finally:
+            conn.set_trace_callback(None)
+        plans = {}
+        for sql in statements:
+            if "borrow_records" in sql and sql.lstrip().upper().startswith(("SELECT", "UPDATE")):
+                rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+                plans[sql] = [r[3] for r in rows]
+    return plans
+
+
+@pytest.mark.parametrize("call", [
+    lambda book_id: db.get_patron_borrow_count("123456"),
+    lambda book_id: db.get_patron_borrowed_books("123456"),
+    lambda book_id: db.update_borrow_record_return_date("123456", book_id, datetime.now()),
+    lambda book_id: svc.borrow_book_by_patron("123456", book_id),
+    lambda book_id: svc.return_book_by_patron("123456", book_id),
+    lambda book_id: svc.calculate_late_fee_for_book("123456", book_id),
+    lambda book_id: svc.get_patron_status_report("123456"),
+    lambda book_id: svc.calculate_outstanding_fees(),
+])
+def test_hot_loan_queries_use_indexes(seed_books, call):
+    book_id = seed_books[0]["id"]
+    now = datetime.now()
+    db.insert_borrow_record("123456", book_id, now - timedelta(days=30), now - timedelta(days=16))
+    db.update_borrow_record_return_date("123456", book_id, now - timedelta(days=20))
+    db.insert_borrow_record("123456", book_id, now, now + timedelta(days=14))
+
+    plans = _query_plans(call, book_id)
+
+    assert plans, "expected at least one borrow_records query"
+    for sql, plan in plans.items():
+        assert not any(step.startswith("SCAN br") or step.startswith("SCAN borrow_records")
+                       for step in plan), f"full scan in {sql!r}: {plan}"
+        assert any("INDEX idx_borrow_records_" in step or "INTEGER PRIMARY KEY" in step
+                   for step in plan), f"no loan index in {sql!r}: {plan}"
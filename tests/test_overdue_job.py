@@ -0,0 +1,153 @@
+import threading
+from datetime import datetime, time, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+from services import overdue_service
+from services.overdue_service import OverdueScheduler, get_overdue_report, run_overdue_job
+
+AS_OF = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def loans(add_book):
+    """Seven overdue open loans, one due later, one returned; returns the overdue loan ids."""
+    book = add_book("Overdue Book", "Author", "8880000000001", 20)
+    for i in range(7):
+        due = AS_OF - timedelta(days=2 * i + 1, minutes=i)
+        db.insert_borrow_record(f"{200000 + i % 3}", book["id"], due - timedelta(days=14), due)
+    db.insert_borrow_record("200009", book["id"], AS_OF, AS_OF + timedelta(days=14))
+    db.insert_borrow_record("200009", book["id"], AS_OF - timedelta(days=40), AS_OF - timedelta(days=26))
+    db.update_borrow_record_return_date("200009", book["id"], AS_OF - timedelta(days=1))
+    conn = db.get_db_connection()
+    overdue = [row[0] for row in conn.execute("SELECT id FROM borrow_records WHERE id <= 7")]
+    conn.close()
+    return overdue
+
+
+def _snapshot(run_id):
+    conn = db.get_db_connection()
+    rows = conn.execute("SELECT loan_id, days_overdue, fee FROM overdue_snapshot WHERE run_id = ? "
+                        "ORDER BY loan_id", (run_id,)).fetchall()
+    conn.close()
+    return [tuple(row) for row in rows]
+
+
+def test_run_snapshots_every_overdue_loan(loans):
+    report = run_overdue_job(AS_OF, chunk_size=3)
+    assert report["status"] == "finished"
+    assert report["loans"] == 7 and report["chunks"] == 3
+    snapshot = _snapshot(report["run_id"])
+    assert [row[0] for row in snapshot] == loans
+    expected = svc.calculate_outstanding_fees(AS_OF)
+    assert report["total_fees"] == expected["total_outstanding"]
+    assert (1, 1, 0.5) in snapshot  # due a day (and a minute) before as_of
+
+
+def test_interrupted_run_resumes_from_checkpoint(loans):
+    partial = run_overdue_job(AS_OF, chunk_size=2, max_chunks=2)
+    assert partial["status"] == "running" and partial["loans"] == 4
+
+    # a later call picks the same run up, keeping its as_of
+    report = run_overdue_job(AS_OF + timedelta(days=5), chunk_size=2)
+    assert report["run_id"] == partial["run_id"]
+    assert report["resumed"] and report["status"] == "finished"
+    assert report["loans"] == 7 and report["chunks"] == 2
+    assert report["as_of"] == AS_OF.isoformat()
+
+    fresh = run_overdue_job(AS_OF, chunk_size=100, resume=False)
+    assert _snapshot(fresh["run_id"]) == _snapshot(report["run_id"])
+
+
+def test_live_lease_blocks_other_workers(loans, monkeypatch):
+    run, claimed = db.claim_overdue_run(AS_OF, "crashed-worker")
+    assert claimed
+    assert run_overdue_job(AS_OF)["status"] == "busy"
+
+    monkeypatch.setattr(db, "OVERDUE_LEASE_SECONDS", -1)  # the crashed worker's lease has lapsed
+    db.claim_overdue_run(AS_OF, "crashed-worker")
+    report = run_overdue_job(AS_OF)
+    assert report["run_id"] == run["id"] and report["status"] == "finished"
+    # the old owner can no longer write to it
+    assert not db.save_overdue_chunk(run["id"], "crashed-worker", [], (0, 0), 0.0, 0.0)
+
+
+def test_scheduled_date_runs_once(loans):
+    first = run_overdue_job(AS_OF, scheduled_for="2024-06-01")
+    again = run_overdue_job(AS_OF, scheduled_for="2024-06-01")
+    assert again["run_id"] == first["run_id"]
+    assert again["status"] == "finished" and again["chunks"] == 0
+
+
+def test_run_accrues_patron_fees(loans):
+    run_overdue_job(AS_OF)
+    summary = db.get_patron_summary("200000")
+    assert summary["fees_as_of"] == AS_OF.isoformat()
+    assert summary["outstanding_fees"] == svc.calculate_outstanding_fees(AS_OF)["by_patron"]["200000"]
+
+
+def test_old_runs_are_pruned(loans, monkeypatch):
+    monkeypatch.setattr(db, "OVERDUE_KEEP_RUNS", 2)
+    runs = [run_overdue_job(AS_OF, resume=False, accrue=False)["run_id"] for _ in range(3)]
+    assert db.get_overdue_run(runs[0]) is None and _snapshot(runs[0]) == []
+    assert db.get_overdue_run(runs[2])["status"] == "finished"
+
+
+def test_overdue_report_pages(loans):
+    run_overdue_job(AS_OF)
+    page = get_overdue_report(limit=4)
+    assert page["run"]["loans"] == 7 and len(page["loans"]) == 4
+    rest = get_overdue_report(cursor=page["next_cursor"], limit=4)
+    assert [loan["loan_id"] for loan in page["loans"] + rest["loans"]] == loans
+    assert rest["next_cursor"] is None
+    assert page["loans"][0]["title"] == "Overdue Book"
+
+
+def test_overdue_api(client, loans):
+    assert client.get("/api/overdue").status_code == 404
+    run_overdue_job(AS_OF)
+    body = client.get("/api/overdue?limit=5").get_json()
+    assert body["run"]["loans"] == 7 and len(body["loans"]) == 5
+    assert client.get("/api/overdue?limit=x").status_code == 400
+    assert client.get("/api/overdue?run_id=abc").status_code == 400
+    assert client.get("/api/overdue?cursor=x").status_code == 400
+
+
+def test_cli_run_and_report(app, loans):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["overdue", "run", "--as-of", AS_OF.isoformat(), "--chunk-size", "2"])
+    assert result.exit_code == 0, result.output
+    assert "7 overdue loans" in result.output and "loans/s" in result.output
+    result = runner.invoke(args=["overdue", "report", "--limit", "2"])
+    assert result.exit_code == 0, result.output
+    assert result.output.count("  loan ") == 2
+
+
+def test_scheduler_runs_at_the_configured_time(loans):
+    scheduler = OverdueScheduler(time(2, 30))
+    assert scheduler.next_run(datetime(2024, 6, 1, 1, 0)) == datetime(2024, 6, 1, 2, 30)
+    assert scheduler.next_run(datetime(2024, 6, 1, 2, 30)) == datetime(2024, 6, 2, 2, 30)
+
+    report = scheduler.run_once(AS_OF)
+    assert report["status"] == "finished" and report["loans"] == 7
+    assert db.get_overdue_run(report["run_id"])["scheduled_for"] == "2024-06-01"
+
+
+def test_scheduler_thread_fires(monkeypatch):
+    calls, fired = [], threading.Event()
+
+    def fake_job(when, **kwargs):
+        calls.append(kwargs)
+        fired.set()
+        return {"status": "finished"}
+
+    monkeypatch.setattr(overdue_service, "run_overdue_job", fake_job)
+    scheduler = OverdueScheduler(time(0, 0))
+    scheduler.next_run = lambda now: now  # due immediately, every time
+    scheduler.start()
+    try:
+        assert fired.wait(5)
+    finally:
+        scheduler.stop(timeout=5)
+    assert calls[0]["scheduled_for"]
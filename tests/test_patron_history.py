@@ -0,0 +1,123 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+from services import export_service
+
+PATRON = "123456"
+BASE = datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def history(seed_books):
+    """25 closed loans one day apart (two share a borrow date) plus one open loan."""
+    conn = db.get_db_connection()
+    rows = []
+    for i in range(25):
+        borrowed = BASE + timedelta(days=min(i, 23))
+        returned = borrowed + timedelta(days=20 if i % 5 == 0 else 3)
+        rows.append((PATRON, seed_books[i % 3]["id"], borrowed.isoformat(),
+                     (borrowed + timedelta(days=14)).isoformat(), returned.isoformat()))
+    rows.append(("654321", seed_books[0]["id"], BASE.isoformat(), BASE.isoformat(), None))
+    conn.executemany(
+        "INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def _all_pages(**kwargs):
+    items, cursor = [], None
+    while True:
+        page = svc.get_patron_history(PATRON, cursor=cursor, **kwargs)
+        assert page["status"] == "ok"
+        items.extend(page["history"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def test_pages_cover_history_newest_first_once(history):
+    items = _all_pages(limit=4)
+    assert len(items) == 25
+    keys = [item["borrow_date"] for item in items]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_history_items_carry_fees(history):
+    items = _all_pages(limit=100)
+    late = [item for item in items if item["days_overdue"]]
+    assert len(late) == 5
+    assert all(item["days_overdue"] == 6 and item["late_fee"] == 3.00 for item in late)
+
+
+def test_date_range_filter(history):
+    items = _all_pages(limit=3, start="2024-01-05", end="2024-01-10")
+    assert [item["borrow_date"][:10] for item in items] == [
+        "2024-01-09", "2024-01-08", "2024-01-07", "2024-01-06", "2024-01-05",
+    ]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"cursor": "nope"},
+    {"cursor": db.encode_cursor([1, 2])},
+    {"limit": 0},
+    {"limit": svc.MAX_PAGE_SIZE + 1},
+    {"start": "last tuesday"},
+])
+def test_invalid_arguments_rejected(kwargs):
+    assert svc.get_patron_history(PATRON, **kwargs)["status"] == "error"
+
+
+def test_status_report_includes_only_first_page(history):
+    report = svc.get_patron_status_report(PATRON, history_limit=10)
+    assert len(report["history"]) == 10
+    assert report["history_next_cursor"] is not None
+    rest = svc.get_patron_history(PATRON, cursor=report["history_next_cursor"], limit=100)
+    assert len(report["history"]) + len(rest["history"]) == 25
+
+
+def test_streaming_export_matches_pages(history, monkeypatch):
+    monkeypatch.setattr(export_service, "CHUNK_ROWS", 7)
+    chunks = list(export_service.export_patron_history(PATRON))
+    assert len(chunks) == 2 + 4  # header, 25 rows in chunks of 7, footer
+    document = json.loads("".join(chunks))
+    assert document["patron_id"] == PATRON
+    assert document["history"] == _all_pages(limit=100)
+
+
+def test_streaming_export_of_empty_history():
+    document = json.loads("".join(export_service.export_patron_history("999999")))
+    assert document["history"] == []
+
+
+def test_streaming_export_validates_eagerly():
+    with pytest.raises(ValueError):
+        export_service.export_patron_history("12")
+    with pytest.raises(ValueError):
+        export_service.export_patron_history(PATRON, start="soon")
+
+
+def test_history_api(client, history):
+    first = client.get(f"/api/patron/{PATRON}/history?limit=20").get_json()
+    assert first["count"] == 20
+    second = client.get(f"/api/patron/{PATRON}/history?limit=20&cursor={first['next_cursor']}").get_json()
+    assert second["count"] == 5
+    assert second["next_cursor"] is None
+    assert client.get(f"/api/patron/{PATRON}/history?limit=x").status_code == 400
+    assert client.get("/api/patron/12/history").status_code == 400
+
+
+def test_status_and_export_api(client, history):
+    status = client.get(f"/api/patron/{PATRON}/status").get_json()
+    assert status["summary"]["total_loans"] == 25
+    assert len(status["history"]) == svc.HISTORY_PAGE_SIZE
+
+    response = client.get(f"/api/patron/{PATRON}/history/export?start=2024-01-20")
+    assert response.mimetype == "application/json"
+    assert len(response.get_json()["history"]) == 6
+    assert client.get("/api/patron/12/history/export").status_code == 400
@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+
+PATRON = "123456"
+
+
+@pytest.fixture
+def books(add_book):
+    return [add_book(f"Summary Book {i}", "Author", f"{5000000000000 + i}", 2) for i in range(4)]
+
+
+def _raw(sql, params=()):
+    conn = db.get_db_connection()
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_borrow_and_return_maintain_counts(books, borrow_helper):
+    borrow_helper(PATRON, books[0]["id"])
+    borrow_helper(PATRON, books[1]["id"])
+    summary = db.get_patron_summary(PATRON)
+    assert summary["active_count"] == 2
+    assert summary["total_loans"] == 2
+    assert summary["outstanding_fees"] == 0
+    assert summary["fees_as_of"] is not None
+
+    ok, _ = svc.return_book_by_patron(PATRON, books[0]["id"])
+    assert ok
+    summary = db.get_patron_summary(PATRON)
+    assert summary["active_count"] == 1
+    assert summary["total_loans"] == 2
+    assert summary["last_activity"] >= summary["fees_as_of"][:10]
+
+
+def test_return_refreshes_outstanding_fees(books, borrow_helper, set_due_date):
+    for book in books[:2]:
+        borrow_helper(PATRON, book["id"])
+        set_due_date(PATRON, book["id"], datetime.now() - timedelta(days=10))
+
+    svc.roll_forward_patron_fees()
+    assert db.get_patron_summary(PATRON)["outstanding_fees"] == 13.00  # 2 x (3.50 + 3.00)
+
+    svc.return_book_by_patron(PATRON, books[0]["id"])
+    assert db.get_patron_summary(PATRON)["outstanding_fees"] == 6.50
+
+
+def test_failed_borrow_leaves_summary_untouched(books, borrow_helper):
+    borrow_helper(PATRON, books[0]["id"])
+    before = db.get_patron_summary(PATRON)
+    ok, _ = svc.borrow_book_by_patron(PATRON, 9999)
+    assert not ok
+    assert db.get_patron_summary(PATRON) == before
+
+
+def test_roll_forward_accrues_and_resets(books, borrow_helper, set_due_date):
+    borrow_helper(PATRON, books[0]["id"])
+    borrow_helper("654321", books[1]["id"])
+    due = datetime.now() - timedelta(days=1)
+    set_due_date(PATRON, books[0]["id"], due)
+
+    report = svc.roll_forward_patron_fees(due + timedelta(days=3))
+    assert report["patrons_with_fees"] == 1
+    assert db.get_patron_summary(PATRON)["outstanding_fees"] == 1.50
+    assert db.get_patron_summary("654321")["outstanding_fees"] == 0
+
+    svc.roll_forward_patron_fees(due + timedelta(days=30))
+    assert db.get_patron_summary(PATRON)["outstanding_fees"] == 15.00
+
+
+def test_summary_matches_fee_calculation(books, borrow_helper, set_due_date):
+    for i, book in enumerate(books[:3]):
+        borrow_helper(PATRON, book["id"])
+        set_due_date(PATRON, book["id"], datetime.now() - timedelta(days=3 * i))
+    svc.roll_forward_patron_fees()
+
+    report = svc.get_patron_status_report(PATRON)
+    assert report["summary"]["outstanding_fees"] == report["total_late_fees"]
+    assert report["summary"]["active_count"] == report["current_borrow_count"]
+
+
+def test_status_report_without_loans_has_empty_summary():
+    summary = svc.get_patron_status_report(PATRON)["summary"]
+    assert summary["total_loans"] == 0
+    assert summary["last_activity"] is None
+
+
+def test_raw_writes_keep_counts_exact(books):
+    now = datetime.now()
+    db.insert_borrow_record(PATRON, books[0]["id"], now, now + timedelta(days=14))
+    db.update_borrow_record_return_date(PATRON, books[0]["id"], now + timedelta(hours=1))
+    db.insert_borrow_record(PATRON, books[1]["id"], now, now + timedelta(days=14))
+    _raw("DELETE FROM borrow_records WHERE book_id = ?", (books[0]["id"],))
+
+    summary = db.get_patron_summary(PATRON)
+    assert (summary["active_count"], summary["total_loans"]) == (1, 1)
+    assert summary["last_activity"] == now.isoformat()
+
+    _raw("DELETE FROM borrow_records")
+    assert db.get_patron_summary(PATRON) is None
+
+
+def test_checker_detects_and_repairs_drift(books, borrow_helper, set_due_date):
+    borrow_helper(PATRON, books[0]["id"])
+    borrow_helper("654321", books[1]["id"])
+    assert svc.check_patron_summary()["status"] == "ok"
+
+    _raw("UPDATE patron_summary SET active_count = 7 WHERE patron_id = ?", (PATRON,))
+    _raw("DELETE FROM patron_summary WHERE patron_id = '654321'")
+    # Due date moved without a roll-forward: stored fees are now stale
+    set_due_date(PATRON, books[0]["id"], datetime.now() - timedelta(days=5))
+
+    report = svc.check_patron_summary()
+    assert report["status"] == "mismatch"
+    assert {(m["patron_id"], m["field"]) for m in report["mismatches"]} == {
+        (PATRON, "active_count"), (PATRON, "outstanding_fees"), ("654321", "row"),
+    }
+
+    assert svc.check_patron_summary(repair=True)["status"] == "repaired"
+    assert svc.check_patron_summary()["status"] == "ok"
+    assert db.get_patron_summary(PATRON)["outstanding_fees"] == 2.50
+
+
+def test_migration_backfills_existing_loans(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "pre_summary.db"))
+    db.migrate(target=4)
+    conn = db.get_db_connection()
+    conn.executemany(
+        "INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date) VALUES (?, 1, ?, ?, ?)",
+        [(PATRON, "2024-01-01T10:00:00", "2024-01-15T10:00:00", "2024-01-20T09:00:00"),
+         (PATRON, "2024-02-01T10:00:00", "2024-02-15T10:00:00", None)],
+    )
+    conn.commit()
+    conn.close()
+
+    db.migrate()
+    summary = db.get_patron_summary(PATRON)
+    assert (summary["active_count"], summary["total_loans"]) == (1, 2)
+    assert summary["last_activity"] == "2024-02-01T10:00:00"
+    assert summary["fees_as_of"] is None
+    db.close_all_connections()
+
+
+def test_summary_cli(app, books, borrow_helper):
+    borrow_helper(PATRON, books[0]["id"])
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["patron-summary", "roll-forward"])
+    assert result.exit_code == 0
+    assert "owed by 0 patrons" in result.output
+
+    _raw("UPDATE patron_summary SET total_loans = 3")
+    result = runner.invoke(args=["patron-summary", "check"])
+    assert result.exit_code == 1
+    result = runner.invoke(args=["patron-summary", "check", "--repair"])
+    assert result.exit_code == 0
+    assert "repaired" in result.output
@@ -0,0 +1,149 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+import library_service as svc
+from services import payment_service
+from services.payment_service import HTTPPaymentGateway, PaymentGateway, PaymentGatewayError
+from benchmarks.payment_stub import PaymentStubServer
+
+
+@pytest.fixture
+def stub():
+    server = PaymentStubServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def gateway(stub):
+    client = HTTPPaymentGateway(stub.url, max_concurrency=4, timeout=(1.0, 2.0))
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def shared_gateway():
+    """Restore the simulated process-wide gateway after the test."""
+    yield payment_service.configure_payment_gateway
+    payment_service.configure_payment_gateway(None)
+
+
+def test_charge_refund_and_status(gateway):
+    ok, txn, msg = gateway.process_payment("123456", 10.5, "Late fees")
+    assert ok and txn.startswith("txn_123456_")
+    assert msg == "Payment of $10.50 processed successfully"
+    assert gateway.verify_payment_status(txn)["status"] == "completed"
+
+    ok, msg = gateway.refund_payment(txn, 5.0)
+    assert ok and "Refund of $5.00 processed successfully" in msg
+
+
+@pytest.mark.parametrize("patron_id, amount, message", [
+    ("123456", 0, "Invalid amount: must be greater than 0"),
+    ("123456", 2000.0, "Payment declined: amount exceeds limit"),
+    ("12", 10.0, "Invalid patron ID format"),
+])
+def test_declines_come_back_like_the_simulated_gateway(gateway, patron_id, amount, message):
+    assert gateway.process_payment(patron_id, amount) == (False, "", message)
+
+
+def test_refund_and_status_errors(gateway):
+    assert gateway.refund_payment("bad_txn", 5.0) == (False, "Invalid transaction ID")
+    assert gateway.verify_payment_status("txn_unknown")["status"] == "not_found"
+
+
+def test_connections_are_reused(stub, gateway):
+    for _ in range(20):
+        assert gateway.process_payment("123456", 1.0)[0]
+    assert stub.counters["requests"] == 20
+    assert stub.counters["connections"] == 1
+
+
+def test_concurrency_is_capped(stub):
+    in_flight, peak, lock = [0], [0], threading.Lock()
+    respond = stub.respond
+
+    def tracking(*args):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            threading.Event().wait(0.02)
+            return respond(*args)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    stub.respond = tracking
+    client = HTTPPaymentGateway(stub.url, max_concurrency=3)
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        results = list(pool.map(lambda _: client.process_payment("123456", 1.0), range(24)))
+    client.close()
+    assert all(ok for ok, _, _ in results)
+    assert peak[0] == 3
+    assert stub.counters["connections"] <= 3
+
+
+def test_busy_gateway_fails_fast(stub):
+    stub.latency = 0.3
+    client = HTTPPaymentGateway(stub.url, max_concurrency=1, acquire_timeout=0.05)
+    worker = threading.Thread(target=client.process_payment, args=("123456", 1.0))
+    worker.start()
+    threading.Event().wait(0.05)
+    with pytest.raises(PaymentGatewayError, match="busy"):
+        client.process_payment("123456", 1.0)
+    worker.join()
+    client.close()
+
+
+def test_timeouts_and_failures_raise(stub):
+    stub.latency = 0.5
+    client = HTTPPaymentGateway(stub.url, timeout=(1.0, 0.1))
+    with pytest.raises(PaymentGatewayError, match="timed out"):
+        client.process_payment("123456", 1.0)
+    client.close()
+
+    stub.latency = 0
+    stub.fail_status = 503
+    client = HTTPPaymentGateway(stub.url)
+    with pytest.raises(PaymentGatewayError, match="HTTP 503"):
+        client.process_payment("123456", 1.0)
+    client.close()
+
+    unreachable = HTTPPaymentGateway("http://127.0.0.1:9", timeout=(0.5, 0.5))
+    with pytest.raises(PaymentGatewayError, match="unreachable"):
+        unreachable.verify_payment_status("txn_1")
+
+
+def test_pay_late_fees_uses_the_shared_client(stub, shared_gateway, add_book, borrow_helper, set_due_date):
+    shared_gateway(stub.url)
+    book = add_book("Late Paid", "Author", "6660000000001", 1)
+    borrow_helper("123456", book["id"])
+    set_due_date("123456", book["id"], datetime.now() - timedelta(days=3))
+
+    assert isinstance(payment_service.get_payment_gateway(), HTTPPaymentGateway)
+    ok, msg, txn = svc.pay_late_fees("123456", book["id"])
+    assert ok and txn in stub.charges
+    assert stub.charges[txn]["amount"] == 1.5
+    ok, msg = svc.refund_late_fee_payment(txn, 1.5)
+    assert ok
+
+
+def test_gateway_errors_surface_as_failed_payments(stub, shared_gateway, add_book, borrow_helper, set_due_date):
+    shared_gateway(stub.url)
+    stub.fail_status = 502
+    book = add_book("Late Failed", "Author", "6660000000002", 1)
+    borrow_helper("123456", book["id"])
+    set_due_date("123456", book["id"], datetime.now() - timedelta(days=3))
+    ok, msg, txn = svc.pay_late_fees("123456", book["id"])
+    assert not ok and txn is None
+    assert msg.startswith("Payment processing error") and "HTTP 502" in msg
+
+
+def test_simulated_gateway_without_url(shared_gateway):
+    shared_gateway(None)
+    gateway = payment_service.get_payment_gateway()
+    assert type(gateway) is PaymentGateway
+    assert payment_service.get_payment_gateway() is gateway
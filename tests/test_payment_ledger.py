@@ -0,0 +1,244 @@
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+import database as db
+import library_service as svc
+from services import payment_service
+from services.job_service import JobWorker
+from services.payment_service import CircuitBreaker, HTTPPaymentGateway, PaymentGateway, PaymentGatewayError
+from benchmarks.payment_stub import PaymentStubServer
+
+
+@pytest.fixture
+def stub():
+    server = PaymentStubServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def late_book(add_book, borrow_helper, set_due_date):
+    """Patron 123456 has one book 3 days overdue ($1.50)."""
+    book = add_book("Ledger Book", "Author", "4440000000001", 1)
+    borrow_helper("123456", book["id"])
+    set_due_date("123456", book["id"], datetime.now() - timedelta(days=3, hours=1))
+    return book
+
+
+def _mock_gateway():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_123456_1", "Payment of $1.50 processed successfully")
+    gateway.refund_payment.return_value = (True, "Refunded")
+    return gateway
+
+
+def test_duplicate_submission_returns_the_stored_result(late_book):
+    gateway = _mock_gateway()
+    first = svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    again = svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    assert first == again == (True, "Payment successful! Payment of $1.50 processed successfully", "txn_123456_1")
+    assert gateway.process_payment.call_count == 1
+    assert gateway.process_payment.call_args.kwargs["idempotency_key"] == "req-1"
+
+    payment = db.get_payment("req-1")
+    assert payment["status"] == "succeeded" and payment["amount"] == 1.5 and payment["attempts"] == 1
+
+
+def test_duplicate_batch_submission(late_book):
+    gateway = _mock_gateway()
+    first = svc.pay_all_late_fees("123456", gateway, idempotency_key="batch-1")
+    again = svc.pay_all_late_fees("123456", gateway, idempotency_key="batch-1")
+    assert again == first and first["status"] == "paid"
+    assert again["items"][0]["title"] == "Ledger Book"
+    assert gateway.process_payment.call_count == 1
+
+
+def test_key_reused_for_another_request_is_refused(late_book):
+    gateway = _mock_gateway()
+    svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    ok, msg, txn = svc.pay_late_fees("654321", late_book["id"], gateway, idempotency_key="req-1")
+    assert not ok and "already used for a different request" in msg
+    ok, msg = svc.refund_late_fee_payment("txn_123456_1", 1.0, gateway, idempotency_key="req-1")
+    assert not ok and "already used for a different request" in msg
+    assert gateway.process_payment.call_count == 1
+
+
+def test_request_in_flight_is_not_sent_twice(late_book, monkeypatch):
+    db.record_payment("req-1", "charge", 1.5, {"description": "x"}, patron_id="123456")
+    gateway = _mock_gateway()
+    ok, msg, _ = svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    assert not ok and msg == "This payment is already being processed."
+    gateway.process_payment.assert_not_called()
+
+    # a worker that died mid-charge: once the entry is stale it is sent again
+    monkeypatch.setattr(db, "PAYMENT_PROCESSING_SECONDS", -1)
+    ok, _, txn = svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    assert ok and txn == "txn_123456_1"
+    assert db.get_payment("req-1")["attempts"] == 2
+
+
+def test_lost_response_is_recovered_without_charging_twice(stub, late_book):
+    respond, calls = stub.respond, []
+
+    def slow_first_response(*args):
+        result = respond(*args)  # the charge goes through...
+        calls.append(args)
+        if len(calls) == 1:
+            threading.Event().wait(0.3)  # ...but the answer arrives too late
+        return result
+
+    stub.respond = slow_first_response
+    gateway = HTTPPaymentGateway(stub.url, timeout=(1.0, 0.1), retries=0)
+    ok, msg, _ = svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    assert not ok and "timed out" in msg
+    assert db.get_payment("req-1")["status"] == "unknown"
+
+    ok, _, txn = svc.pay_late_fees("123456", late_book["id"], gateway, idempotency_key="req-1")
+    assert ok and list(stub.charges) == [txn]
+    gateway.close()
+
+
+def test_transient_failures_are_retried_with_the_same_key(stub):
+    stub.fail_status, stub.fail_count = 503, 2
+    gateway = HTTPPaymentGateway(stub.url, backoff=0.01)
+    ok, txn, _ = gateway.process_payment("123456", 2.0, idempotency_key="k")
+    assert ok and stub.counters["requests"] == 3 and list(stub.charges) == [txn]
+
+    stub.fail_status, stub.fail_count = 503, 3
+    with pytest.raises(PaymentGatewayError, match="HTTP 503") as error:
+        gateway.process_payment("123456", 2.0)
+    assert error.value.retryable and error.value.sent
+    gateway.close()
+
+
+def test_backoff_is_jittered_and_capped(stub, monkeypatch):
+    pauses = []
+    monkeypatch.setattr(payment_service.time, "sleep", pauses.append)
+    stub.fail_status = 503
+    gateway = HTTPPaymentGateway(stub.url, retries=4, backoff=0.5)
+    with pytest.raises(PaymentGatewayError):
+        gateway.verify_payment_status("txn_1")
+    gateway.close()
+    assert len(pauses) == 4
+    assert all(0 <= pause <= min(payment_service.PAYMENT_RETRY_BACKOFF_MAX, 0.5 * 2 ** i)
+               for i, pause in enumerate(pauses))
+    assert len(set(pauses)) > 1
+
+
+def test_circuit_breaker_opens_and_recovers():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=0.5, window=4, min_calls=4, cooldown=10, clock=lambda: now[0])
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok)
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] = 11
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow()  # one trial call at a time
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    now[0] = 22
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.stats()["rejected"] == 2
+
+
+def test_unexpected_errors_still_end_the_half_open_trial(monkeypatch):
+    now = [0.0]
+    breaker = CircuitBreaker(min_calls=1, window=1, cooldown=10, clock=lambda: now[0])
+    breaker.allow()
+    breaker.record(False)
+    now[0] = 11
+    gateway = HTTPPaymentGateway("http://gateway.invalid", retries=0, breaker=breaker)
+    for error in (payment_service.requests.TooManyRedirects("loop"), TypeError("bad kwargs")):
+        monkeypatch.setattr(gateway.session, "request", Mock(side_effect=error))
+        with pytest.raises((PaymentGatewayError, TypeError)):
+            gateway.verify_payment_status("txn_1")
+        assert breaker.state == "open"
+        now[0] += 11
+    gateway.close()
+
+
+def test_simulated_gateway_remembers_a_bounded_number_of_keys(monkeypatch):
+    monkeypatch.setattr(payment_service, "IDEMPOTENCY_CACHE_SIZE", 2)
+    monkeypatch.setattr(payment_service.time, "sleep", lambda seconds: None)
+    gateway = PaymentGateway()
+    first = gateway.process_payment("123456", 1.0, idempotency_key="k1")
+    with monkeypatch.context() as m:
+        m.setattr(payment_service.time, "time", lambda: 0)
+        assert gateway.process_payment("123456", 1.0, idempotency_key="k1") == first
+    for key in ("k2", "k3"):
+        gateway.refund_payment(first[1], 1.0, idempotency_key=key)
+    assert len(gateway._idempotent) == 2 and gateway._idempotent.get("k1") is None
+    assert gateway._key_locks == {}
+
+
+def test_open_circuit_fails_fast_and_releases_the_fees(stub, late_book):
+    stub.fail_status = 502
+    gateway = HTTPPaymentGateway(stub.url, retries=0, breaker=CircuitBreaker(min_calls=2, window=2))
+    for _ in range(2):
+        with pytest.raises(PaymentGatewayError):
+            gateway.verify_payment_status("txn_1")
+    requests_before = stub.counters["requests"]
+
+    result = svc.pay_all_late_fees("123456", gateway)
+    assert result["status"] == "error" and "too many recent failures" in result["message"]
+    assert stub.counters["requests"] == requests_before
+    assert db.get_payment(result["idempotency_key"])["status"] == "error"
+    assert svc.get_patron_fees_due("123456")["total"] == 1.5
+    gateway.close()
+
+
+def test_refunds_are_checked_against_the_ledger(late_book):
+    gateway = _mock_gateway()
+    ok, _, txn = svc.pay_late_fees("123456", late_book["id"], gateway)
+    assert svc.refund_late_fee_payment(txn, 1.0, gateway, idempotency_key="refund-1") == (True, "Refunded")
+    assert svc.refund_late_fee_payment(txn, 1.0, gateway, idempotency_key="refund-1") == (True, "Refunded")
+    assert gateway.refund_payment.call_count == 1
+
+    ok, msg = svc.refund_late_fee_payment(txn, 1.0, gateway)
+    assert not ok and "exceeds the $0.50 left to refund" in msg
+
+    # a failed refund does not use up the refundable amount
+    gateway.refund_payment.return_value = (False, "Refund window closed")
+    assert svc.refund_late_fee_payment(txn, 0.5, gateway) == (False, "Refund failed: Refund window closed")
+    gateway.refund_payment.return_value = (True, "Refunded")
+    assert svc.refund_late_fee_payment(txn, 0.5, gateway)[0]
+
+
+def test_charges_in_the_same_second_are_refunded_separately(late_book, add_book, borrow_helper, set_due_date,
+                                                            monkeypatch):
+    other = add_book("Second Ledger Book", "Author", "4440000000002", 1)
+    borrow_helper("123456", other["id"])
+    set_due_date("123456", other["id"], datetime.now() - timedelta(days=3, hours=1))
+    monkeypatch.setattr(payment_service.time, "sleep", lambda seconds: None)
+    gateway = PaymentGateway()
+    with monkeypatch.context() as m:
+        m.setattr(payment_service.time, "time", lambda: 1700000000.0)
+        first = svc.pay_late_fees("123456", late_book["id"], gateway)[2]
+        second = svc.pay_late_fees("123456", other["id"], gateway)[2]
+    assert first != second
+    assert svc.refund_late_fee_payment(first, 1.5, gateway)[0]
+    ok, msg = svc.refund_late_fee_payment(first, 0.5, gateway)
+    assert not ok and "exceeds the $0.00 left" in msg
+    assert db.get_charge(second)["refunded"] == 0 and svc.refund_late_fee_payment(second, 1.5, gateway)[0]
+
+
+def test_pay_api_honours_idempotency_key(client, stub, late_book):
+    payment_service.configure_payment_gateway(stub.url)
+    try:
+        first = client.post("/api/patron/123456/fees/pay", headers={"Idempotency-Key": "api-1"})
+        again = client.post("/api/patron/123456/fees/pay", headers={"Idempotency-Key": "api-1"})
+        assert (first.status_code, again.status_code) == (202, 200)
+        assert again.get_json()["job"]["id"] == first.get_json()["job"]["id"]
+        worker = JobWorker()
+        assert worker.run_once() and not worker.run_once()
+        assert len(stub.charges) == 1
+        assert db.get_payment("api-1")["status"] == "succeeded"
+        assert client.get("/api/stats").get_json()["payments"]["circuit"]["state"] == "closed"
+    finally:
+        payment_service.configure_payment_gateway(None)
@@ -1,7 +1,8 @@
 
 import pytest
-from unittest.mock import Mock
+from unittest.mock import ANY, Mock
 
+import database as db
 import services.library_service as fees
 from services.library_service import pay_late_fees, refund_late_fee_payment
 from services.payment_service import PaymentGateway 
@@ -30,7 +31,8 @@ def test_pay_late_fees_success(mocker):
     gateway.process_payment.assert_called_once_with(
         patron_id="123456",
         amount=5.0,
-        description="Late fees for 'Test Book'"
+        description="Late fees for 'Test Book'",
+        idempotency_key=ANY
     )
 
 
@@ -56,7 +58,8 @@ def test_pay_late_fees_payment_declined(mocker):
     gateway.process_payment.assert_called_once_with(
         patron_id="123456",
         amount=5.0,
-        description="Late fees for 'Test Book'"
+        description="Late fees for 'Test Book'",
+        idempotency_key=ANY
     )
 
 
@@ -124,13 +127,24 @@ def test_pay_late_fees_handles_gateway_exception(mocker):
     gateway.process_payment.assert_called_once_with(
         patron_id="123456",
         amount=5.0,
-        description="Late fees for 'Test Book'"
+        description="Late fees for 'Test Book'",
+        idempotency_key=ANY
     )
 
 
 # refund_late_fee_payment() TESTS
 
-def test_refund_late_fee_payment_success():
+@pytest.fixture
+def charged():
+    """Put a succeeded charge in the payments ledger, as pay_late_fees() would."""
+    def charge(transaction_id, amount=5.0):
+        payment, _ = db.record_payment(f"key_{transaction_id}", "charge", amount, patron_id="123456")
+        db.finish_payment(payment["id"], "succeeded", transaction_id, "Success")
+    return charge
+
+
+def test_refund_late_fee_payment_success(charged):
+    charged("txn_999")
     gateway = Mock(spec=PaymentGateway)
     gateway.refund_payment.return_value = (True, "Refunded")
 
@@ -138,7 +152,7 @@ def test_refund_late_fee_payment_success():
 
     assert success is True
     assert msg == "Refunded"
-    gateway.refund_payment.assert_called_once_with("txn_999", 5.0)
+    gateway.refund_payment.assert_called_once_with("txn_999", 5.0, idempotency_key=ANY)
 
 
 @pytest.mark.parametrize("bad_txn", ["", "abc", None, "tx_123"])
@@ -163,17 +177,35 @@ def test_refund_late_fee_payment_invalid_amount_nonpositive(bad_amount):
     gateway.refund_payment.assert_not_called()
 
 
-def test_refund_late_fee_payment_amount_exceeds_max():
+def test_refund_late_fee_payment_unknown_transaction():
     gateway = Mock(spec=PaymentGateway)
 
-    success, msg = refund_late_fee_payment("txn_123", 20.0, gateway)
+    success, msg = refund_late_fee_payment("txn_123", 5.0, gateway)
 
     assert success is False
-    assert "exceeds maximum late fee" in msg
+    assert msg == "Transaction not found."
     gateway.refund_payment.assert_not_called()
 
 
-def test_refund_late_fee_payment_gateway_failure():
+def test_refund_late_fee_payment_amount_exceeds_amount_paid(charged):
+    charged("txn_123", 20.0)
+    gateway = Mock(spec=PaymentGateway)
+    gateway.refund_payment.return_value = (True, "Refunded")
+
+    success, msg = refund_late_fee_payment("txn_123", 20.01, gateway)
+
+    assert success is False
+    assert "exceeds the $20.00 left to refund" in msg
+    gateway.refund_payment.assert_not_called()
+
+    assert refund_late_fee_payment("txn_123", 15.0, gateway)[0] is True
+    success, msg = refund_late_fee_payment("txn_123", 5.01, gateway)
+    assert success is False
+    assert "exceeds the $5.00 left to refund" in msg
+
+
+def test_refund_late_fee_payment_gateway_failure(charged):
+    charged("txn_123")
     gateway = Mock(spec=PaymentGateway)
     gateway.refund_payment.return_value = (False, "Gateway said no")
 
@@ -181,10 +213,11 @@ def test_refund_late_fee_payment_gateway_failure():
 
     assert success is False
     assert "Refund failed: Gateway said no" in msg
-    gateway.refund_payment.assert_called_once_with("txn_123", 5.0)
+    gateway.refund_payment.assert_called_once_with("txn_123", 5.0, idempotency_key=ANY)
 
 
-def test_refund_late_fee_payment_gateway_exception():
+def test_refund_late_fee_payment_gateway_exception(charged):
+    charged("txn_123")
     gateway = Mock(spec=PaymentGateway)
     gateway.refund_payment.side_effect = Exception("Network down")
 
@@ -192,4 +225,4 @@ def test_refund_late_fee_payment_gateway_exception():
 
     assert success is False
     assert "Refund processing error: Network down" in msg
-    gateway.refund_payment.assert_called_once_with("txn_123", 5.0)
+    gateway.refund_payment.assert_called_once_with("txn_123", 5.0, idempotency_key=ANY)
@@ -1,9 +1,10 @@
+from collections.abc import Mapping
 import library_service as svc
 
-def test_catalog_returns_list_of_dicts(seed_books):
+def test_catalog_returns_list_of_mappings(seed_books):
     books = svc.get_all_books()
     assert isinstance(books, list)
-    assert books and isinstance(books[0], dict)
+    assert books and isinstance(books[0], Mapping)
 
 def test_catalog_has_required_fields(seed_books):
     required = {"id", "title", "author", "isbn", "total_copies", "available_copies"}
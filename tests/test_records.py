@@ -0,0 +1,99 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import database as db
+import library_service as svc
+from records import Book, Loan, json_default
+from services.export_service import export_books
+
+
+def test_book_behaves_like_a_mapping(seed_books):
+    book = db.get_all_books()[0]
+    assert isinstance(book, Book)
+    assert book["title"] == book.title
+    assert dict(book) == {key: getattr(book, key) for key in book}
+    assert book.get("missing", "default") == "default"
+    with pytest.raises(KeyError):
+        book["missing"]
+
+
+def test_book_records_have_no_instance_dict(seed_books):
+    book = db.get_all_books()[0]
+    assert not hasattr(book, "__dict__")
+    with pytest.raises(AttributeError):
+        book.extra = 1
+
+
+def test_book_lookups_return_records(seed_books):
+    book = seed_books[0]
+    assert isinstance(db.get_book_by_id(book["id"]), Book)
+    assert db.get_book_by_isbn(book["isbn"]) == book
+    assert all(isinstance(b, Book) for b in db.search_books_fulltext(book["title"].split()[0]))
+    assert all(isinstance(b, Book) for b in svc.search_books_in_catalog(book["title"], "title"))
+
+
+def test_borrow_and_return_helpers_return_records(seed_books):
+    book, now = seed_books[0], datetime.now()
+    status, borrowed = db.borrow_book_atomic("123456", book["id"], now, now + timedelta(days=14), max_borrowed=5)
+    assert status == "ok" and isinstance(borrowed, Book) and borrowed == book
+    status, loan = db.return_book_atomic("123456", book["id"], now + timedelta(days=1))
+    assert status == "ok" and isinstance(loan, Loan)
+    assert (loan.title, loan.due_date, loan.return_date) == (book["title"], now + timedelta(days=14),
+                                                             now + timedelta(days=1))
+    assert db.return_book_atomic("123456", book["id"], now) == ("no_record", None)
+
+
+def test_loan_dates_are_parsed_lazily(seed_books, borrow_helper):
+    borrow_helper("123456", seed_books[0]["id"])
+    loan = db.get_patron_borrowed_books("123456")[0]
+    assert isinstance(loan, Loan)
+    assert loan._due_date is None
+    assert isinstance(loan["due_date"], datetime)
+    assert loan.due_date.isoformat() == loan.due_date_iso
+    assert loan["is_overdue"] is False
+    assert loan.return_date is None
+
+
+def test_loan_is_overdue(seed_books, add_book):
+    book = add_book("Overdue Record", "Author", "5550000000001", 1)
+    due = datetime.now() - timedelta(days=3)
+    db.insert_borrow_record("123456", book["id"], due - timedelta(days=14), due)
+    loan = db.get_patron_borrowed_books("123456")[0]
+    assert loan.is_overdue
+
+
+def test_loans_are_read_only(seed_books, borrow_helper):
+    borrow_helper("123456", seed_books[0]["id"])
+    loan = db.get_patron_borrowed_books("123456")[0]
+    with pytest.raises(TypeError):
+        loan["title"] = "Changed"
+
+
+def test_records_serialize_to_json(seed_books, borrow_helper):
+    borrow_helper("123456", seed_books[0]["id"])
+    loan = db.get_patron_borrowed_books("123456")[0]
+    encoded = json.loads(json.dumps(loan, default=json_default))
+    assert encoded["due_date"] == loan.due_date_iso
+    assert encoded["book_id"] == seed_books[0]["id"]
+    assert json.loads(json.dumps(db.get_all_books(), default=json_default))[0]["title"]
+
+
+def test_api_and_export_encode_records(client, seed_books):
+    title = seed_books[0]["title"]
+    results = client.get("/api/search", query_string={"q": title}).get_json()["results"]
+    assert results[0]["title"] == title
+    rows = [json.loads(line) for line in "".join(export_books("ndjson")).splitlines()]
+    assert {row["id"] for row in rows} == {book["id"] for book in seed_books}
+
+
+def test_templates_render_records(client, seed_books):
+    response = client.get("/catalog")
+    assert response.status_code == 200
+    assert seed_books[0]["title"].encode() in response.data
+
+
+def test_status_report_uses_loan_records(seed_books, borrow_helper):
+    borrow_helper("123456", seed_books[0]["id"])
+    report = svc.get_patron_status_report("123456")
+    assert report["currently_borrowed"][0]["title"] == seed_books[0]["title"]
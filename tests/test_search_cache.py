@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+import database as db
+import library_service as svc
+from cache import LRUCache
+
+
+@pytest.fixture
+def catalog(add_book):
+    add_book("War and Peace", "Leo Tolstoy", "3000000000001", 2)
+    add_book("The War of the Worlds", "H. G. Wells", "3000000000002", 1)
+    add_book("Peace Talks", "Jim Butcher", "3000000000003", 1)
+
+
+@pytest.fixture
+def search_cache():
+    """A fresh search result cache, restored to the defaults afterwards."""
+    saved = (db.SEARCH_CACHE_BYTES, db.SEARCH_CACHE_SIZE)
+    db.configure_search_cache()
+    yield db.configure_search_cache
+    db.configure_search_cache(*saved)
+
+
+def _raw(sql, params=()):
+    conn = sqlite3.connect(db.DATABASE)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def _titles(page):
+    return [b["title"] for b in page["books"]]
+
+
+def test_lru_weight_budget():
+    cache = LRUCache(max_size=10, max_weight=10, weigh=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("c", "xxxx")  # 12 > 10: "a" goes
+    assert cache.get("a") is None and cache.get("b") == "xxxx"
+    assert not cache.put("d", "x" * 11)
+    cache.put("b", "x")
+    assert cache.stats()["weight"] == 5 and cache.stats()["evictions"] == 1
+
+
+def test_normalized_queries_share_an_entry(catalog, search_cache):
+    first = svc.search_books_page("war", "title")
+    assert _titles(svc.search_books_page("  WAR ", "title")) == _titles(first) == [
+        "War and Peace", "The War of the Worlds"]
+    svc.search_books_page("war  peace", "title", mode="token")
+    svc.search_books_page("War Peace", "title", mode="token")
+    stats = db.get_search_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 2, 2)
+    # different pages are different entries
+    svc.search_books_page("war", "title", limit=1)
+    assert db.get_search_cache_stats()["size"] == 3
+
+
+def test_cached_pages_show_current_availability(catalog, search_cache):
+    svc.search_books_page("war", "title")
+    _raw("UPDATE books SET available_copies = 0 WHERE isbn = '3000000000001'")
+    page = svc.search_books_page("war", "title")
+    assert db.get_search_cache_stats()["hits"] == 1
+    assert page["books"][0]["available_copies"] == 0
+    # and the cached copy itself is untouched
+    page["books"][0]["title"] = "Changed"
+    assert _titles(svc.search_books_page("war", "title"))[0] == "War and Peace"
+
+
+def test_catalog_writes_invalidate(catalog, add_book, search_cache):
+    assert svc.search_books_page("peace", "title")["total"] == 2
+    add_book("Peacemaker", "Author", "3000000000004", 1)
+    assert svc.search_books_page("peace", "title")["total"] == 3
+    _raw("UPDATE books SET title = 'Calm Talks' WHERE isbn = '3000000000003'")
+    assert _titles(svc.search_books_page("peace", "title")) == ["Peacemaker", "War and Peace"]
+    assert db.get_search_cache_stats()["hits"] == 0
+
+
+def test_memory_budget_evicts(catalog, search_cache):
+    search_cache(max_bytes=2000)
+    for term in ("war", "peace", "the", "talks", "worlds"):
+        svc.search_books_page(term, "title")
+    stats = db.get_search_cache_stats()
+    assert stats["weight"] <= 2000 and stats["evictions"] > 0
+
+
+def test_sessions_bypass_the_cache(catalog, search_cache):
+    with db.db_session() as conn:
+        conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                     "VALUES ('Uncommitted War', 'X', '3000000000009', 1, 1)")
+        assert svc.search_books_page("war", "title")["total"] == 3
+        conn.rollback()
+    assert svc.search_books_page("war", "title")["total"] == 2
+    assert db.get_search_cache_stats()["size"] == 1
+
+
+def test_stats_endpoint_reports_hit_ratio(client, catalog, search_cache):
+    for _ in range(4):
+        client.get("/api/search?q=war")
+    client.get("/search?q=war")
+    stats = client.get("/api/stats").get_json()["search_cache"]
+    assert stats["hit_ratio"] == 0.8 and stats["max_weight"] == db.SEARCH_CACHE_BYTES
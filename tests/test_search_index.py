@@ -0,0 +1,96 @@
+import random
+import sqlite3
+
+import pytest
+import database as db
+import library_service as svc
+from search_index import TrigramIndex
+
+WORDS = ["gatsby", "great", "the", "expectations", "misérables", "les", "war", "peace", "İstanbul", "ß", "a"]
+
+
+def _brute(docs, query):
+    return [doc_id for doc_id, text in docs if query.lower() in text.lower()]
+
+
+def test_index_matches_a_lowercase_scan():
+    rng = random.Random(7)
+    docs = [(i * 3, " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5)))) for i in range(400)]
+    index = TrigramIndex()
+    index.add_many(docs[:200])
+    for doc_id, text in docs[200:]:
+        index.add(doc_id, text)
+    queries = ["gatsb", "tsby", "GREAT EXP", "at", "a", "e g", "MISÉR", "istanbul", "i̇st", "xyz", "war war", "ß"]
+    for query in queries:
+        assert index.search(query) == _brute(docs, query), query
+    assert len(index) == 400 and index.stats()["documents"] == 400
+
+
+def test_short_and_missing_trigrams():
+    index = TrigramIndex()
+    index.add_many([(1, "Dune"), (2, "Emma")])
+    assert index.search("") == [1, 2]
+    assert index.search("m") == [2]
+    assert index.search("qqq") == []
+
+
+@pytest.fixture
+def catalog(add_book):
+    add_book("The Great Gatsby", "F. Scott Fitzgerald", "1000000000001", 1)
+    add_book("Great Expectations", "Charles Dickens", "1000000000002", 1)
+    add_book("Gatsby Revisited", "Great Scholar", "1000000000003", 1)
+
+
+def _raw(sql, params=()):
+    conn = sqlite3.connect(db.DATABASE)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def _titles(books):
+    return [b["title"] for b in books]
+
+
+def test_inserts_are_appended_to_the_index(catalog, add_book):
+    assert _titles(svc.search_books_in_catalog("great", "title")) == ["Great Expectations", "The Great Gatsby"]
+    index = db._search_indexes[(db.DATABASE, "title")]["index"]
+    add_book("A Greater Gatsby", "Author", "1000000000004", 1)
+    db.insert_books_bulk([("Greatness", "Author", "1000000000005", 1)])
+    assert _titles(svc.search_books_in_catalog("great", "title")) == [
+        "A Greater Gatsby", "Great Expectations", "Greatness", "The Great Gatsby"]
+    assert db._search_indexes[(db.DATABASE, "title")]["index"] is index and len(index) == 5
+
+
+def test_edits_and_deletes_by_other_processes_rebuild_it(catalog):
+    assert _titles(svc.search_books_in_catalog("gatsby", "title")) == ["Gatsby Revisited", "The Great Gatsby"]
+    _raw("UPDATE books SET title = 'Bleak House' WHERE title = 'Gatsby Revisited'")
+    assert _titles(svc.search_books_in_catalog("gatsby", "title")) == ["The Great Gatsby"]
+    _raw("DELETE FROM books WHERE title = 'The Great Gatsby'")
+    _raw("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+         "VALUES ('Gatsby Again', 'X', '1000000000009', 1, 1)")
+    assert _titles(svc.search_books_in_catalog("gatsby", "title")) == ["Gatsby Again"]
+    assert _titles(svc.search_books_in_catalog("great", "author")) == ["Bleak House"]
+
+
+def test_results_carry_current_availability(catalog):
+    svc.search_books_in_catalog("great", "title")
+    _raw("UPDATE books SET available_copies = 0 WHERE title = 'The Great Gatsby'")
+    book = svc.search_books_in_catalog("great gatsby", "title")[0]
+    assert book["available_copies"] == 0
+
+
+def test_sessions_scan_instead(catalog):
+    with db.db_session() as conn:
+        conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                     "VALUES ('Uncommitted Gatsby', 'X', '1000000000010', 1, 1)")
+        assert "Uncommitted Gatsby" in _titles(db.search_books_indexed("gatsby", "title"))
+        conn.rollback()
+    assert "Uncommitted Gatsby" not in _titles(db.search_books_indexed("gatsby", "title"))
+
+
+def test_index_stats(client, catalog):
+    svc.search_books_in_catalog("great", "author")
+    stats = client.get("/api/stats").get_json()["search_index"]
+    assert list(stats) == ["author"] and stats["author"]["documents"] == 3
+    assert stats["author"]["catalog_version"] == 3
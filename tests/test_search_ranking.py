@@ -0,0 +1,75 @@
+import pytest
+import library_service as svc
+from search_index import MATCH_EXACT, MATCH_INFIX, MATCH_PREFIX, MATCH_WORD, TrigramIndex, match_tier
+
+
+@pytest.mark.parametrize("text, tier", [
+    ("war", MATCH_EXACT),
+    ("war and peace", MATCH_PREFIX),
+    ("the war", MATCH_WORD),
+    ("anti-war songs", MATCH_WORD),
+    ("the inward war", MATCH_WORD),  # an infix occurrence before a word-boundary one
+    ("stoneware", MATCH_INFIX),
+])
+def test_match_tiers(text, tier):
+    assert match_tier(text, "war") == tier
+
+
+def test_rank_pages_through_every_match_once():
+    index = TrigramIndex()
+    index.add_many(enumerate(["Stoneware", "The War", "War", "War and Peace", "Dwarves", "Peace", "war"]))
+    keys, total = index.rank("WAR", 3)
+    assert total == 6
+    assert keys == [(MATCH_EXACT, "war", 2), (MATCH_EXACT, "war", 6), (MATCH_PREFIX, "war and peace", 3)]
+    rest, _ = index.rank("war", 10, after=keys[-1])
+    assert [key[2] for key in rest] == [1, 4, 0]
+
+
+@pytest.fixture
+def catalog(add_book):
+    for i, title in enumerate(["Stoneware", "The War", "War", "War and Peace", "Dwarves", "Peace"]):
+        add_book(title, "Leo Tolstoy" if "Peace" in title else "Someone", f"20000000000{i:02d}", 1)
+
+
+def test_search_page_ranks_and_paginates(catalog):
+    page = svc.search_books_page("war", "title", limit=2)
+    assert page["status"] == "ok" and page["total"] == 5
+    titles = [b["title"] for b in page["books"]]
+    while page["next_cursor"]:
+        page = svc.search_books_page("war", "title", limit=2, cursor=page["next_cursor"])
+        titles += [b["title"] for b in page["books"]]
+    assert titles == ["War", "War and Peace", "The War", "Dwarves", "Stoneware"]
+
+
+def test_search_page_validation(catalog):
+    assert svc.search_books_page("war", "title", limit=0)["status"] == "error"
+    assert svc.search_books_page("war", "title", cursor="garbage")["message"] == "Invalid cursor."
+    assert svc.search_books_page("war", "genre")["books"] == []
+    isbn = svc.search_books_page("2000000000002", "isbn")
+    assert [b["title"] for b in isbn["books"]] == ["War"] and isbn["total"] == 1
+
+
+def test_full_text_modes_page_by_offset(catalog):
+    first = svc.search_books_page("peace", "title", mode="token", limit=1)
+    assert first["total"] == 2 and len(first["books"]) == 1
+    second = svc.search_books_page("peace", "title", mode="token", limit=1, cursor=first["next_cursor"])
+    assert second["next_cursor"] is None
+    assert {first["books"][0]["title"], second["books"][0]["title"]} == {"Peace", "War and Peace"}
+    assert svc.search_books_page("peace", "title", mode="token", cursor=svc.encode_cursor(["x"]))["status"] == "error"
+
+
+def test_search_api_pages(client, catalog):
+    body = client.get("/api/search?q=war&limit=3").get_json()
+    assert (body["count"], body["total"], body["limit"]) == (3, 5, 3)
+    assert body["results"][0]["title"] == "War"
+    more = client.get("/api/search", query_string={"q": "war", "limit": 3, "cursor": body["next_cursor"]}).get_json()
+    assert [b["title"] for b in more["results"]] == ["Dwarves", "Stoneware"] and more["next_cursor"] is None
+    assert client.get("/api/search?q=war&limit=x").status_code == 400
+    assert client.get("/api/search?q=war&limit=500").status_code == 400
+    assert client.get("/api/search?q=war&cursor=bad").status_code == 400
+
+
+def test_search_page_links_to_more_results(client, catalog):
+    html = client.get("/search?q=war&limit=2").get_data(as_text=True)
+    assert "Showing 2 of 5 matches" in html and "More results" in html
+    assert "More results" not in client.get("/search?q=war").get_data(as_text=True)
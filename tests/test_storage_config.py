@@ -0,0 +1,63 @@
+import pytest
+import database as db
+from app import create_app
+
+
+def _pragma(name):
+    conn = db.get_db_connection()
+    value = conn.execute(f"PRAGMA {name}").fetchone()[0]
+    conn.close()
+    return value
+
+
+@pytest.fixture
+def restore_profile(monkeypatch):
+    monkeypatch.setattr(db, "STORAGE_PROFILE", db.STORAGE_PROFILE)
+    monkeypatch.setattr(db, "STORAGE_OVERRIDES", {})
+    yield
+    db.close_all_connections()
+
+
+def test_default_profile_uses_wal_and_full_sync(restore_profile):
+    db.configure_storage("safe")
+    assert _pragma("journal_mode") == "wal"
+    assert _pragma("synchronous") == 2  # FULL
+    assert _pragma("temp_store") == 2  # MEMORY
+
+
+def test_throughput_profile_relaxes_sync(restore_profile):
+    db.configure_storage("throughput")
+    assert _pragma("journal_mode") == "wal"
+    assert _pragma("synchronous") == 1  # NORMAL
+    assert _pragma("cache_size") == -64000
+
+
+def test_overrides_win_over_profile(restore_profile):
+    db.configure_storage("safe", busy_timeout=1234)
+    assert _pragma("busy_timeout") == 1234
+
+
+def test_unknown_profile_rejected(restore_profile):
+    with pytest.raises(ValueError):
+        db.configure_storage("yolo")
+
+
+def test_app_factory_configures_storage(restore_profile):
+    app = create_app({"DATABASE": db.DATABASE, "DB_PROFILE": "throughput", "JOB_WORKERS": 0})
+    assert app.config["DB_PROFILE"] == "throughput"
+    assert db.STORAGE_PROFILE == "throughput"
+    assert _pragma("synchronous") == 1
+
+
+def test_readers_not_blocked_by_open_write_transaction(restore_profile, seed_books):
+    db.configure_storage("safe")
+    writer = db.get_db_connection()
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("UPDATE books SET available_copies = 0")
+    try:
+        # a WAL reader sees the last committed state without waiting
+        books = db.get_all_books()
+        assert [b["available_copies"] for b in books] == [b["available_copies"] for b in seed_books]
+    finally:
+        writer.rollback()
+        writer.close()
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+import database as db
+import library_service as svc
+from search_index import MATCH_PREFIX, MATCH_WORD, PrefixIndex, word_starts
+
+
+def test_word_starts():
+    assert word_starts("the great-gatsby") == [4, 10]
+    assert word_starts("  war") == [2]
+    assert word_starts("") == []
+
+
+def test_prefix_index_orders_and_counts():
+    index = PrefixIndex()
+    index.add_many(enumerate(["The Great Gatsby", "Great Expectations", "the great gatsby", "Gatsby Returns"]))
+    assert index.suggest("GRE", 5) == [
+        (MATCH_PREFIX, "great expectations", "Great Expectations", 1),
+        (MATCH_WORD, "great gatsby", "The Great Gatsby", 2),
+    ]
+    assert [label for _, _, label, _ in index.suggest("gatsby", 5)] == ["Gatsby Returns", "The Great Gatsby"]
+    assert index.suggest("gre", 1) == index.suggest("gre", 5)[:1]
+    assert index.suggest("zzz", 5) == [] and index.suggest("  ", 5) == []
+
+
+def test_prefix_index_one_by_one_matches_bulk():
+    titles = [f"Title {i % 37} Volume {i}" for i in range(300)]
+    bulk, single = PrefixIndex(), PrefixIndex()
+    bulk.add_many(enumerate(titles))
+    for i, title in enumerate(titles):
+        single.add(i, title)
+    for prefix in ("title 3", "vol", "volume 2", "1"):
+        assert single.suggest(prefix, 10) == bulk.suggest(prefix, 10)
+
+
+@pytest.fixture
+def catalog(add_book):
+    add_book("Harry Potter", "J. K. Rowling", "4000000000001", 1)
+    add_book("The Hobbit", "J. R. R. Tolkien", "4000000000002", 1)
+    add_book("Hard Times", "Charles Dickens", "4000000000003", 1)
+    add_book("Great Expectations", "Charles Dickens", "4000000000004", 1)
+
+
+def test_suggestions_merge_titles_and_authors(catalog):
+    page = svc.get_search_suggestions("ha")
+    assert [s["text"] for s in page["suggestions"]] == ["Hard Times", "Harry Potter"]
+    charles = svc.get_search_suggestions("charles")["suggestions"]
+    assert charles == [{"text": "Charles Dickens", "field": "author", "books": 2}]
+    assert [s["text"] for s in svc.get_search_suggestions("hobbit", "title")["suggestions"]] == ["The Hobbit"]
+    assert svc.get_search_suggestions("hobbit", "author")["suggestions"] == []
+    assert svc.get_search_suggestions("4000", "isbn")["suggestions"] == []
+    assert svc.get_search_suggestions("ha", limit=0)["status"] == "error"
+
+
+def test_suggestions_follow_catalog_writes(catalog, add_book):
+    svc.get_search_suggestions("ha")
+    index = db._suggest_indexes[(db.DATABASE, "title")]["index"]
+    add_book("Hamlet", "William Shakespeare", "4000000000005", 1)
+    assert [s["text"] for s in svc.get_search_suggestions("ha", "title")["suggestions"]] == [
+        "Hamlet", "Hard Times", "Harry Potter"]
+    assert db._suggest_indexes[(db.DATABASE, "title")]["index"] is index
+    conn = sqlite3.connect(db.DATABASE)
+    conn.execute("DELETE FROM books WHERE isbn = '4000000000003'")
+    conn.commit()
+    conn.close()
+    assert [s["text"] for s in svc.get_search_suggestions("ha", "title")["suggestions"]] == ["Hamlet", "Harry Potter"]
+
+
+def test_suggest_api(client, catalog):
+    body = client.get("/api/suggest?q=Ha&limit=1").get_json()
+    assert body == {"query": "Ha", "suggestions": [{"text": "Hard Times", "field": "title", "books": 1}]}
+    assert client.get("/api/suggest?q=").get_json()["suggestions"] == []
+    assert client.get("/api/suggest?q=ha&limit=x").status_code == 400
+    assert client.get("/api/suggest?q=ha&limit=50").status_code == 400
+    assert client.get("/api/suggest?q=ha&type=genre").status_code == 400
+    assert "title" in client.get("/api/stats").get_json()["suggest_index"]
+    assert 'list="suggestions"' in client.get("/search").get_data(as_text=True)